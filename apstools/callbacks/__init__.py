@@ -1,10 +1,16 @@
+from .benchmark import benchmark_callbacks
+from .benchmark import default_benchmark_callbacks
+from .benchmark import synthetic_run_documents
 from .callback_base import FileWriterCallbackBase
+from .dispatcher import CallbackDispatcher
 from .doc_collector import DocumentCollectorCallback
 from .doc_collector import document_contents_callback
+from .image_statistics import ImageStatsCallback
 from .nexus_writer import NEXUS_FILE_EXTENSION
 from .nexus_writer import NEXUS_RELEASE
 from .nexus_writer import NXWriter
 from .nexus_writer import NXWriterAPS
+from .process_writer import FileWriterProcess
 from .scan_signal_statistics import factor_fwhm
 from .scan_signal_statistics import SignalStatsCallback
 from .spec_file_writer import SCAN_ID_RESET_VALUE
@@ -0,0 +1,326 @@
+"""
+Benchmark callbacks with synthetic document streams
+++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+.. autosummary::
+
+   ~benchmark_callbacks
+   ~default_benchmark_callbacks
+   ~synthetic_run_documents
+"""
+
+__all__ = """
+benchmark_callbacks
+default_benchmark_callbacks
+synthetic_run_documents
+""".split()
+
+import logging
+import pathlib
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pyRestTable
+
+from ..utils.memory import rss_mem
+
+logger = logging.getLogger(__name__)
+
+
+def synthetic_run_documents(
+    num_events=1000,
+    num_signals=10,
+    num_baseline=100,
+    image_shape=None,
+    image_path=None,
+    scan_id=1,
+):
+    """
+    Return a list of ``(name, doc)`` documents of a synthetic step scan.
+
+    The scan moves motor ``m1`` through ``num_events`` points and reads
+    ``num_signals`` detector signals (``s000``, ...), each a peak with noise.
+    The *baseline* stream has ``num_baseline`` PVs (``pv0000``, ...), read
+    before and after the scan.  With ``image_shape`` (rows, columns), each
+    event also has an area detector image, written to an ``AD_HDF5`` file
+    in ``image_path`` (default: a new temporary directory), referenced by
+    *resource* and *datum* documents.
+
+    (new in release 1.6.21)
+    """
+    import event_model
+
+    rng = np.random.default_rng(scan_id)
+    signals = [f"s{i:03d}" for i in range(num_signals)]
+    pvs = [f"pv{i:04d}" for i in range(num_baseline)]
+    md = dict(
+        detectors=["det"],
+        motors=["m1"],
+        num_points=num_events,
+        plan_name="scan",
+        plan_type="generator",
+        scan_id=scan_id,
+        title="synthetic benchmark run",
+        hints=dict(dimensions=[[["m1"], "primary"]]),
+    )
+    run = event_model.compose_run(metadata=md)
+    documents = [("start", run.start_doc)]
+
+    def data_key(source, shape=None):
+        return dict(source=source, dtype="array" if shape else "number", shape=list(shape or []))
+
+    def timestamps(keys):
+        t = time.time()
+        return {k: t for k in keys}
+
+    if num_baseline > 0:
+        baseline = run.compose_descriptor(
+            name="baseline",
+            data_keys={pv: data_key(f"PV:{pv}") for pv in pvs},
+            object_keys={pv: [pv] for pv in pvs},
+        )
+        documents.append(("descriptor", baseline.descriptor_doc))
+        values = rng.uniform(0, 100, num_baseline).tolist()
+        baseline_event = dict(data=dict(zip(pvs, values)), timestamps=timestamps(pvs))
+        documents.append(("event", baseline.compose_event(**baseline_event)))
+
+    data_keys = {"m1": data_key("PV:m1")}
+    data_keys.update({s: data_key(f"PV:{s}") for s in signals})
+    hints = {"m1": {"fields": ["m1"]}, "det": {"fields": signals}}
+    if image_shape is not None:
+        data_keys["det_image"] = data_key("PV:det:image", image_shape)
+        data_keys["det_image"]["external"] = "FILESTORE:"
+    primary = run.compose_descriptor(
+        name="primary",
+        data_keys=data_keys,
+        object_keys={"m1": ["m1"], "det": signals + (["det_image"] if image_shape else [])},
+        hints=hints,
+    )
+    documents.append(("descriptor", primary.descriptor_doc))
+
+    x = np.linspace(-1, 1, num_events)
+    centers = rng.uniform(-0.5, 0.5, num_signals)
+    y = 1000 * np.exp(-(((x[None, :] - centers[:, None]) / 0.1) ** 2) / 2)
+    y += rng.uniform(0, 10, y.shape)
+
+    if image_shape is not None:
+        import h5py
+
+        image_path = pathlib.Path(image_path or tempfile.mkdtemp(prefix="apstools-benchmark-"))
+        image_file = image_path / f"images_{scan_id:05d}.h5"
+        rows, columns = np.indices(image_shape)
+        with h5py.File(image_file, "w") as root:
+            ds = root.create_dataset(
+                "/entry/data/data",
+                shape=(num_events, *image_shape),
+                dtype="uint16",
+                chunks=(1, *image_shape),
+            )
+            for i in range(num_events):
+                frame = 1000 * np.exp(-((rows - image_shape[0] / 2) ** 2 + (columns - i % image_shape[1]) ** 2) / 50)
+                ds[i] = frame.astype("uint16")
+        resource = run.compose_resource(
+            spec="AD_HDF5",
+            root=str(image_path),
+            resource_path=image_file.name,
+            resource_kwargs=dict(frame_per_point=1),
+        )
+        documents.append(("resource", resource.resource_doc))
+
+    for i in range(num_events):
+        data = {"m1": float(x[i])}
+        data.update({s: float(y[j, i]) for j, s in enumerate(signals)})
+        filled = {}
+        if image_shape is not None:
+            datum = resource.compose_datum(datum_kwargs=dict(point_number=i))
+            documents.append(("datum", datum))
+            data["det_image"] = datum["datum_id"]
+            filled["det_image"] = False
+        event = primary.compose_event(data=data, timestamps=timestamps(data), filled=filled)
+        documents.append(("event", event))
+
+    if num_baseline > 0:
+        values = rng.uniform(0, 100, num_baseline).tolist()
+        baseline_event = dict(data=dict(zip(pvs, values)), timestamps=timestamps(pvs))
+        documents.append(("event", baseline.compose_event(**baseline_event)))
+
+    documents.append(("stop", run.compose_stop(exit_status="success")))
+    return documents
+
+
+def default_benchmark_callbacks(path):
+    """
+    Dictionary of functions that create the callbacks to be benchmarked.
+
+    Files are written to directory ``path``.
+
+    (new in release 1.6.21)
+    """
+    from .nexus_writer import NXWriter
+    from .nexus_writer import NXWriterAPS
+    from .scan_signal_statistics import SignalStatsCallback
+    from .spec_file_writer import SpecWriterCallback
+
+    path = pathlib.Path(path)
+
+    def nxwriter(writer_class):
+        def make():
+            writer = writer_class()
+            writer.file_name = path / f"{writer_class.__name__}-{time.time_ns()}.hdf"
+            writer.warn_on_missing_content = False
+            return writer
+
+        return make
+
+    def specwriter():
+        filename = path / f"benchmark-{time.time_ns()}.dat"
+        return SpecWriterCallback(filename=filename)
+
+    def signal_stats():
+        stats = SignalStatsCallback()
+        stats.stop_report = False
+        return stats
+
+    return dict(
+        NXWriter=nxwriter(NXWriter),
+        NXWriterAPS=nxwriter(NXWriterAPS),
+        SpecWriterCallback=specwriter,
+        SignalStatsCallback=signal_stats,
+    )
+
+
+def _wait_for_file(callback):
+    """Wait until the callback has finished writing its file(s)."""
+    for method in ("wait_writer", "wait", "flush"):
+        if callable(getattr(callback, method, None)):
+            getattr(callback, method)()
+            return
+
+
+def benchmark_callbacks(documents, callbacks=None, rate=None, path=None, report=True):
+    """
+    Send ``documents`` to each callback and measure its performance.
+
+    Each callback (made new from its function in ``callbacks``) receives
+    all the ``documents`` (such as from :func:`synthetic_run_documents`),
+    as fast as possible or at ``rate`` (documents per second).  Returns a
+    dictionary (keyed by callback name) of results:
+
+    ==================  ====================================================
+    result              description
+    ==================  ====================================================
+    documents           number of documents
+    elapsed             time (s) to send all documents to the callback
+    docs_per_s          documents per second
+    stop_to_file        time (s) from *stop* document until file is written
+    peak_rss            peak resident memory (bytes) of this process
+    rss_increase        increase of peak over starting resident memory
+    ==================  ====================================================
+
+    If ``report`` is ``True``, also print a table of the results.
+
+    PARAMETERS
+
+    documents
+        *list* :
+        ``(name, doc)`` pairs to be sent.
+    callbacks
+        *dict* :
+        Functions (keyed by a name) that create the callback objects (with a
+        ``receiver()`` method).  Default: :func:`default_benchmark_callbacks`
+        writing into ``path``.
+    rate
+        *float* :
+        Documents per second.  (default: ``None``, as fast as possible)
+    path
+        *str* :
+        Directory for files written by the default callbacks.
+        (default: a new temporary directory)
+
+    EXAMPLE::
+
+        from apstools.callbacks import benchmark_callbacks
+        from apstools.callbacks import synthetic_run_documents
+
+        documents = synthetic_run_documents(num_events=10_000, num_signals=50)
+        results = benchmark_callbacks(documents)
+
+    (new in release 1.6.21)
+    """
+    if callbacks is None:
+        path = path or tempfile.mkdtemp(prefix="apstools-benchmark-")
+        callbacks = default_benchmark_callbacks(path)
+
+    results = {}
+    for name, factory in callbacks.items():
+        callback = factory()
+        receiver = getattr(callback, "receiver", callback)
+
+        rss_start = rss_mem().rss
+        peak = dict(rss=rss_start)
+        sampling = threading.Event()
+
+        def sample_rss():
+            while not sampling.wait(0.01):
+                peak["rss"] = max(peak["rss"], rss_mem().rss)
+
+        sampler = threading.Thread(target=sample_rss, daemon=True)
+        sampler.start()
+
+        t_start = time.perf_counter()
+        t_stop = None
+        for i, (key, doc) in enumerate(documents):
+            if rate is not None:
+                delay = t_start + i / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            if key == "stop":
+                t_stop = time.perf_counter()
+            receiver(key, doc)
+        t_sent = time.perf_counter()
+        _wait_for_file(callback)
+        t_done = time.perf_counter()
+
+        sampling.set()
+        sampler.join()
+        peak["rss"] = max(peak["rss"], rss_mem().rss)
+        elapsed = t_sent - t_start
+        results[name] = dict(
+            documents=len(documents),
+            elapsed=elapsed,
+            docs_per_s=len(documents) / elapsed if elapsed > 0 else None,
+            stop_to_file=None if t_stop is None else t_done - t_stop,
+            peak_rss=peak["rss"],
+            rss_increase=peak["rss"] - rss_start,
+        )
+
+    if report:
+        table = pyRestTable.Table()
+        table.labels = "callback documents elapsed,s docs/s stop_to_file,s peak_RSS,MB RSS_increase,MB".split()
+        for name, r in results.items():
+            # fmt: off
+            table.addRow((
+                name,
+                r["documents"],
+                f"{r['elapsed']:.3f}",
+                f"{r['docs_per_s'] or 0:.0f}",
+                "" if r["stop_to_file"] is None else f"{r['stop_to_file']:.3f}",
+                f"{r['peak_rss'] / 2**20:.1f}",
+                f"{r['rss_increase'] / 2**20:.1f}",
+            ))
+            # fmt: on
+        print(table)
+    return results
+
+
+# -----------------------------------------------------------------------------
+# :author:    Pete R. Jemian
+# :email:     jemian@anl.gov
+# :copyright: (c) 2017-2024, UChicago Argonne, LLC
+#
+# Distributed under the terms of the Argonne National Laboratory Open Source License.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
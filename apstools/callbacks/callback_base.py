@@ -4,18 +4,278 @@ Base Class for File Writer Callbacks
 
 .. autosummary::
 
+   ~BufferMemory
+   ~ColumnBuffer
    ~FileWriterCallbackBase
 """
 
 
+import concurrent.futures
+import copy
 import datetime
 import logging
 import pathlib
+import tempfile
+import threading
 
+import numpy as np
 import pyRestTable
 
 logger = logging.getLogger(__name__)
 
+NUMERIC_DTYPES = "array boolean integer number".split()  # descriptor dtypes
+NUMERIC_KINDS = "biuf"  # numpy: boolean, integer, unsigned integer, floating
+# scalar types that can be stored directly, by numpy kind of the column
+SCALAR_TYPES = {
+    "b": (bool, np.bool_),
+    "i": (int, np.int64),
+    "f": (float, int, np.float64),
+}
+
+
+class BufferMemory:
+    """
+    Memory ceiling shared by the :class:`ColumnBuffer` objects of one run.
+
+    When a buffer would grow past ``limit`` (bytes), its values are moved
+    (*spilled*) to a temporary file in ``directory`` (default: the system's
+    temporary directory) and kept there in a ``numpy.memmap``.  Temporary
+    files are deleted when their buffers are closed or discarded.
+    ``limit=None`` means no limit.
+    """
+
+    def __init__(self, limit=None, directory=None):
+        self.limit = limit
+        self.directory = directory
+        self.used = 0  # bytes in RAM
+        self.spilled = 0  # bytes in temporary files
+
+    def release(self, nbytes):
+        """Memory of ``nbytes`` (in RAM) is no longer used."""
+        self.used = max(0, self.used - nbytes)
+
+    def request(self, nbytes):
+        """Reserve ``nbytes`` of RAM.  Return ``False`` if over the limit."""
+        if self.limit is not None and self.used + nbytes > self.limit:
+            return False
+        self.used += nbytes
+        return True
+
+    def temporary_file(self):
+        """Create a new (anonymous) temporary file for spilled values."""
+        directory = None if self.directory is None else str(self.directory)
+        return tempfile.TemporaryFile(prefix="apstools-buffer-", dir=directory)
+
+
+class ColumnBuffer:
+    """
+    Growable column of the values of one data key, kept in a numpy array.
+
+    Numeric data keys (descriptor ``dtype`` of ``number``, ``integer``,
+    ``boolean``, or ``array``) are stored in a numpy array, allocated in
+    advance, which doubles in size when full.  The numpy data type is the
+    descriptor's ``dtype_numpy`` (when available) or that of the first value.
+    The shape of each row is the shape of the first value.  The data type is
+    promoted (such as integer to floating point) as needed.  Other values
+    (strings, external references, ragged arrays, values of mixed type) are
+    kept in a list.
+
+    With a :class:`BufferMemory` ceiling, the numpy array moves to a
+    memory-mapped temporary file when the ceiling is reached.  Either way,
+    ``values`` is a numpy array (``numpy.memmap`` is a subclass).
+
+    .. autosummary::
+
+       ~append
+       ~clear
+       ~extend
+       ~spilled
+       ~values
+    """
+
+    initial_size = 16
+
+    def __init__(self, dtype="number", dtype_numpy=None, memory=None):
+        self.dtype = dtype
+        self.shape = None  # shape of each value, from the first value
+        self._array = None  # allocated with the first value
+        self._file = None  # temporary file, when spilled
+        self._length = 0
+        self._list = None if dtype in NUMERIC_DTYPES else []
+        self._memory = memory
+        self._scalar_types = ()  # fast path for append()
+
+        self._dtype_numpy = None
+        if dtype_numpy:
+            try:
+                self._dtype_numpy = np.dtype(dtype_numpy)
+            except TypeError:
+                pass
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.values, dtype=dtype)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        if self._list is not None:
+            return len(self._list)
+        return self._length
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.values!r})"
+
+    def _accepts(self, dtype, shape):
+        """Can values of this numpy dtype and shape be stored in the array?"""
+        if dtype.kind not in NUMERIC_KINDS:
+            return False
+        if self._array is None:
+            if self._dtype_numpy is not None and self._dtype_numpy.kind in NUMERIC_KINDS:
+                dtype = np.promote_types(self._dtype_numpy, dtype)
+            self.shape = shape
+            self._array = np.empty((0,) + shape, dtype=dtype)
+            self._grow(self.initial_size)
+        elif shape != self.shape:
+            return False
+        else:
+            promoted = np.promote_types(self._array.dtype, dtype)
+            if promoted != self._array.dtype:
+                self._reallocate(len(self._array), promoted)
+        dtype = self._array.dtype
+        if self.shape == () and dtype in ("bool", "int64", "float64"):
+            self._scalar_types = SCALAR_TYPES[dtype.kind]
+        else:
+            self._scalar_types = ()
+        return True
+
+    def _grow(self, size):
+        """Make room for (at least) ``size`` values."""
+        capacity = len(self._array)
+        if size > capacity:
+            capacity = max(size, 2 * capacity, self.initial_size)
+            self._reallocate(capacity, self._array.dtype)
+
+    def _nbytes(self, capacity, dtype):
+        return capacity * int(np.prod(self.shape, dtype=int)) * np.dtype(dtype).itemsize
+
+    def _reallocate(self, capacity, dtype):
+        """Move the values to new storage (RAM or file) of the given size and type."""
+        old = self._array
+        old_nbytes = 0 if self._file is not None else old.nbytes
+        nbytes = self._nbytes(capacity, dtype)
+        in_ram = (
+            self._file is None
+            and (self._memory is None or nbytes == 0 or self._memory.request(nbytes))
+        )
+        if in_ram:
+            array = np.empty((capacity,) + self.shape, dtype=dtype)
+            array[: self._length] = old[: self._length]
+        elif self._file is not None and dtype == old.dtype:
+            # already spilled: grow the file, values stay in place
+            self._file.truncate(nbytes)
+            array = np.memmap(self._file, dtype=dtype, mode="r+", shape=(capacity,) + self.shape)
+            self._memory.spilled += nbytes - old.nbytes
+        else:
+            # spill (or change the data type of spilled values)
+            temporary = self._memory.temporary_file()
+            temporary.truncate(nbytes)
+            array = np.memmap(temporary, dtype=dtype, mode="r+", shape=(capacity,) + self.shape)
+            array[: self._length] = old[: self._length]
+            if self._file is None:
+                logger.debug("Spill %s buffer to temporary file (%d bytes).", self.dtype, nbytes)
+            else:
+                self._memory.spilled -= old.nbytes
+                self._file.close()
+            self._memory.spilled += nbytes
+            self._file = temporary
+        if self._memory is not None:
+            self._memory.release(old_nbytes)
+        self._array = array
+
+    def _to_list(self):
+        """Keep values in a list from now on."""
+        if self._array is None:
+            self._list = []
+        else:
+            self._list = list(np.array(self._array[: self._length]))
+            if self._memory is not None:
+                if self._file is None:
+                    self._memory.release(self._array.nbytes)
+                else:
+                    self._memory.spilled -= self._array.nbytes
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._array = None
+        self._length = 0
+        self._scalar_types = ()
+
+    def append(self, value):
+        """Add one value."""
+        if type(value) in self._scalar_types:
+            if self._length == len(self._array):
+                self._grow(self._length + 1)
+            try:
+                self._array[self._length] = value
+                self._length += 1
+                return
+            except OverflowError:
+                pass  # Python int too large for the numpy array
+        if self._list is None:
+            try:
+                arr = np.asarray(value)
+            except ValueError:  # ragged
+                arr = None
+            if arr is not None and self._accepts(arr.dtype, arr.shape):
+                self._grow(self._length + 1)
+                self._array[self._length] = arr
+                self._length += 1
+                return
+            self._to_list()
+        self._list.append(value)
+
+    def clear(self):
+        """Remove all values (keep the storage)."""
+        self._length = 0
+        if self._list is not None:
+            self._list = []
+
+    def extend(self, values):
+        """Add several values (such as a column from an event page)."""
+        if len(values) == 0:
+            return
+        if self._list is None:
+            try:
+                arr = np.asarray(values)
+            except ValueError:  # ragged
+                arr = None
+            if arr is not None and self._accepts(arr.dtype, arr.shape[1:]):
+                n = len(arr)
+                self._grow(self._length + n)
+                self._array[self._length : self._length + n] = arr
+                self._length += n
+                return
+            self._to_list()
+        self._list.extend(list(values))
+
+    @property
+    def spilled(self):
+        """Are the values kept in a temporary file?"""
+        return self._file is not None
+
+    @property
+    def values(self):
+        """The values: numpy array (a view) or list."""
+        if self._list is not None:
+            return self._list
+        if self._array is None:
+            return []
+        return self._array[: self._length]
+
 
 class FileWriterCallbackBase:
     """
@@ -29,14 +289,37 @@ class FileWriterCallbackBase:
 
     The local buffers are cleared when a start document is received.
     Content is collected here from each document until the stop document.
+    The values (and timestamps) of each data key are collected in a
+    :class:`ColumnBuffer` (a numpy array, for numeric data).  For very long
+    runs, set ``buffer_memory_limit`` to move (*spill*) the buffers to
+    memory-mapped temporary files when that many bytes are in memory.
     The content is written once the stop document is received.
 
 
+    A subclass may write its files in the background (such as when it must
+    wait for files written by an area detector IOC) by calling
+    ``submit_writer()`` from its ``writer()`` method.  The file is written
+    in a bounded pool of worker threads, from a copy of this callback that
+    keeps the content of the run.  The next run can begin while earlier
+    files are still being written.
+
+    ==========================  =====================================================
+    attribute                   description
+    ==========================  =====================================================
+    ``buffer_memory_limit``     bytes of buffered data in memory before spill to file
+    ``buffer_spill_directory``  directory for spilled buffers (default: system temp)
+    ``writer_pool_size``        maximum number of files written at the same time
+    ``writer_queue_depth``      maximum number of runs waiting or writing (blocks)
+    ``max_writer_errors``       failed runs remembered until ``wait_writer()``
+    ==========================  =====================================================
+
     User Interface methods
 
     .. autosummary::
 
        ~receiver
+       ~wait_writer
+       ~wait_writer_plan_stub
 
     Internal methods
 
@@ -44,6 +327,7 @@ class FileWriterCallbackBase:
 
        ~clear
        ~make_file_name
+       ~submit_writer
        ~writer
 
     Document Handler methods
@@ -54,25 +338,38 @@ class FileWriterCallbackBase:
        ~datum
        ~descriptor
        ~event
+       ~event_page
        ~resource
        ~start
        ~stop
     """
 
+    buffer_memory_limit = None
+    buffer_spill_directory = None
     file_extension = "dat"
+    max_writer_errors = 100
+    writer_pool_size = 2
+    writer_queue_depth = 4
     _file_name = None
     _file_path = None
+    _writer_poll_delay = 0.1
 
     # convention: methods written in alphabetical order
 
     def __init__(self, *args, **kwargs):
         """Initialize: clear and reset."""
+        self._writer_errors = {}  # key: run uid, value: exception
+        self._writer_futures = {}  # key: run uid, value: Future
+        self._writer_lock = threading.Lock()
+        self._writer_pool = None
+        self._writer_slots = None
         self.clear()
         self.xref = dict(
             bulk_events=self.bulk_events,
             datum=self.datum,
             descriptor=self.descriptor,
             event=self.event,
+            event_page=self.event_page,
             resource=self.resource,
             start=self.start,
             stop=self.stop,
@@ -97,6 +394,7 @@ class FileWriterCallbackBase:
         delete any saved data from the cache and reinitialize
         """
         self.acquisitions = {}
+        self.buffer_memory = BufferMemory(self.buffer_memory_limit, self.buffer_spill_directory)
         self.detectors = []
         self.exit_status = None
         self.externals = {}
@@ -150,6 +448,101 @@ class FileWriterCallbackBase:
         path = self.file_path or pathlib.Path(".")
         return path / fname
 
+    def submit_writer(self, func, *args, **kwargs):
+        """
+        Call ``func(snapshot, *args, **kwargs)`` in the writer pool.
+
+        ``snapshot`` is a (shallow) copy of this callback, made now, with the
+        content of this run.  Since ``clear()`` replaces (not empties) the
+        buffers, the next run does not change the ``snapshot``.
+
+        Blocks while ``writer_queue_depth`` runs are waiting or writing.
+        Returns the ``concurrent.futures.Future`` for this run.
+        """
+        if self._writer_pool is None:
+            self._writer_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(1, self.writer_pool_size),
+                thread_name_prefix=self.__class__.__name__,
+            )
+            self._writer_slots = threading.BoundedSemaphore(max(1, self.writer_queue_depth))
+
+        uid = self.uid
+
+        def write(snapshot):
+            try:
+                return func(snapshot, *args, **kwargs)
+            except Exception as exc:
+                # Record it before the future is done, for wait_writer().
+                logger.error("Writer for run %s failed: %r", uid, exc)
+                with self._writer_lock:
+                    self._writer_errors.pop(uid, None)
+                    self._writer_errors[uid] = exc
+                    # Forget the oldest failures that nobody waited for.
+                    for old in list(self._writer_errors)[: -max(1, self.max_writer_errors)]:
+                        self._writer_errors.pop(old)
+                raise
+
+        self._writer_slots.acquire()  # backpressure
+        snapshot = copy.copy(self)
+        try:
+            future = self._writer_pool.submit(write, snapshot)
+        except Exception:
+            self._writer_slots.release()
+            raise
+        with self._writer_lock:
+            self._writer_futures[uid] = future
+
+        def finished(future):
+            self._writer_slots.release()
+            with self._writer_lock:
+                if self._writer_futures.get(uid) is future:
+                    self._writer_futures.pop(uid)
+
+        future.add_done_callback(finished)
+        return future
+
+    def _pending_writers(self, uid=None):
+        """List of (not finished) writer futures, for all runs or just ``uid``."""
+        with self._writer_lock:
+            futures = dict(self._writer_futures)
+        if uid is not None:
+            futures = {k: v for k, v in futures.items() if k == uid}
+        return [future for future in futures.values() if not future.done()]
+
+    @property
+    def _writer_active(self):
+        """Is any writer waiting or writing?"""
+        return len(self._pending_writers()) > 0
+
+    def _pop_writer_errors(self, uid=None):
+        """Remove & return the writer exceptions, for all runs or just ``uid``."""
+        with self._writer_lock:
+            uids = list(self._writer_errors) if uid is None else [uid]
+            return {k: self._writer_errors.pop(k) for k in uids if k in self._writer_errors}
+
+    def wait_writer(self, uid=None):
+        """
+        Wait for the writer(s) to finish.  For interactive use (Not in a plan).
+
+        Wait for all runs (default) or only the run with the given ``uid``.
+        Returns a dictionary (key: run uid) of the exceptions of writers that
+        failed.  These are reported only once.
+        """
+        concurrent.futures.wait(self._pending_writers(uid))
+        return self._pop_writer_errors(uid)
+
+    def wait_writer_plan_stub(self, uid=None):
+        """
+        Wait for the writer(s) to finish.  Use in a plan (with RunEngine).
+
+        Wait for all runs (default) or only the run with the given ``uid``.
+        """
+        import bluesky.plan_stubs as bps
+
+        while len(self._pending_writers(uid)) > 0:
+            yield from bps.sleep(self._writer_poll_delay)
+        return self._pop_writer_errors(uid)
+
     def writer(self):
         """
         print summary of run as diagnostic
@@ -212,9 +605,9 @@ class FileWriterCallbackBase:
         """Deprecated. Use EventPage instead."""
         if not self.scanning:
             return
-        logger.info("not handled yet")
-        logger.info(doc)
-        logger.info("-" * 40)
+        for events in doc.values():
+            for event in events:
+                self.event(event)
 
     def datum(self, doc):
         """
@@ -263,9 +656,19 @@ class FileWriterCallbackBase:
             dd["upper_ctrl_limit"] = entry.get("upper_ctrl_limit", "")
             dd["precision"] = entry.get("precision", 0)
             dd["object_name"] = entry.get("object_name", k)
-            dd["data"] = []  # entry data goes here
-            dd["time"] = []  # entry time stamps here
             dd["external"] = entry.get("external") is not None
+            # entry data goes here
+            if dd["external"]:
+                dd["data"] = ColumnBuffer(dtype="external")  # references
+            else:
+                # fmt: off
+                dd["data"] = ColumnBuffer(
+                    dtype=dd["dtype"],
+                    dtype_numpy=entry.get("dtype_numpy"),
+                    memory=self.buffer_memory,
+                )
+                # fmt: on
+            dd["time"] = ColumnBuffer(memory=self.buffer_memory)  # time stamps here
             # logger.debug("dd %s: %s", k, data[k])
 
     def event(self, doc):
@@ -289,6 +692,27 @@ class FileWriterCallbackBase:
                     data["data"].append(v)
                     data["time"].append(doc["timestamps"][k])
 
+    def event_page(self, doc):
+        """
+        several "rows" of data (columns of values)
+
+        Each column is added to its buffer in one step.
+        """
+        if not self.scanning:
+            return
+        descriptor_uid = doc["descriptor"]
+
+        # gather the data by streams
+        descriptor = self.acquisitions.get(descriptor_uid)
+        if descriptor is not None:
+            for k, values in doc["data"].items():
+                data = descriptor["data"].get(k)
+                if data is None:
+                    print(f"entry key {k} not found in descriptor of {descriptor['stream']}")
+                else:
+                    data["data"].extend(values)
+                    data["time"].extend(doc["timestamps"][k])
+
     def resource(self, doc):
         """
         like a descriptor, but for data recorded outside of bluesky
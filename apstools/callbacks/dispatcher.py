@@ -0,0 +1,262 @@
+"""
+Dispatch documents to callbacks in a worker thread
++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+.. autosummary::
+
+   ~CallbackDispatcher
+"""
+
+__all__ = """
+CallbackDispatcher
+""".split()
+
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+EVENT_DOCUMENTS = "event event_page bulk_events".split()
+OVERFLOW_POLICIES = "block drop raise".split()
+
+
+class CallbackDispatcher:
+    """
+    Send documents to callbacks, in order, from a worker thread.
+
+    .. index:: Bluesky Callback; CallbackDispatcher
+
+    The RunEngine calls its callbacks in its own thread, so the time spent
+    in a callback (such as formatting a SPEC scan or writing a NeXus file)
+    adds to the dead time of a plan.  Subscribe the callbacks through a
+    dispatcher instead.  The ``receiver()`` only puts each document on a
+    (bounded) queue.  A worker thread sends the documents, in order, to
+    each callback.
+
+    EXAMPLE::
+
+        from apstools.callbacks import CallbackDispatcher
+        from apstools.callbacks import NXWriter
+        from apstools.callbacks import SpecWriterCallback
+
+        nxwriter = NXWriter()
+        specwriter = SpecWriterCallback()
+        dispatcher = CallbackDispatcher(nxwriter.receiver, specwriter.receiver)
+        RE.subscribe(dispatcher.receiver)
+
+        RE(bp.count([det]))
+        dispatcher.flush()  # wait for the callbacks to finish
+        print(dispatcher.report())
+
+    In a plan, use ``yield from dispatcher.flush_plan_stub()``.
+
+    When the queue is full, the ``overflow`` policy applies:
+
+    =========  ====================================================
+    overflow   description
+    =========  ====================================================
+    block      (default) wait for space in the queue
+    drop       skip event documents (counted in ``dropped``), wait
+               for space for the other documents
+    raise      raise ``queue.Full``
+    =========  ====================================================
+
+    An exception in a callback is logged and recorded (``errors``, the
+    most recent ones).  The other callbacks continue to receive documents.
+
+    PARAMETERS
+
+    callbacks
+        *callable* :
+        Callbacks (each with arguments: ``name, doc``) to receive the
+        documents.  More callbacks can be added with ``subscribe()``.
+    queue_size
+        *int* :
+        Maximum number of documents waiting in the queue.  (default: 10,000)
+    overflow
+        *str* :
+        What to do when the queue is full.  (default: ``"block"``)
+
+    .. autosummary::
+
+       ~receiver
+       ~subscribe
+       ~flush
+       ~flush_plan_stub
+       ~report
+       ~close
+
+    (new in release 1.6.21)
+    """
+
+    max_errors = 100
+    poll_delay = 0.05
+
+    def __init__(self, *callbacks, queue_size=10_000, overflow="block"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown {overflow=!r}.  Use one of: {' '.join(OVERFLOW_POLICIES)}")
+        self.callbacks = []
+        self.overflow = overflow
+        self.dropped = 0
+        self.errors = []  # (callback name, document name, exception)
+        self.latency = {}  # key: callback name, value: dict of counters
+        self.queue_wait = dict(count=0, total=0, max=0)
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        for callback in callbacks:
+            self.subscribe(callback)
+
+    def __repr__(self):
+        names = [self._name(cb) for cb in self.callbacks]
+        return f"{self.__class__.__name__}(callbacks={names}, queued={self._queue.qsize()})"
+
+    @staticmethod
+    def _name(callback):
+        """Name of the callback (for the report)."""
+        owner = getattr(callback, "__self__", None)
+        name = getattr(callback, "__qualname__", None) or repr(callback)
+        if owner is not None:
+            name = f"{owner.__class__.__name__}.{callback.__name__}"
+        return name
+
+    def subscribe(self, callback):
+        """Add a callback (arguments: ``name, doc``)."""
+        name = self._name(callback)
+        if name in self.latency:
+            name = f"{name}-{len(self.callbacks)}"  # unique name
+        with self._lock:
+            self.callbacks.append((name, callback))
+            self.latency[name] = dict(count=0, total=0, max=0)
+
+    def receiver(self, key, document):
+        """
+        bluesky callback: put the document on the queue
+
+        .. index:: Bluesky Callback; CallbackDispatcher.receiver
+        """
+        self._start_thread()
+        item = (key, document, time.time())
+        if self.overflow == "block":
+            self._queue.put(item)
+        elif self.overflow == "raise":
+            self._queue.put(item, block=False)
+        else:  # drop
+            try:
+                self._queue.put(item, block=key not in EVENT_DOCUMENTS)
+            except queue.Full:
+                self.dropped += 1
+                logger.warning("Dispatcher queue is full, dropped %s document.", key)
+
+    def _start_thread(self):
+        """Start the worker thread (if not running)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(
+            target=self._worker,
+            name=self.__class__.__name__,
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _worker(self):
+        """Send each document from the queue to the callbacks."""
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    break
+                key, document, t_received = item
+                self._count(self.queue_wait, time.time() - t_received)
+                with self._lock:
+                    callbacks = list(self.callbacks)
+                for name, callback in callbacks:
+                    t0 = time.time()
+                    try:
+                        callback(key, document)
+                    except Exception as exc:
+                        logger.exception("Callback %s failed with %s document.", name, key)
+                        self.errors.append((name, key, exc))
+                        del self.errors[: -self.max_errors]
+                    self._count(self.latency[name], time.time() - t0)
+            finally:
+                self._queue.task_done()
+
+    @staticmethod
+    def _count(counters, elapsed):
+        counters["count"] += 1
+        counters["total"] += elapsed
+        counters["max"] = max(counters["max"], elapsed)
+
+    @property
+    def pending(self):
+        """Number of documents not yet sent to all callbacks."""
+        return self._queue.unfinished_tasks
+
+    def flush(self, timeout=None):
+        """
+        Wait until the callbacks have received all documents.  (Not in a plan.)
+
+        Returns ``True`` if all the documents have been sent.
+        """
+        t_end = None if timeout is None else time.time() + timeout
+        while self.pending > 0:
+            if self._thread is None or not self._thread.is_alive():
+                logger.error("Dispatcher worker thread is not running.")
+                return False
+            if t_end is not None and time.time() >= t_end:
+                return False
+            time.sleep(self.poll_delay)
+        return True
+
+    def flush_plan_stub(self):
+        """Wait until the callbacks have received all documents.  Use in a plan."""
+        import bluesky.plan_stubs as bps
+
+        while self.pending > 0:
+            if self._thread is None or not self._thread.is_alive():
+                logger.error("Dispatcher worker thread is not running.")
+                break
+            yield from bps.sleep(self.poll_delay)
+
+    def report(self):
+        """Dictionary with the queue and latency (seconds) counters."""
+
+        def summary(counters):
+            count = counters["count"]
+            return dict(
+                count=count,
+                mean=counters["total"] / count if count else None,
+                max=counters["max"],
+                total=counters["total"],
+            )
+
+        return dict(
+            queued=self._queue.qsize(),
+            dropped=self.dropped,
+            errors=len(self.errors),
+            queue_wait=summary(self.queue_wait),
+            callbacks={name: summary(c) for name, c in self.latency.items()},
+        )
+
+    def close(self, timeout=None):
+        """Send the remaining documents, then end the worker thread."""
+        if self._thread is None:
+            return
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+        self._thread = None
+
+
+# -----------------------------------------------------------------------------
+# :author:    Pete R. Jemian
+# :email:     jemian@anl.gov
+# :copyright: (c) 2017-2024, UChicago Argonne, LLC
+#
+# Distributed under the terms of the Argonne National Laboratory Open Source License.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
@@ -8,7 +8,12 @@ Document Collector
    ~document_contents_callback
 """
 
+import collections
+import json
 import logging
+import pathlib
+
+import numpy as np
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
@@ -23,6 +28,15 @@ def document_contents_callback(key, doc):
         print(f"\t{k}\t{v}")
 
 
+def _json_default(obj):
+    """Make numpy (and other) objects JSON serializable."""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return repr(obj)
+
+
 class DocumentCollectorCallback(object):
     """
     Bluesky callback to collect *all* documents from most-recent plan
@@ -41,22 +55,96 @@ class DocumentCollectorCallback(object):
         print(doc_collector.uids)
         print(doc_collector.documents["stop"])
 
+    .. rubric:: Journal mode
+
+    To collect documents for a long time (such as for diagnostics), give
+    a ``journal`` directory.  Then, all documents are written to a journal
+    of JSON-lines files (one document per line) and memory use is bounded:
+
+    * ``documents`` keeps only the *start* and *stop* documents of the
+      most recent run.
+    * ``uids`` and ``recent`` keep only the ``ring_size`` most recent
+      uids and ``(name, document)`` pairs.
+    * A journal file is closed once it is larger than ``journal_file_bytes``.
+      Only the ``journal_files`` most recent files are kept.
+
+    Documents in the journal are found by uid (``get_document()``), or by
+    type and run (``get_documents()``), from an index of file offsets.
+    ``runs`` has, for each run, the number of each type of document.
+
+    EXAMPLE::
+
+        doc_collector = DocumentCollectorCallback(journal="/tmp/journal")
+        RE.subscribe(doc_collector.receiver)
+        ...
+        doc_collector.get_document(uid)
+        doc_collector.get_documents("stop")
+
+    PARAMETERS
+
+    journal
+        *str* or *pathlib.Path* :
+        (optional) Directory for the journal files.  (default: ``None``,
+        keep all documents of the most-recent run in memory)
+    ring_size
+        *int* :
+        Journal mode: number of recent documents kept in memory.
+        (default: 1000)
+    journal_file_bytes
+        *int* :
+        Journal mode: start a new journal file after this size.
+        (default: 64 MiB)
+    journal_files
+        *int* :
+        Journal mode: number of journal files to keep.  (default: 8)
+
+    .. autosummary::
+
+       ~receiver
+       ~get_document
+       ~get_documents
+       ~close
+
+    (journal mode new in release 1.6.21)
     """
 
-    data_event_names = "descriptor event resource datum bulk_events".split()
+    data_event_names = "descriptor event event_page resource datum bulk_events".split()
+    journal_prefix = "journal-"
+    journal_suffix = ".jsonl"
 
-    def __init__(self):
+    def __init__(self, journal=None, ring_size=1000, journal_file_bytes=64 * 2**20, journal_files=8):
         self.documents = {}  # key: name, value: document
         self.uids = []  # chronological list of UIDs as-received
+        self.journal = None if journal is None else pathlib.Path(journal)
+        self.journal_file_bytes = journal_file_bytes
+        self.journal_files = journal_files
+        self.recent = collections.deque(maxlen=ring_size)
+        self.runs = {}  # key: run uid, value: dict
+        self._index = {}  # key: uid, value: (name, location)
+        self._type_index = {}  # key: name, value: deque of (location, run uid)
+        self._file = None  # open journal file
+        self._file_number = 0
+        self._run_uid = None
+        if self.journal is not None:
+            self.journal.mkdir(parents=True, exist_ok=True)
+            self.uids = collections.deque(maxlen=ring_size)
+            numbers = [n for n, _p in self._journal_paths()]
+            self._file_number = max(numbers, default=0)
 
     def receiver(self, key, document):
         """keep all documents from recent plan in memory"""
         token = document.get("uid") or document.get("datum_id")
         if token is None:
             raise KeyError("No uid in '{}' document".format(key))
-        self.uids.append(token)
+        if isinstance(token, list):  # event_page: one uid per row
+            self.uids.extend(token)
+        else:
+            self.uids.append(token)
         logger = logging.getLogger(__name__)
         logger.debug("%s document  uid=%s", key, str(token))  # lgtm [py/clear-text-logging-sensitive-data]
+        if self.journal is not None:
+            self._journal_receiver(key, document, token)
+            return
         if key == "start":
             self.documents = {key: document}
         elif key in self.data_event_names:
@@ -77,6 +165,125 @@ class DocumentCollectorCallback(object):
             self.documents[key].append(document)
         return
 
+    def _journal_receiver(self, key, document, token):
+        """Journal mode: write the document, keep only a little in memory."""
+        location = self._journal_write(key, document)
+        self.recent.append((key, document))
+        for uid in token if isinstance(token, list) else [token]:
+            self._index[uid] = (key, location)
+
+        if key == "start":
+            self.documents = {key: document}
+            self._run_uid = token
+            self.runs[token] = dict(start=location, stop=None, counts={})
+        run = self.runs.get(self._run_uid)
+        self._type_index.setdefault(key, collections.deque()).append((location, self._run_uid))
+        if run is not None:
+            run["counts"][key] = run["counts"].get(key, 0) + 1
+        if key == "stop":
+            self.documents[key] = document
+            if run is not None:
+                run["stop"] = location
+            self._file.flush()
+            print("exit status:", document["exit_status"])
+            for item in self.data_event_names:
+                if run is not None and item in run["counts"]:
+                    print(f"# {run['counts'][item]}(s):")
+
+    def _journal_path(self, number):
+        return self.journal / f"{self.journal_prefix}{number:06d}{self.journal_suffix}"
+
+    def _journal_paths(self):
+        """(number, path) of the journal files, oldest first."""
+        paths = []
+        for path in self.journal.glob(f"{self.journal_prefix}*{self.journal_suffix}"):
+            try:
+                number = int(path.name[len(self.journal_prefix) : -len(self.journal_suffix)])
+            except ValueError:
+                continue
+            paths.append((number, path))
+        return sorted(paths)
+
+    def _journal_write(self, key, document):
+        """Write one document to the journal.  Return its location."""
+        if self._file is None:
+            self._file_number += 1
+            self._file = open(self._journal_path(self._file_number), "ab")
+        line = json.dumps(dict(name=key, doc=document), default=_json_default).encode("utf8") + b"\n"
+        offset = self._file.tell()
+        self._file.write(line)
+        if offset + len(line) >= self.journal_file_bytes:
+            self._journal_rotate()
+        return (self._file_number, offset, len(line))
+
+    def _journal_rotate(self):
+        """Close the journal file, remove the oldest files."""
+        self.close()
+        paths = self._journal_paths()
+        removed = set()
+        keep = max(1, self.journal_files - 1)  # and the next file
+        for number, path in paths[: max(0, len(paths) - keep)]:
+            path.unlink()
+            removed.add(number)
+        if len(removed) == 0:
+            return
+        self._index = {k: v for k, v in self._index.items() if v[1][0] not in removed}
+        for entries in self._type_index.values():
+            while len(entries) > 0 and entries[0][0][0] in removed:
+                entries.popleft()
+        self.runs = {k: v for k, v in self.runs.items() if v["start"][0] not in removed}
+
+    def _journal_read(self, location):
+        """Read the (name, document) at this location of the journal."""
+        number, offset, length = location
+        if self._file is not None and number == self._file_number:
+            self._file.flush()
+        with open(self._journal_path(number), "rb") as f:
+            f.seek(offset)
+            content = json.loads(f.read(length))
+        return content["name"], content["doc"]
+
+    def close(self):
+        """Journal mode: close the journal file (a new one is started when needed)."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def get_document(self, uid):
+        """
+        Return the ``(name, document)`` with this ``uid`` (or ``datum_id``).
+
+        For an event in an *event_page*, the page is returned.  Raises
+        ``KeyError`` if not found.  (new in release 1.6.21)
+        """
+        if self.journal is None:
+            for key, docs in self.documents.items():
+                for doc in docs if isinstance(docs, list) else [docs]:
+                    token = doc.get("uid") or doc.get("datum_id")
+                    if uid == token or (isinstance(token, list) and uid in token):
+                        return key, doc
+            raise KeyError(uid)
+        return self._journal_read(self._index[uid][1])
+
+    def get_documents(self, key, run_uid=None):
+        """
+        Return list of the documents of type ``key`` (such as ``"stop"``).
+
+        Optionally, only those of the run with ``run_uid``.
+        In journal mode, only documents in the journal are returned.
+        (new in release 1.6.21)
+        """
+        if self.journal is None:
+            docs = self.documents.get(key, [])
+            if run_uid is not None and self.documents.get("start", {}).get("uid") != run_uid:
+                return []
+            return list(docs) if isinstance(docs, list) else [docs]
+        return [
+            self._journal_read(location)[1]
+            for location, run in self._type_index.get(key, [])
+            if run_uid is None or run == run_uid
+        ]
+
 
 # -----------------------------------------------------------------------------
 # :author:    Pete R. Jemian
@@ -0,0 +1,373 @@
+"""
+Live statistics of area detector images during a run.
+=====================================================
+
+.. autosummary::
+
+    ~ImageStatsCallback
+"""
+
+__all__ = """
+ImageStatsCallback
+""".split()
+
+import concurrent.futures
+import logging
+import pathlib
+import threading
+import time
+
+import numpy as np
+
+from ..utils.image_analysis import image_statistics
+
+logger = logging.getLogger(__name__)
+logger.info(__file__)
+
+
+class ImageStatsCallback:
+    """
+    Callback: Compute statistics of each new area detector image.
+
+    .. index:: Bluesky Callback; ImageStatsCallback
+
+    Subscribe the ``receiver()`` method.  For each *event* (or each row of an
+    *event_page*) in the ``data_stream``, the image is read and its
+    statistics (see :func:`~apstools.utils.image_analysis.image_statistics`:
+    centroid, sigma, peak position & maximum, total, ROI sums) are computed
+    with numpy in a pool of worker threads.  The RunEngine is not blocked.
+
+    The image is found (in this order):
+
+    * from ``frame_source()``, if provided (such as a function that reads
+      the image plugin of the area detector)
+    * in the event data, if the image array is there
+    * from the external file (``AD_HDF5`` resource/datum documents)
+
+    Results (dictionaries, in order of ``seq_num``) are kept in memory
+    (``results``).  A feedback plan can use ``latest`` or ``on_result``.
+    If ``publish`` is a callback (``publish(name, doc)``), the results are
+    also sent, in order, as *descriptor* and *event* documents of an
+    ``image_stats`` stream of the run.  These documents are sent while the
+    run is in progress and, at the latest, from the *stop* document of the
+    run (before ``publish`` receives it, if ``publish`` is subscribed after
+    this callback).  The *stop* document waits, at most, ``stop_timeout``
+    for the images still being analyzed.  Their results are kept (call
+    ``wait()``) but not published.
+
+    When ``max_pending`` images are waiting for analysis, the next images
+    are skipped (and counted in ``dropped``) so the RunEngine never waits.
+
+    EXAMPLE::
+
+        from apstools.callbacks import ImageStatsCallback
+
+        image_stats = ImageStatsCallback()
+        image_stats.rois = dict(beam=(500, 400, 100, 100))
+        RE.subscribe(image_stats.receiver)
+
+        uid, = RE(bp.count([adsimdet], num=100, delay=0.1))
+        image_stats.wait()
+        print(image_stats.latest)
+
+    .. rubric:: Public API
+    .. autosummary::
+
+        ~receiver
+        ~wait
+        ~latest
+        ~data_stream
+        ~image_key
+        ~rois
+        ~max_workers
+        ~max_pending
+        ~stop_timeout
+        ~frame_source
+        ~on_result
+        ~publish
+
+    .. rubric:: Internal API
+    .. autosummary::
+
+        ~clear
+        ~start
+        ~descriptor
+        ~resource
+        ~datum
+        ~event
+        ~event_page
+        ~stop
+        ~read_frame
+
+    (new in release 1.6.21)
+    """
+
+    data_stream: str = "primary"
+    """RunEngine document stream with the images."""
+
+    image_key: str = None
+    """Name of the image in the data stream.  (default: first array of 2 or more dimensions)"""
+
+    rois: dict = {}
+    """Regions of interest (``name: (min_x, min_y, size_x, size_y)``) to be summed."""
+
+    max_workers: int = 2
+    """Number of worker threads."""
+
+    max_pending: int = 8
+    """Skip new images while this many are waiting for analysis."""
+
+    stop_timeout: float = 2
+    """Time (s) the *stop* document waits for images still being analyzed."""
+
+    frame_source: object = None
+    """(optional) Function that returns the current image (a 2-D array)."""
+
+    on_result: object = None
+    """(optional) Function called (from a worker thread) with each result."""
+
+    publish: object = None
+    """(optional) Callback to receive the ``image_stats`` stream documents."""
+
+    stream_name: str = "image_stats"
+    """Name of the stream sent to ``publish``."""
+
+    read_timeout: float = 10
+    """Time (s) to wait for an image to be available in its file."""
+
+    read_retry_delay: float = 0.1
+    """Time (s) between attempts to read an image from its file."""
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+        self.clear()
+
+    def __repr__(self):
+        args = f"image_key={self._image_key!r}, results={len(self.results)}"
+        return f"{self.__class__.__name__}({args})"
+
+    def clear(self):
+        """Clear the internal memory for the next run."""
+        self.results = []  # results of the run, in seq_num order
+        self.dropped = 0  # images skipped: too many pending
+        self.errors = []  # images that could not be analyzed
+        self._datums = {}
+        self._descriptor_uid = None
+        self._image_key = self.image_key
+        self._pending = {}  # key: seq_num, value: future
+        self._published = None  # ComposeDescriptorBundle of the derived stream
+        self._resources = {}
+        self._scanning = False
+        self._start_doc = None
+
+    @property
+    def latest(self):
+        """Most recent result (``None`` if no results yet)."""
+        with self._lock:
+            return self.results[-1] if len(self.results) > 0 else None
+
+    def start(self, doc):
+        """Receives 'start' documents from the RunEngine."""
+        if self._scanning:
+            self.wait(timeout=self.stop_timeout)
+        self.clear()
+        self._scanning = True
+        self._start_doc = doc
+
+    def descriptor(self, doc):
+        """Receives 'descriptor' documents from the RunEngine."""
+        if not self._scanning or doc["name"] != self.data_stream:
+            return
+        if self._image_key is None:
+            for key, data_key in doc["data_keys"].items():
+                if len(data_key.get("shape") or []) >= 2:
+                    self._image_key = key
+                    break
+        if self._image_key not in doc["data_keys"]:
+            logger.warning("No image %r in the %r stream.", self._image_key, self.data_stream)
+            return
+        self._descriptor_uid = doc["uid"]
+
+    def resource(self, doc):
+        """Receives 'resource' documents from the RunEngine."""
+        self._resources[doc["uid"]] = doc
+
+    def datum(self, doc):
+        """Receives 'datum' documents from the RunEngine."""
+        self._datums[doc["datum_id"]] = doc
+
+    def event(self, doc):
+        """Receives 'event' documents from the RunEngine."""
+        if not self._scanning or doc["descriptor"] != self._descriptor_uid:
+            return
+        self._submit(doc["seq_num"], doc["time"], doc["data"][self._image_key])
+
+    def event_page(self, doc):
+        """Receives 'event_page' documents from the RunEngine."""
+        if not self._scanning or doc["descriptor"] != self._descriptor_uid:
+            return
+        for seq_num, t, value in zip(doc["seq_num"], doc["time"], doc["data"][self._image_key]):
+            self._submit(seq_num, t, value)
+
+    def stop(self, doc):
+        """Receives 'stop' documents from the RunEngine."""
+        if not self._scanning:
+            return
+        if not self.wait(timeout=self.stop_timeout):
+            logger.warning(
+                "End of run: %d image(s) still being analyzed (seq_num: %s), not published.",
+                len(self._pending),
+                sorted(self._pending),
+            )
+        self._scanning = False
+
+    def receiver(self, key, document):
+        """Client method used to subscribe to the RunEngine."""
+        handlers = "start stop descriptor event event_page resource datum".split()
+        if key in handlers:
+            getattr(self, key)(document)
+        else:
+            logger.debug("%s: unhandled document type: %s", self.__class__.__name__, key)
+
+    def read_frame(self, value):
+        """
+        Return the image (a numpy array) for this event ``value``.
+
+        ``value`` is the image or the ``datum_id`` of the image in an
+        external file.  Override in a subclass for other file formats.
+        """
+        if not isinstance(value, str):
+            return np.asarray(value)
+
+        import h5py
+
+        datum = self._datums[value]
+        resource = self._resources[datum["resource"]]
+        if resource["spec"] not in ("AD_HDF5",):
+            raise ValueError(f'{value}: spec {resource["spec"]} not handled')
+        fname = pathlib.Path(resource["root"]) / resource["resource_path"]
+        frames = resource["resource_kwargs"].get("frame_per_point", 1)
+        first = datum["datum_kwargs"].get("point_number", 0) * frames
+
+        t0 = time.time()
+        while True:
+            try:
+                with h5py.File(fname, "r", swmr=True) as root:
+                    # sum of all the frames of this point
+                    return root["/entry/data/data"][first : first + frames].sum(axis=0)
+            except (OSError, KeyError, ValueError):
+                if time.time() - t0 > self.read_timeout:
+                    raise
+                time.sleep(self.read_retry_delay)
+
+    def _analyze(self, seq_num, timestamp, value):
+        """Read the image and compute its statistics.  (worker thread)"""
+        t0 = time.time()
+        frame = self.read_frame(value)
+        result = image_statistics(frame, self.rois)
+        result.update(
+            seq_num=seq_num,
+            time=timestamp,
+            image_key=self._image_key,
+            elapsed=time.time() - t0,
+        )
+        if self.on_result is not None:
+            self.on_result(result)
+        return result
+
+    def _submit(self, seq_num, timestamp, value):
+        """Analyze the image in a worker thread (unless too busy)."""
+        self._collect()
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            logger.warning("Image analysis too slow, skipped seq_num=%d.", seq_num)
+            return
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="ImageStats",
+            )
+        if isinstance(value, str) and self.frame_source is None:
+            if value not in self._datums:
+                logger.warning("Datum %r (seq_num=%d) not found.", value, seq_num)
+                return
+        elif self.frame_source is not None:
+            # Read the image now, before the detector acquires the next one.
+            value = np.asarray(self.frame_source())
+        self._pending[seq_num] = self._executor.submit(self._analyze, seq_num, timestamp, value)
+
+    def _collect(self, timeout=0):
+        """Keep the results (in order) of the images analyzed so far."""
+        t_end = None if timeout is None else time.time() + timeout
+        for seq_num in sorted(self._pending):
+            future = self._pending[seq_num]
+            remaining = None if t_end is None else max(0, t_end - time.time())
+            try:
+                result = future.result(timeout=remaining)
+            except concurrent.futures.TimeoutError:
+                break  # Keep results in order.
+            except Exception as exc:
+                logger.error("Could not analyze image seq_num=%d: %s", seq_num, exc)
+                self.errors.append((seq_num, repr(exc)))
+                result = None
+            del self._pending[seq_num]
+            if result is not None:
+                with self._lock:
+                    self.results.append(result)
+                if self._scanning:  # Not after the stop document.
+                    self._publish(result)
+
+    def _publish(self, result):
+        """Send the result as an event of the derived stream."""
+        if self.publish is None:
+            return
+        import event_model
+
+        data = dict(
+            total=result["total"],
+            centroid_x=result["centroid"][0],
+            centroid_y=result["centroid"][1],
+            sigma_x=result["sigma"][0],
+            sigma_y=result["sigma"][1],
+            peak_x=result["peak_position"][0],
+            peak_y=result["peak_position"][1],
+            max_y=result["max_y"],
+            **{f"roi_{k}": v for k, v in result["roi_sums"].items()},
+        )
+        if self._published is None:
+            source = f"{self.__class__.__name__}:{self._image_key}"
+            self._published = event_model.compose_descriptor(
+                start=self._start_doc,
+                streams={},
+                event_counters={},
+                name=self.stream_name,
+                data_keys={k: dict(source=source, dtype="number", shape=[]) for k in data},
+            )
+            self.publish("descriptor", self._published.descriptor_doc)
+        event = self._published.compose_event(
+            data={k: (np.nan if v is None else v) for k, v in data.items()},
+            timestamps={k: result["time"] for k in data},
+            seq_num=result["seq_num"],
+        )
+        self.publish("event", event)
+
+    def wait(self, timeout=None):
+        """
+        Wait for analysis of all the images received so far.
+
+        Returns ``True`` if all have been analyzed (before ``timeout`` s).
+        """
+        self._collect(timeout=timeout)
+        return len(self._pending) == 0
+
+
+# -----------------------------------------------------------------------------
+# :author:    Pete R. Jemian
+# :email:     jemian@anl.gov
+# :copyright: (c) 2017-2024, UChicago Argonne, LLC
+#
+# Distributed under the terms of the Argonne National Laboratory Open Source License.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
@@ -8,6 +8,7 @@ NeXus File Writer Callbacks
    ~NXWriterAPS
 """
 
+import concurrent.futures
 import datetime
 import json
 import logging
@@ -35,9 +36,11 @@ class NXWriter(FileWriterCallbackBase):
 
     .. note::
         If you use ``NXWriter``, you must wait for the `writer()` method to
-        finish before proceeding with the next acquisition or processing.  (The
-        `writer()` method is launched in a background thread to complete once
-        all readable assets are available, potentially even after the run ends.)
+        finish before reading the file.  (The file is written in a background
+        thread to complete once all readable assets are available, potentially
+        even after the run ends.)  The next run can start before the file of
+        the previous run is finished.  Wait for all runs (default) or pass the
+        ``uid`` of a specific run.
 
         See the table below for which wait method to call.
 
@@ -54,19 +57,34 @@ class NXWriter(FileWriterCallbackBase):
         # ...
         run = cat.v2[-1]  # for additional processing
 
+    Streaming mode (write the data streams as the events arrive)::
+
+        nxwriter = NXWriter()
+        nxwriter.streaming = True  # default: False
+        nxwriter.streaming_batch_size = 500  # default: 100
+        RE.subscribe(nxwriter.receiver)
+
+    In *streaming* mode, the HDF5 file is opened when the ``start`` document
+    is received.  A group is created for each data key when the
+    ``descriptor`` document is received.  Data from ``event`` documents is
+    appended (in batches of ``streaming_batch_size`` events) to resizable,
+    chunked datasets in that group.  The remaining structure (metadata,
+    links, ``NXdata`` & templates) is written when the ``stop`` document is
+    received.  Memory use does not grow with the number of events.
+
     .. note::
        There are two methods to wait for the callback.  One is for *interactive*
        use when not using the RunEngine.  The other is for use *in a plan* that
        is executed by the bluesky RunEngine.
 
-        ============    =========================== ========================
+        ============    =========================== =============================
         When            Method                      Which uses
-        ============    =========================== ========================
-        interactive     ``wait_writer()``           ``time.sleep()``
+        ============    =========================== =============================
+        interactive     ``wait_writer()``           ``concurrent.futures.wait()``
         in a plan       ``wait_writer_plan_stub()`` ``yield from bps.sleep()``
-        ============    =========================== ========================
+        ============    =========================== =============================
 
-        The ``wait_writer()`` method calls ``time.sleep()`` and this would block
+        The ``wait_writer()`` method blocks and this would block
         the RunEngine from its routine processing of other background tasks.
         The ``wait_writer_plan_stub()`` method replaces that call with ``yield
         from bps.sleep()`` which does not block the RunEngine from processing
@@ -84,6 +102,15 @@ class NXWriter(FileWriterCallbackBase):
                 yield from bp.count(dets)
                 yield from nxwriter.wait_writer_plan_stub()
 
+        def my_other_plan(dets, n=5):
+            uids = []
+            for i in range(n):
+                uid = yield from bp.count(dets)
+                uids.append(uid)
+            # files are written while the next run is acquired
+            for uid in uids:
+                yield from nxwriter.wait_writer_plan_stub(uid)
+
     METHODS
 
     .. autosummary::
@@ -93,6 +120,7 @@ class NXWriter(FileWriterCallbackBase):
        ~add_dataset_attributes
        ~assign_signal_type
        ~create_NX_group
+       ~flush_streams
        ~get_sample_title
        ~get_stream_link
        ~resolve_class_path
@@ -115,6 +143,8 @@ class NXWriter(FileWriterCallbackBase):
 
     New with apstools release 1.3.0.
     Update in release 1.6.11 to wait for area detector HDF5 files.
+    Update in release 1.6.21 to add *streaming* mode and
+    ``external_data_mode`` (area detector images are not copied by default).
     """
 
     warn_on_missing_content = True
@@ -129,9 +159,33 @@ class NXWriter(FileWriterCallbackBase):
     template_key = "nxwriter_template"
     """The template (dict) is written as a JSON string to this metadata key."""
 
+    external_data_mode = "vds"
+    """
+    How to store area detector images (from an external ``AD_HDF5`` file).
+
+    ========  =========================================================
+    mode      description
+    ========  =========================================================
+    ``vds``   HDF5 virtual dataset with the images in the external file
+    ``link``  ``h5py.ExternalLink`` to the images in the external file
+    ``copy``  copy the images (in chunks of ``external_copy_frames``)
+    ========  =========================================================
+
+    With ``vds`` or ``link``, the external file must remain available
+    (at the same path) to read the images from the NeXus file.
+    """
+
+    external_copy_frames = 16
+    """Copy mode: maximum number of frames to read from the external file at once."""
+
+    streaming = False
+    """If ``True``, write the data streams to the file as the events arrive."""
+
+    streaming_batch_size = 100
+    """In streaming mode, append to the datasets after this many events."""
+
     _external_file_read_timeout = 20
     _external_file_read_retry_delay = 0.5
-    _writer_active = False
 
     # convention: methods written in alphabetical order
 
@@ -170,17 +224,21 @@ class NXWriter(FileWriterCallbackBase):
         for k, v in primary.items():
             # logger.debug(v.name)
             # logger.debug(v.keys())
+            # Do not open (or modify) an external file through a link.
+            external = isinstance(v.get("value", getlink=True), h5py.ExternalLink)
             if k in self.detectors:
                 signal_type = "detector"
             elif k in self.positioners:
                 signal_type = "positioner"
             else:
-                if v["value"].attrs.get("source", "").find(".S") > 0:
+                if not external and v["value"].attrs.get("source", "").find(".S") > 0:
                     # PV name matches a scaler channel PV
                     signal_type = "detector"
                 else:
                     signal_type = "other"
             v.attrs["signal_type"] = signal_type  # group
+            if external:
+                continue
             try:
                 v["value"].attrs["signal_type"] = signal_type  # dataset
             except KeyError:
@@ -190,6 +248,9 @@ class NXWriter(FileWriterCallbackBase):
     def create_NX_group(self, parent, specification):
         """
         create an h5 group with named NeXus class (specification)
+
+        If the group exists already (such as when created in streaming mode)
+        with the same NeXus class, return that group.
         """
         local_address, nx_class = specification.split(":")
         if not nx_class.startswith("NX"):
@@ -199,11 +260,79 @@ class NXWriter(FileWriterCallbackBase):
                 f" received {nx_class}"
             )
             # fmt: on
+        group = parent.get(local_address)
+        if isinstance(group, h5py.Group) and group.attrs.get("NX_class") == nx_class:
+            return group
         group = parent.create_group(local_address)
         group.attrs["NX_class"] = nx_class
         group.attrs["target"] = group.name  # for use as NeXus link
         return group
 
+    def descriptor(self, doc):
+        """
+        description of the data stream to be acquired
+
+        In streaming mode, also create the HDF5 group for each data key.
+        """
+        super().descriptor(doc)
+        if not (self.scanning and self.streaming and self.root is not None):
+            return
+        acquisition = self.acquisitions[doc["uid"]]
+        for k, v in acquisition["data"].items():
+            v["streaming"] = not v["external"]
+            v["streamed"] = 0  # number of values written to the file
+            if v["streaming"]:
+                self._streaming_group(acquisition["stream"], k)
+
+    def event(self, doc):
+        """
+        a single "row" of data
+
+        In streaming mode, write the buffered data every
+        ``streaming_batch_size`` events.
+        """
+        super().event(doc)
+        self._streaming_check(doc["descriptor"])
+
+    def event_page(self, doc):
+        """
+        several "rows" of data (columns of values)
+
+        In streaming mode, write the buffered data every
+        ``streaming_batch_size`` events.
+        """
+        super().event_page(doc)
+        self._streaming_check(doc["descriptor"])
+
+    def flush_streams(self):
+        """
+        Streaming mode: append buffered data to the HDF5 datasets.
+
+        Each data key is written to the (resizable, chunked) ``value`` and
+        ``EPOCH`` datasets of its group in
+        ``/entry/instrument/bluesky/streams/STREAM/KEY``.  When a data key
+        cannot be appended (such as ragged arrays or values of mixed type),
+        its data is returned to memory and written when the run ends.
+        """
+        if self.root is None:
+            return
+        for acquisition in self.acquisitions.values():
+            for k, v in acquisition["data"].items():
+                if not v.get("streaming") or len(v["data"]) == 0:
+                    continue
+                subgroup = self._streaming_group(acquisition["stream"], k)
+                try:
+                    self._streaming_append(subgroup, "value", v["data"].values, v["dtype"])
+                except (TypeError, ValueError) as exc:
+                    logger.info("Not streaming %s: %s", k, exc)
+                    self._streaming_restore(subgroup, v)
+                    continue
+                self._streaming_append(subgroup, "EPOCH", v["time"].values, "number")
+                v["streamed"] += len(v["data"])
+                v["data"].clear()
+                v["time"].clear()
+        self.root.flush()
+
     def getResourceFile(self, resource_id):
         """
         full path to the resource file specified by uid ``resource_id``
@@ -280,55 +409,129 @@ class NXWriter(FileWriterCallbackBase):
         logger.debug("HDF5 address=%r", addr)
         return addr
 
-    def wait_writer(self):
-        """
-        Wait for the writer to finish.  For interactive use (Not in a plan).
-
-        If you use ``NXWriter`` interactively, you must call
-        ``NXWriter.wait_writer()`` which waits for all data processing to finish
-        before proceeding with the next acquisition or processing.
+    def start(self, doc):
         """
-        while self._writer_active:
-            time.sleep(self._external_file_read_retry_delay)
+        beginning of a run, clear cache and collect metadata
 
-    def wait_writer_plan_stub(self):
+        In streaming mode, also open the HDF5 file.  A file left open by a
+        previous run (that had no *stop* document) is closed first.
         """
-        Wait for the writer to finish.  Use in a plan (with RunEngine).
+        super().start(doc)
+        if self.streaming:
+            fname = self.file_name or self.make_file_name()
+            if self.root is not None:
+                # A previous run ended without a stop document.
+                logger.warning("closing incomplete NeXus file: %s", self.root.filename)
+                self.root.close()
+                self.root = None
+            if self.file_name is not None and self._writer_active:
+                # A previous run's writer may still have this file open.
+                concurrent.futures.wait(self._pending_writers())
+            self.root = h5py.File(fname, "w")
+            logger.info("streaming to NeXus file: %s", fname)
+
+    def _streaming_append(self, group, name, values, dtype):
+        """Append ``values`` to the resizable dataset ``group[name]``."""
+        if dtype in ("string",):
+            arr = np.array([str(t) for t in values], dtype=h5py.string_dtype())
+        else:
+            arr = np.asarray(values)
+            if arr.dtype.kind in "OUS":
+                raise TypeError(f"cannot stream values of type {arr.dtype}")
+        if name not in group:
+            # fmt: off
+            group.create_dataset(
+                name, data=arr, chunks=True, maxshape=(None,) + arr.shape[1:]
+            )
+            # fmt: on
+        else:
+            ds = group[name]
+            if ds.shape[1:] != arr.shape[1:]:
+                raise ValueError(f"shape {arr.shape[1:]} does not match {ds.shape[1:]}")
+            n = ds.shape[0]
+            ds.resize(n + len(arr), axis=0)
+            ds[n:] = arr
+
+    def _streaming_check(self, descriptor_uid):
+        """Write buffered data when ``streaming_batch_size`` is reached."""
+        if not (self.scanning and self.streaming and self.root is not None):
+            return
+        acquisition = self.acquisitions.get(descriptor_uid)
+        if acquisition is None:
+            return
+        for v in acquisition["data"].values():
+            if v.get("streaming") and len(v["data"]) >= self.streaming_batch_size:
+                self.flush_streams()
+                break
 
-        If you use ``NXWriter`` in a plan, you must call
-        ``NXWriter.wait_writer()`` which waits for all data processing to finish
-        before proceeding with the next acquisition or processing.
-        """
-        import bluesky.plan_stubs as bps
+    def _streaming_group(self, stream_name, key):
+        """Return the HDF5 group for this ``key`` (create if needed)."""
+        # fmt: off
+        path = [
+            "entry:NXentry",
+            "instrument:NXinstrument",
+            "bluesky:NXnote",
+            "streams:NXnote",
+            f"{stream_name}:NXnote",
+            f"{key}:NXdata",
+        ]
+        # fmt: on
+        group = self.root
+        for specification in path:
+            group = self.create_NX_group(group, specification)
+        return group
 
-        while self._writer_active:
-            yield from bps.sleep(self._external_file_read_retry_delay)
+    def _streaming_prepend(self, buffer, values):
+        """Put ``values`` before the values in ``buffer``."""
+        pending = list(buffer)
+        buffer.clear()
+        buffer.extend(values)
+        buffer.extend(pending)
+
+    def _streaming_restore(self, group, v):
+        """Move any data already streamed from ``group`` back into memory."""
+        if "value" in group:
+            ds = group["value"]
+            if h5py.check_string_dtype(ds.dtype) is not None:
+                ds = ds.asstr()
+            self._streaming_prepend(v["data"], ds[()])
+            del group["value"]
+        if "EPOCH" in group:
+            self._streaming_prepend(v["time"], group["EPOCH"][()])
+            del group["EPOCH"]
+        v["streaming"] = False
+        v["streamed"] = 0
 
     def writer(self):
         """
         Write collected data to HDF5/NeXus data file.
 
-        The callback launches ``_threaded_writer()`` and returns. In the thread,
-        ``write_root()`` (or methods within) can wait on certain items (such as
-        an external HDF5 file written by an area detector IOC) to become
-        readable or a timeout period has expired.
+        The file is written in the background, by ``submit_writer()``, and
+        this method returns.  In the background, ``write_root()`` (or methods
+        within) can wait on certain items (such as an external HDF5 file
+        written by an area detector IOC) to become readable or a timeout
+        period has expired.  Meanwhile, the next run can begin.
         """
-        from ..utils import run_in_thread
+        if self.root is not None:
+            self.flush_streams()  # streaming mode: write any remaining data
 
-        @run_in_thread
-        def _threaded_writer(fname):
+        def _write_file(snapshot, fname):
             """Allow read of external files _after_ run ends."""
-            self._writer_active = True
             try:
-                with h5py.File(fname, "w") as self.root:
-                    self.write_root(fname)
+                if snapshot.root is None:
+                    with h5py.File(fname, "w") as snapshot.root:
+                        snapshot.write_root(fname)
+                else:
+                    # streaming mode: file is open, streams have been written
+                    with snapshot.root:
+                        snapshot.write_root(snapshot.root.filename)
                 self.output_nexus_file = fname
                 logger.info(f"wrote NeXus file: {fname}")  # lgtm [py/clear-text-logging-sensitive-data]
             finally:
-                self.root = None
-                self._writer_active = False
+                snapshot.root = None
 
-        _threaded_writer(self.file_name or self.make_file_name())
+        self.submit_writer(_write_file, self.file_name or self.make_file_name())
+        self.root = None  # The snapshot (above) has the open file.
 
     def write_data(self, parent):
         """
@@ -338,7 +541,11 @@ class NXWriter(FileWriterCallbackBase):
 
         primary = parent["instrument/bluesky/streams/primary"]
         for k in primary.keys():
-            nxdata[k] = primary[k + "/value"]
+            link = primary[k].get("value", getlink=True)
+            if isinstance(link, h5py.ExternalLink):
+                nxdata[k] = h5py.ExternalLink(link.filename, link.path)
+            else:
+                nxdata[k] = primary[k + "/value"]
 
         # pick the timestamps from one of the datasets (the last one)
         nxdata["EPOCH"] = primary[k + "/time"]
@@ -663,19 +870,43 @@ class NXWriter(FileWriterCallbackBase):
             )
             # fmt: on
 
-        def copy_image_from_IOC_file(fname):
+        mode = self.external_data_mode
+        if mode not in ("copy", "link", "vds"):
+            raise ValueError(f"Unknown {mode=!r}.  Use one of: copy link vds")
+
+        def store_image_from_IOC_file(fname):
             with h5py.File(fname, "r") as hdf_image_file_root:
                 h5addr = "/entry/data/data"
                 h5_obj = hdf_image_file_root[h5addr]
-                ds = subgroup.create_dataset(
-                    "value",
-                    data=h5_obj[()],
-                    compression="lzf",
-                    # compression="gzip",
-                    # compression_opts=9,
-                    shuffle=True,
-                    fletcher32=True,
-                )
+                if mode == "link":
+                    subgroup["value"] = h5py.ExternalLink(str(fname), h5addr)
+                    # An external link has no attributes.  Describe it here.
+                    subgroup.attrs["source_file"] = str(fname)
+                    subgroup.attrs["source_address"] = h5_obj.name
+                    subgroup.attrs["resource_id"] = resource_id
+                    return
+                elif mode == "vds":
+                    layout = h5py.VirtualLayout(shape=h5_obj.shape, dtype=h5_obj.dtype)
+                    layout[...] = h5py.VirtualSource(str(fname), h5addr, shape=h5_obj.shape)
+                    ds = subgroup.create_virtual_dataset("value", layout)
+                else:
+                    ds = subgroup.create_dataset(
+                        "value",
+                        shape=h5_obj.shape,
+                        dtype=h5_obj.dtype,
+                        compression="lzf",
+                        # compression="gzip",
+                        # compression_opts=9,
+                        shuffle=True,
+                        fletcher32=True,
+                    )
+                    if h5_obj.ndim == 0:
+                        ds[()] = h5_obj[()]
+                    else:
+                        # bounded memory: copy a few frames at a time
+                        step = max(1, self.external_copy_frames)
+                        for i in range(0, h5_obj.shape[0], step):
+                            ds[i : i + step] = h5_obj[i : i + step]
                 ds.attrs["target"] = ds.name
                 ds.attrs["source_file"] = str(fname)
                 ds.attrs["source_address"] = h5_obj.name
@@ -688,9 +919,11 @@ class NXWriter(FileWriterCallbackBase):
         while time.time() - t0 < self._external_file_read_timeout:
             t_elapsed = time.time() - t0
             try:
-                copy_image_from_IOC_file(fname)
+                store_image_from_IOC_file(fname)
                 break
             except (OSError, BlockingIOError) as exinfo:
+                if subgroup.get("value", getlink=True) is not None:
+                    del subgroup["value"]  # incomplete, try again
                 logger.warning(
                     (
                         "Could not open EPICS AD data file for reading: %s"
@@ -712,6 +945,18 @@ class NXWriter(FileWriterCallbackBase):
         subgroup.attrs["signal"] = "value"
         subgroup.attrs["axes"] = ["time", ]
         # fmt: on
+        if "value" in subgroup:
+            # streaming mode: data has been written already
+            ds = subgroup["value"]
+            ds.attrs["target"] = ds.name
+            self.add_dataset_attributes(ds, v, k)
+            if stream_name == "baseline":
+                for key, index in dict(value_start=0, value_end=-1).items():
+                    ds_ref = subgroup.create_dataset(key, data=ds[index])
+                    self.add_dataset_attributes(ds_ref, v, k)
+                    ds_ref.attrs["target"] = ds_ref.name
+            return
+
         if isinstance(d, list) and len(d) > 0:
             if v["dtype"] in ("string",):
                 d = self.h5string(d)
@@ -762,7 +1007,7 @@ class NXWriter(FileWriterCallbackBase):
             # just get the one descriptor
             acquisition = self.acquisitions[uid0]
             for k, v in acquisition["data"].items():
-                d = v["data"]
+                d = v["data"].values  # numpy array or list
                 # NXlog is for time series data but NXdata makes an automatic plot
                 subgroup = self.create_NX_group(group, k + ":NXdata")
 
@@ -771,8 +1016,13 @@ class NXWriter(FileWriterCallbackBase):
                 else:
                     self.write_stream_internal(parent, d, subgroup, stream_name, k, v)
 
-                t = np.array(v["time"])
-                ds = subgroup.create_dataset("EPOCH", data=t)
+                if "EPOCH" in subgroup:
+                    # streaming mode: time stamps have been written already
+                    ds = subgroup["EPOCH"]
+                    t = ds[()]
+                else:
+                    t = v["time"].values
+                    ds = subgroup.create_dataset("EPOCH", data=t)
                 ds.attrs["units"] = "s"
                 ds.attrs["long_name"] = "epoch time (s)"
                 ds.attrs["target"] = ds.name
@@ -0,0 +1,441 @@
+"""
+File Writer in a separate process
++++++++++++++++++++++++++++++++++++++++
+
+.. autosummary::
+
+   ~FileWriterProcess
+"""
+
+import atexit
+import logging
+import multiprocessing
+import pickle
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SHARED_MEMORY_KEY = "__shared_memory__"
+
+
+def _export_arrays(obj, threshold, segments, names=None):
+    """
+    Replace large numpy arrays in ``obj`` with references to shared memory.
+
+    Containers are copied only when something inside has been replaced.
+    Sizes (bytes) of the new shared memory segments are appended to ``segments``
+    (and their names to ``names``, if given).
+    """
+    if isinstance(obj, np.ndarray):
+        if obj.nbytes < threshold or obj.dtype.hasobject:
+            return obj
+        shm = shared_memory.SharedMemory(create=True, size=obj.nbytes)
+        np.ndarray(obj.shape, dtype=obj.dtype, buffer=shm.buf)[...] = obj
+        segments.append(obj.nbytes)
+        if names is not None:
+            names.append(shm.name)
+        ref = {
+            SHARED_MEMORY_KEY: shm.name,
+            "dtype": obj.dtype.str,
+            "shape": obj.shape,
+        }
+        shm.close()  # The writer process will unlink it.
+        return ref
+    if isinstance(obj, dict):
+        new = {k: _export_arrays(v, threshold, segments, names) for k, v in obj.items()}
+        changed = any(new[k] is not v for k, v in obj.items())
+        return new if changed else obj
+    if isinstance(obj, (list, tuple)):
+        new = [_export_arrays(v, threshold, segments, names) for v in obj]
+        changed = any(a is not b for a, b in zip(new, obj))
+        return type(obj)(new) if changed else obj
+    return obj
+
+
+def _import_arrays(obj):
+    """Restore numpy arrays from shared memory (and release the memory)."""
+    if isinstance(obj, dict):
+        if SHARED_MEMORY_KEY in obj:
+            shm = shared_memory.SharedMemory(name=obj[SHARED_MEMORY_KEY])
+            try:
+                shared = np.ndarray(obj["shape"], dtype=obj["dtype"], buffer=shm.buf)
+                array = shared.copy()
+                del shared
+            finally:
+                shm.close()
+                shm.unlink()
+            return array
+        return {k: _import_arrays(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)([_import_arrays(v) for v in obj])
+    return obj
+
+
+def _release_segments(names):
+    """Release shared memory segments (those not yet released by the writer process)."""
+    for name in names:
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            continue  # already released
+        shm.close()
+        shm.unlink()
+
+
+def _latency_summary(latencies):
+    """Summary statistics (seconds) of a list of latencies."""
+    if len(latencies) == 0:
+        return dict(mean=None, max=None, p95=None)
+    arr = np.array(latencies)
+    return dict(
+        mean=float(arr.mean()),
+        max=float(arr.max()),
+        p95=float(np.percentile(arr, 95)),
+    )
+
+
+def _writer_process(writer_class, writer_attrs, doc_queue, report_queue):
+    """
+    Main function of the writer process.
+
+    Receive ``(key, doc)`` documents from ``doc_queue`` and pass them to an
+    instance of ``writer_class``.  When a run is written, put its report on
+    ``report_queue``.  A ``None`` item ends the process.
+    """
+    writer = writer_class()
+    for k, v in writer_attrs.items():
+        setattr(writer, k, v)
+
+    run = None
+    while True:
+        item = doc_queue.get()
+        if item is None:
+            break
+        payload, t_sent, shared_bytes = item
+        t_received = time.time()
+        try:
+            key, doc = pickle.loads(payload)
+            doc = _import_arrays(doc)
+        except Exception as exc:
+            logger.exception("Could not read document from queue.")
+            if run is not None:
+                run["errors"].append(repr(exc))
+            continue
+
+        if key == "start":
+            run = dict(
+                uid=doc.get("uid"),
+                scan_id=doc.get("scan_id"),
+                documents={},
+                errors=[],
+                file_name=None,
+                handler_time=0,
+                latency=[],
+                queue_wait=[],
+                shared_memory_bytes=0,
+                t_start=t_received,
+            )
+        if run is None:
+            continue  # Not in a run.
+
+        run["documents"][key] = run["documents"].get(key, 0) + 1
+        run["shared_memory_bytes"] += shared_bytes
+        run["queue_wait"].append(t_received - t_sent)
+        t0 = time.time()
+        try:
+            if key == "stop" and getattr(writer, "scanning", False):
+                run["file_name"] = str(writer.file_name or writer.make_file_name())
+            writer.receiver(key, doc)
+        except Exception as exc:
+            logger.exception("Writer failed to handle %s document.", key)
+            run["errors"].append(f"{key}: {exc!r}")
+        t1 = time.time()
+        run["handler_time"] += t1 - t0
+        run["latency"].append(t1 - t_sent)
+
+        if key == "stop":
+            uid = run["uid"]
+            if hasattr(writer, "wait_writer"):
+                for exc in (writer.wait_writer(uid) or {}).values():
+                    run["errors"].append(f"writer: {exc!r}")
+            t_written = time.time()
+            report = dict(
+                uid=uid,
+                scan_id=run["scan_id"],
+                status="error" if len(run["errors"]) else "ok",
+                errors=run["errors"],
+                file_name=run["file_name"],
+                documents=run["documents"],
+                num_documents=sum(run["documents"].values()),
+                shared_memory_bytes=run["shared_memory_bytes"],
+                handler_time=run["handler_time"],
+                latency=_latency_summary(run["latency"]),
+                queue_wait=_latency_summary(run["queue_wait"]),
+                stop_to_file=t_written - t_received,
+                elapsed=t_written - run["t_start"],
+            )
+            report_queue.put(report)
+            run = None
+
+
+class FileWriterProcess:
+    """
+    Write files with a file writer callback running in a separate process.
+
+    .. index:: Bluesky Callback; FileWriterProcess
+
+    The file writer (such as :class:`~apstools.callbacks.nexus_writer.NXWriter`
+    or :class:`~apstools.callbacks.nexus_writer.NXWriterAPS`) runs in its own
+    process so its work (HDF5 compression, YAML dumps, image copies) does not
+    compete for the Python GIL with the RunEngine and ophyd.  Here, the
+    ``receiver()`` only serializes each document onto a (bounded)
+    multiprocessing queue.  Large numpy arrays are passed through shared
+    memory.  No external services are needed.
+
+    When a run has been written, the writer process sends a report of that
+    run (health and latency).  Reports are kept in the ``reports`` dictionary
+    (key: run uid).  If the writer process ends, the runs it had not written
+    are reported with ``status="error"`` (and their shared memory released).
+
+    EXAMPLE::
+
+        from apstools.callbacks import FileWriterProcess
+        from apstools.callbacks import NXWriterAPS
+
+        nxwriter = FileWriterProcess(
+            NXWriterAPS,
+            file_path="/tmp",
+            warn_on_missing_content=False,
+        )
+        RE.subscribe(nxwriter.receiver)
+
+        uid, = RE(bp.count([det]))
+        nxwriter.wait(uid)
+        print(nxwriter.reports[uid])
+
+    ===========================  ======================================================
+    attribute                    description
+    ===========================  ======================================================
+    ``queue_size``               maximum number of documents in queue (blocks)
+    ``shared_memory_threshold``  arrays this size (bytes) or larger use shared memory
+    ``start_method``             multiprocessing start method
+    ``poll_delay``               interval (s) to check for reports
+    ===========================  ======================================================
+
+    PARAMETERS
+
+    writer_class
+        *class* :
+        File writer callback class (subclass of ``FileWriterCallbackBase``).
+        The class must be importable by the writer process.
+    writer_attrs
+        *keyword arguments* :
+        Set these attributes (such as ``file_path``) of the file writer,
+        in the writer process.
+
+    .. autosummary::
+
+       ~close
+       ~health
+       ~receiver
+       ~wait
+       ~wait_plan_stub
+
+    (new in release 1.6.21)
+    """
+
+    queue_size = 10_000
+    shared_memory_threshold = 64 * 1024
+    start_method = "spawn"
+    poll_delay = 0.1
+
+    def __init__(self, writer_class, **writer_attrs):
+        """The writer process starts with the first document."""
+        self.writer_class = writer_class
+        self.writer_attrs = writer_attrs
+        self.reports = {}  # key: run uid, value: report (dict)
+        self.pending = []  # run uids sent but not yet reported
+        self.process = None
+        self._current_uid = None  # run receiving documents now
+        self._segments = {}  # key: run uid, value: names of shared memory segments
+        self._doc_queue = None
+        self._report_queue = None
+
+    def _start_process(self):
+        """Start the writer process (if not running)."""
+        if self.process is not None and self.process.is_alive():
+            return
+        if self.process is not None:
+            logger.error(
+                "Writer process ended (exitcode=%s).  Starting a new one.",
+                self.process.exitcode,
+            )
+            self._abandon_pending()
+        context = multiprocessing.get_context(self.start_method)
+        self._doc_queue = context.Queue(maxsize=self.queue_size)
+        self._report_queue = context.Queue()
+        self.process = context.Process(
+            target=_writer_process,
+            args=(
+                self.writer_class,
+                self.writer_attrs,
+                self._doc_queue,
+                self._report_queue,
+            ),
+            name=f"{self.writer_class.__name__}-process",
+            daemon=True,
+        )
+        self.process.start()
+        atexit.register(self.close)  # Write pending runs before Python exits.
+
+    def _collect_reports(self, timeout=None):
+        """Move any reports from the writer process into ``reports``."""
+        if self._report_queue is None:
+            return
+        block = timeout is not None
+        while True:
+            try:
+                report = self._report_queue.get(block=block, timeout=timeout)
+            except queue.Empty:
+                break
+            block = False  # Wait, at most, for the first report.
+            uid = report["uid"]
+            self.reports[uid] = report
+            self._segments.pop(uid, None)
+            if uid in self.pending:
+                self.pending.remove(uid)
+            if report["status"] != "ok":
+                logger.error("Writer failed for run %s: %s", uid, report["errors"])
+
+    def _abandon_pending(self):
+        """
+        The writer process has ended: report the pending runs as failed.
+
+        Release their shared memory (the writer process can no longer).
+        """
+        self._collect_reports()  # runs written before the process ended
+        exitcode = None if self.process is None else self.process.exitcode
+        for uid in self.pending:
+            _release_segments(self._segments.pop(uid, []))
+            self.reports[uid] = dict(
+                uid=uid,
+                status="error",
+                errors=[f"writer process ended (exitcode={exitcode})"],
+            )
+            logger.error("Writer process ended before run %s was written.", uid)
+        self.pending = []
+        for names in self._segments.values():
+            _release_segments(names)  # documents sent outside of a run
+        self._segments = {}
+        self._current_uid = None
+
+    def close(self, timeout=None):
+        """
+        Write any pending runs, then end the writer process.
+
+        Called automatically when Python exits.
+        """
+        if self.process is None:
+            return
+        if self.process.is_alive():
+            self._doc_queue.put(None)
+            self.process.join(timeout)
+        if self.process.is_alive():
+            self._collect_reports()
+        else:
+            self._abandon_pending()  # any runs not written
+        self.process = None
+        atexit.unregister(self.close)
+
+    def health(self):
+        """Dictionary describing the health of the writer process."""
+        self._collect_reports()
+        try:
+            queued = self._doc_queue.qsize()
+        except (AttributeError, NotImplementedError):  # not on macOS
+            queued = None
+        alive = self.process is not None and self.process.is_alive()
+        return dict(
+            alive=alive,
+            pid=None if self.process is None else self.process.pid,
+            exitcode=None if self.process is None else self.process.exitcode,
+            queued_documents=queued,
+            pending_runs=list(self.pending),
+            runs_reported=len(self.reports),
+            runs_failed=len([r for r in self.reports.values() if r["status"] != "ok"]),
+        )
+
+    def receiver(self, key, doc):
+        """
+        bluesky callback: serialize the document onto the queue
+
+        .. index:: Bluesky Callback; FileWriterProcess.receiver
+        """
+        self._start_process()
+        t_sent = time.time()
+        segments, names = [], []
+        doc = _export_arrays(doc, self.shared_memory_threshold, segments, names)
+        payload = pickle.dumps((key, doc), protocol=pickle.HIGHEST_PROTOCOL)
+        if key == "start":
+            self._current_uid = doc["uid"]
+            self.pending.append(doc["uid"])
+        if len(names) > 0:
+            self._segments.setdefault(self._current_uid, []).extend(names)
+        self._doc_queue.put((payload, t_sent, sum(segments)))
+        if key == "stop":
+            self._current_uid = None
+            self._collect_reports()
+
+    def _is_pending(self, uid=None):
+        self._collect_reports()
+        if uid is None:
+            return len(self.pending) > 0
+        return uid in self.pending
+
+    def wait(self, uid=None, timeout=None):
+        """
+        Wait for the writer process to write the run(s).  (Not in a plan.)
+
+        Wait for all runs (default) or only the run with the given ``uid``.
+        Returns ``True`` if the run(s) have been written.
+        """
+        t_end = None if timeout is None else time.time() + timeout
+        while self._is_pending(uid):
+            if self.process is None or not self.process.is_alive():
+                logger.error("Writer process is not running.")
+                self._abandon_pending()
+                return False
+            if t_end is not None and time.time() >= t_end:
+                return False
+            self._collect_reports(timeout=self.poll_delay)
+        return True
+
+    def wait_plan_stub(self, uid=None):
+        """
+        Wait for the writer process to write the run(s).  Use in a plan.
+
+        Wait for all runs (default) or only the run with the given ``uid``.
+        """
+        import bluesky.plan_stubs as bps
+
+        while self._is_pending(uid):
+            if self.process is None or not self.process.is_alive():
+                logger.error("Writer process is not running.")
+                self._abandon_pending()
+                break
+            yield from bps.sleep(self.poll_delay)
+
+
+# -----------------------------------------------------------------------------
+# :author:    Pete R. Jemian
+# :email:     jemian@anl.gov
+# :copyright: (c) 2017-2024, UChicago Argonne, LLC
+#
+# Distributed under the terms of the Argonne National Laboratory Open Source License.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
@@ -6,16 +6,19 @@ Collect statistics on the signals used in 1-D scans.
 
     ~factor_fwhm
     ~SignalStatsCallback
+    ~SummationRegisterArray
 """
 
 __all__ = """
 factor_fwhm
 SignalStatsCallback
+SummationRegisterArray
 """.split()
 
 import math
 import logging
 
+import numpy as np
 import pyRestTable
 import pysumreg
 
@@ -30,6 +33,161 @@ see: https://statproofbook.github.io/P/norm-fwhm.html
 """
 
 
+class SummationRegisterArray:
+    """
+    Summation registers of many Y signals (vs. one X) in numpy arrays.
+
+    Each call to ``add()`` updates the registers of all the Y signals at
+    once, for one or many ``(x, y)`` points.  The registers of one signal
+    (with the API of ``pysumreg.SummationRegisters``) are::
+
+        registers = SummationRegisterArray(["I0", "diode"])
+        registers.add(x, [y_I0, y_diode])
+        print(registers["diode"].centroid)
+
+    .. autosummary::
+
+        ~add
+        ~clear
+
+    (new in release 1.6.21)
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.clear()
+
+    def __getitem__(self, name):
+        return _SignalRegisters(self, self.names.index(name))
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(names={self.names!r}, n={self.n})"
+
+    def clear(self):
+        r"""Clear the :math:`\sum{}` summation registers."""
+        k = len(self.names)
+        self.n = 0
+        self.X = 0.0
+        self.XX = 0.0
+        self.min_x = None
+        self.max_x = None
+        self.Y = np.zeros(k)
+        self.XY = np.zeros(k)
+        self.XXY = np.zeros(k)
+        self.YY = np.zeros(k)
+        self.min_y = np.full(k, np.inf)
+        self.max_y = np.full(k, -np.inf)
+        self.x_at_min_y = np.full(k, np.nan)
+        self.x_at_max_y = np.full(k, np.nan)
+
+    def add(self, x, y):
+        r"""
+        :math:`\sum{+}`: Add :math:`(x, y)` points to the registers.
+
+        ``x`` is a number (one point) or a list of numbers (several points,
+        as from an *event_page*).  ``y`` has a number (or list of numbers,
+        same length as ``x``) for each of the Y signals.
+        """
+        if np.ndim(x) == 0:
+            self._add_point(float(x), np.asarray(y, dtype=float))
+            return
+        x = np.asarray(x, dtype=float)
+        if x.size == 0:
+            return
+        y = np.asarray(y, dtype=float).reshape(len(self.names), x.size)
+
+        self.n += x.size
+        self.X += float(x.sum())
+        self.XX += float((x * x).sum())
+        xy = y * x
+        self.Y += y.sum(axis=1)
+        self.XY += xy.sum(axis=1)
+        self.XXY += (xy * x).sum(axis=1)
+        self.YY += (y * y).sum(axis=1)
+
+        lo, hi = float(x.min()), float(x.max())
+        self.min_x = lo if self.min_x is None else min(lo, self.min_x)
+        self.max_x = hi if self.max_x is None else max(hi, self.max_x)
+
+        # Like pysumreg, the last x wins when the extreme y is repeated.
+        rows = np.arange(len(self.names))
+        last = x.size - 1
+        i = last - np.argmax(y[:, ::-1], axis=1)
+        update = y[rows, i] >= self.max_y
+        self.max_y = np.where(update, y[rows, i], self.max_y)
+        self.x_at_max_y = np.where(update, x[i], self.x_at_max_y)
+        i = last - np.argmin(y[:, ::-1], axis=1)
+        update = y[rows, i] <= self.min_y
+        self.min_y = np.where(update, y[rows, i], self.min_y)
+        self.x_at_min_y = np.where(update, x[i], self.x_at_min_y)
+
+    def _add_point(self, x, y):
+        """Add one :math:`(x, y)` point (an *event*), all signals."""
+        self.n += 1
+        self.X += x
+        self.XX += x * x
+        xy = x * y
+        self.Y += y
+        self.XY += xy
+        self.XXY += x * xy
+        self.YY += y * y
+        self.min_x = x if self.min_x is None else min(x, self.min_x)
+        self.max_x = x if self.max_x is None else max(x, self.max_x)
+        update = y >= self.max_y
+        np.copyto(self.max_y, y, where=update)
+        np.copyto(self.x_at_max_y, x, where=update)
+        update = y <= self.min_y
+        np.copyto(self.min_y, y, where=update)
+        np.copyto(self.x_at_min_y, x, where=update)
+
+
+def _scalar_register(name):
+    """Register shared by all signals (n and the x terms)."""
+    return property(lambda self: getattr(self._array, name))
+
+
+def _signal_register(name):
+    """Register of one signal (Python float, or None for empty extrema)."""
+
+    def getter(self):
+        if self._array.n == 0 and name.startswith(("min", "max", "x_at")):
+            return None
+        return float(getattr(self._array, name)[self._index])
+
+    return property(getter)
+
+
+class _SignalRegisters(pysumreg.SummationRegisters):
+    """
+    Registers of one signal from a ``SummationRegisterArray`` (read-only).
+
+    Provides the statistics of ``pysumreg.SummationRegisters``.
+    """
+
+    def __init__(self, array, index):
+        self._array = array
+        self._index = index
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Use the methods of the SummationRegisterArray.")
+
+    add = clear = subtract = _read_only
+
+    n = _scalar_register("n")
+    X = _scalar_register("X")
+    XX = _scalar_register("XX")
+    min_x = _scalar_register("min_x")
+    max_x = _scalar_register("max_x")
+    Y = _signal_register("Y")
+    XY = _signal_register("XY")
+    XXY = _signal_register("XXY")
+    YY = _signal_register("YY")
+    min_y = _signal_register("min_y")
+    max_y = _signal_register("max_y")
+    x_at_min_y = _signal_register("x_at_min_y")
+    x_at_max_y = _signal_register("x_at_max_y")
+
+
 class SignalStatsCallback:
     """
     Callback: Collect peak (& other) statistics during a scan.
@@ -60,13 +218,46 @@ class SignalStatsCallback:
             yield from _inner()  # run the scan
             signal_stats.report()  # print the statistics
 
+    Statistics are collected for each detector signal against each of the
+    motors of the scan.  The statistics of all signals are updated at once
+    (in numpy arrays, see :class:`SummationRegisterArray`) from each *event*
+    or *event_page* document.  For scans of two (or more) motors (such as
+    ``bp.grid_scan()``), ``statistics_2d()`` reports the 2-D centroid and
+    width of each signal against the first two motors.
+
+    .. rubric:: Stop a scan after the peak
+
+    With ``peak_detection = True``, the first detector signal is watched as
+    the data arrives.  When the signal has risen to a maximum and then fallen
+    below ``peak_fraction`` of the peak height (above the minimum) for
+    ``peak_points_after`` points, ``peak_found`` is set ``True``.  Use the
+    ``per_step()`` method in a step scan to skip the remaining points::
+
+        signal_stats.peak_detection = True
+        RE(
+            bpp.subs_wrapper(
+                bp.rel_scan(
+                    [det], motor, -1, 1, 41,
+                    per_step=signal_stats.per_step
+                ),
+                signal_stats.receiver,
+            )
+        )
+
     .. rubric:: Public API
     .. autosummary::
 
         ~receiver
         ~report
+        ~statistics_2d
+        ~per_step
         ~data_stream
         ~stop_report
+        ~peak_detection
+        ~peak_fraction
+        ~peak_points_after
+        ~peak_min_height
+        ~peak_found
 
     .. rubric:: Internal API
     .. autosummary::
@@ -74,10 +265,12 @@ class SignalStatsCallback:
         ~clear
         ~descriptor
         ~event
+        ~event_page
         ~start
         ~stop
         ~_scanning
         ~_registers
+        ~_motor_registers
     """
 
     data_stream: str = "primary"
@@ -86,11 +279,33 @@ class SignalStatsCallback:
     stop_report: bool = True
     """If ``True`` (default), call the ``report()`` method when a ``stop`` document is received."""
 
+    peak_detection: bool = False
+    """If ``True``, watch the first detector signal for a peak as the data arrives."""
+
+    peak_fraction: float = 0.5
+    """Peak is passed when the signal falls below this fraction of the peak height."""
+
+    peak_points_after: int = 2
+    """Peak is passed after this many consecutive points below ``peak_fraction``."""
+
+    peak_min_height: float = 0
+    """Peak height (maximum - minimum) must be greater than this."""
+
+    peak_found: bool = False
+    """Has the scan passed a peak?  (Only with ``peak_detection``.)"""
+
     _scanning: bool = False
     """Is a run *in progress*?"""
 
     _registers: dict = {}
-    """Dictionary (keyed on Signal name) of ``SummationRegister()`` objects."""
+    """
+    Dictionary (keyed on Signal name) of ``SummationRegister()`` objects.
+
+    Statistics against the first motor.
+    """
+
+    _motor_registers: dict = {}
+    """Dictionary (keyed on motor Signal name) of ``SummationRegisterArray()`` objects."""
 
     # TODO: What happens when the run is paused?
 
@@ -105,10 +320,16 @@ class SignalStatsCallback:
         self._scanning = False
         self._detectors = []
         self._motor = ""
+        self._motors = []
         self._registers = {}
+        self._motor_registers = {}
         self._descriptor_uid = None
         self._x_name = None
+        self._x_names = []
         self._y_names = []
+        self._XXY_2d = None  # sum of x0*x1*y (two motors)
+        self.peak_found = False
+        self._peak = dict(n=0, max_y=None, min_y=None, min_before_max=None, i_max=0, below=0)
 
     def descriptor(self, doc):
         """Receives 'descriptor' documents from the RunEngine."""
@@ -120,14 +341,59 @@ class SignalStatsCallback:
         # Remember now, to match with later events.
         self._descriptor_uid = doc["uid"]
 
-        # Pick the first motor signal.
-        self._x_name = doc["hints"][self._motor]["fields"][0]
+        # Pick the first signal of each motor.
+        for motor in self._motors:
+            fields = doc["hints"].get(motor, {}).get("fields", [])
+            if len(fields) > 0:
+                self._x_names.append(fields[0])
+            elif motor in doc["data_keys"]:
+                self._x_names.append(motor)
+            else:
+                logger.warning("No signal found for motor %r.", motor)
+        self._x_name = (self._x_names or [None])[0]
         # Get the signals for each detector object.s
         for d in self._detectors:
             self._y_names += doc["hints"][d]["fields"]
 
-        # Keep statistics for each of the Y signals (vs. the one X signal).
-        self._registers = {y: pysumreg.SummationRegisters() for y in self._y_names}
+        # Keep statistics for all of the Y signals vs. each X signal.
+        self._motor_registers = {x: SummationRegisterArray(self._y_names) for x in self._x_names}
+        if self._x_name is not None:
+            registers = self._motor_registers[self._x_name]
+            self._registers = {y: registers[y] for y in self._y_names}
+        if len(self._x_names) > 1:
+            self._XXY_2d = np.zeros(len(self._y_names))
+
+    def _add(self, data):
+        """Add the X & Y data (values or lists of values) to the registers."""
+        y = [data[yname] for yname in self._y_names]
+        for xname, registers in self._motor_registers.items():
+            registers.add(data[xname], y)
+        if self._XXY_2d is not None:
+            x0, x1 = (np.asarray(data[x], dtype=float) for x in self._x_names[:2])
+            y = np.asarray(y, dtype=float).reshape(len(self._y_names), x0.size)
+            self._XXY_2d += (y * (x0 * x1)).sum(axis=1)
+        if self.peak_detection and not self.peak_found and len(self._y_names) > 0:
+            for value in np.atleast_1d(data[self._y_names[0]]):
+                self._peak_check(float(value))
+
+    def _peak_check(self, y):
+        """Look for a peak (rise, maximum, fall) in the next y value."""
+        peak = self._peak
+        peak["n"] += 1
+        if peak["max_y"] is None or y > peak["max_y"]:
+            peak["max_y"] = y
+            peak["min_before_max"] = peak["min_y"]
+            peak["i_max"] = peak["n"]
+        peak["min_y"] = y if peak["min_y"] is None else min(y, peak["min_y"])
+
+        height = peak["max_y"] - peak["min_y"]
+        threshold = peak["min_y"] + self.peak_fraction * height
+        peak["below"] = peak["below"] + 1 if y <= threshold else 0
+        rose = peak["min_before_max"] is not None and peak["min_before_max"] <= threshold
+        fell = peak["n"] > peak["i_max"] and peak["below"] >= self.peak_points_after
+        if rose and fell and height > self.peak_min_height:
+            self.peak_found = True
+            logger.info("Peak passed in signal %r after %d points.", self._y_names[0], peak["n"])
 
     def event(self, doc):
         """Receives 'event' documents from the RunEngine."""
@@ -137,13 +403,34 @@ class SignalStatsCallback:
             return
 
         # Collect the data for the signals.
-        x = doc["data"][self._x_name]
-        for yname in self._y_names:
-            self._registers[yname].add(x, doc["data"][yname])
+        self._add(doc["data"])
+
+    def event_page(self, doc):
+        """Receives 'event_page' documents from the RunEngine."""
+        if not self._scanning:
+            return
+        if doc["descriptor"] != self._descriptor_uid:
+            return
+
+        # Collect the data for the signals, all rows at once.
+        self._add(doc["data"])
+
+    def per_step(self, detectors, step, pos_cache, take_reading=None):
+        """
+        Use as ``per_step`` of a step scan: skip the points after a peak.
+
+        Until ``peak_found``, move and read as ``bps.one_nd_step()``.
+        """
+        import bluesky.plan_stubs as bps
+
+        if self.peak_found:
+            return  # Skip the remaining points.
+        kwargs = {} if take_reading is None else dict(take_reading=take_reading)
+        yield from bps.one_nd_step(detectors, step, pos_cache, **kwargs)
 
     def receiver(self, key, document):
         """Client method used to subscribe to the RunEngine."""
-        handlers = "start stop descriptor event".split()
+        handlers = "start stop descriptor event event_page".split()
         if key in handlers:
             getattr(self, key)(document)
         else:
@@ -151,14 +438,21 @@ class SignalStatsCallback:
 
     def report(self):
         """Print a table with the collected statistics for each signal."""
-        if len(self._registers) == 0:
+        for xname, registers in self._motor_registers.items():
+            self._report_motor(xname, {y: registers[y] for y in self._y_names})
+        if self._XXY_2d is not None:
+            self._report_2d()
+
+    def _report_motor(self, xname, signal_registers):
+        """Print a table with the statistics of each signal vs. one motor."""
+        if len(signal_registers) == 0:
             return
         keys = "n centroid sigma x_at_max_y max_y min_y mean_y stddev_y".split()
         table = pyRestTable.Table()
-        if len(keys) <= len(self._registers):
+        if len(keys) <= len(signal_registers):
             # statistics in the column labels
             table.labels = ["detector"] + keys
-            for yname, stats in self._registers.items():
+            for yname, stats in signal_registers.items():
                 row = [yname]
                 for k in keys:
                     try:
@@ -169,26 +463,71 @@ class SignalStatsCallback:
                 table.addRow(row)
         else:
             # signals in the column labels
-            table.labels = ["statistic"] + list(self._registers)
+            table.labels = ["statistic"] + list(signal_registers)
             for k in keys:
                 row = [k]
-                for stats in self._registers.values():
+                for stats in signal_registers.values():
                     try:
                         v = getattr(stats, k)
                     except (ValueError, ZeroDivisionError):
                         v = 0
                     row.append(v)
                 table.addRow(row)
-        print(f"Motor: {self._x_name}")
+        print(f"Motor: {xname}")
+        print(table)
+
+    def _report_2d(self):
+        """Print a table with the 2-D statistics of each signal."""
+        x0, x1 = self._x_names[:2]
+        table = pyRestTable.Table()
+        table.labels = ["detector", f"centroid_{x0}", f"centroid_{x1}", f"sigma_{x0}", f"sigma_{x1}", "covariance"]
+        for yname in self._y_names:
+            try:
+                stats = self.statistics_2d(yname)
+                row = [yname, *stats["centroid"], *stats["sigma"], stats["covariance"]]
+            except (ValueError, ZeroDivisionError):
+                row = [yname, 0, 0, 0, 0, 0]
+            table.addRow(row)
+        print(f"Motors: {x0}, {x1}")
         print(table)
 
+    def statistics_2d(self, signal=None):
+        r"""
+        Centroid and width of ``signal`` (default: first detector signal) in 2-D.
+
+        Uses the first two motors of the scan, :math:`x_0` and :math:`x_1`,
+        weighted by the signal, :math:`y`.  Returns a dictionary with
+        ``motors``, ``centroid`` (:math:`x_{0,c}, x_{1,c}`), ``sigma``
+        (:math:`\sigma_0, \sigma_1`), and ``covariance``:
+
+        .. math:: \sigma_{01} = {\sum{y x_0 x_1} \over \sum{y}} - x_{0,c} x_{1,c}
+
+        Raises ``ValueError`` if the scan has fewer than two motors and
+        ``ZeroDivisionError`` if :math:`\sum{y}` is zero.
+        """
+        if self._XXY_2d is None:
+            raise ValueError("2-D statistics need (at least) two motors.")
+        signal = signal or self._y_names[0]
+        axes = [self._motor_registers[x][signal] for x in self._x_names[:2]]
+        centroid = [axis.centroid for axis in axes]
+        sigma = [axis.sigma for axis in axes]
+        xxy = float(self._XXY_2d[self._y_names.index(signal)])
+        covariance = xxy / axes[0].Y - centroid[0] * centroid[1]
+        return dict(
+            motors=self._x_names[:2],
+            centroid=centroid,
+            sigma=sigma,
+            covariance=covariance,
+        )
+
     def start(self, doc):
         """Receives 'start' documents from the RunEngine."""
         self.clear()
         self._scanning = True
         # These command arguments might each have many signals.
         self._detectors = doc["detectors"]
-        self._motor = doc["motors"][0]  # just keep the first one
+        self._motors = list(doc.get("motors", []))
+        self._motor = (self._motors or [""])[0]
 
     def stop(self, doc):
         """Receives 'stop' documents from the RunEngine."""
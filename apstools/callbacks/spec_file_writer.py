@@ -56,16 +56,26 @@ results in this SPEC file output::
 
 import datetime
 import getpass
+import json
 import logging
 import pathlib
+import re
 import socket
 import time
 from collections import OrderedDict
 
 import numpy as np
 
+logger = logging.getLogger(__name__)
+
 SPEC_TIME_FORMAT = "%a %b %d %H:%M:%S %Y"
 SCAN_ID_RESET_VALUE = 0
+UID_INDEX_SIDECAR_SUFFIX = ".uids.json"
+UID_PATTERN = re.compile(
+    # bluesky uid (anywhere in the line) or text following "uid = "
+    r"[0-9a-fA-F]{8}(?:-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12}"
+    r"|(?<=uid = )\S+"
+)
 
 
 def _rebuild_scan_command(doc):
@@ -179,6 +189,39 @@ class SpecWriterCallback(object):
         highest scan number in existing SPEC data file.
         default: False
 
+    uid_index_sidecar
+        *boolean* :
+        (optional)
+        If True, keep the index of run uids (written in the SPEC data file)
+        in a small sidecar file (SPEC file name + ``.uids.json``), to
+        reopen the SPEC file quickly.
+        default: False
+
+    streaming
+        *boolean* :
+        (optional)
+        If True (and ``auto_write`` is True), write the scan while it is
+        running: the scan header (through the ``#L`` line) is written when
+        the *primary* descriptor arrives and each row is appended as its
+        data arrives.  The rows written are not lost if the session ends
+        before the *stop* document.  Comments added to *start* or
+        *descriptor* after the *primary* descriptor are written after the
+        scan data.
+        default: False
+
+    flush_interval
+        *float* :
+        (optional)
+        In streaming mode, flush the rows written to the file (so they are
+        visible to other programs) at this interval (seconds).  Use ``0``
+        to flush after each event.
+        default: 1.0
+
+    A run (identified by its ``uid``) is written only once to a SPEC data
+    file.  An index of the uids in the file (``uid_index``, with the scan
+    number of each) is built when the file is first used and is kept up to
+    date as scans are written.  Only new content of the file is read.
+
     User Interface methods
 
     .. autosummary::
@@ -199,14 +242,32 @@ class SpecWriterCallback(object):
        ~start
        ~descriptor
        ~event
+       ~event_page
        ~bulk_events
        ~datum
        ~resource
        ~stop
     """
 
-    def __init__(self, filename=None, auto_write=True, RE=None, reset_scan_id=False):
+    def __init__(
+        self,
+        filename=None,
+        auto_write=True,
+        RE=None,
+        reset_scan_id=False,
+        uid_index_sidecar=False,
+        streaming=False,
+        flush_interval=1.0,
+    ):
+        self._stream = None  # file object (streaming mode), while scanning
+        self._stream_comments = {}  # number of comments written, by key
+        self._stream_flushed = 0  # time of most recent flush
+        self._stream_rows = 0  # number of rows written
         self.clear()
+        self.uid_index_sidecar = uid_index_sidecar
+        self.streaming = streaming
+        self.flush_interval = flush_interval
+        self._uid_index_reset()
         self.buffered_comments = self._empty_comments_dict()
         self.auto_write = auto_write
         self.uid_short_length = 8
@@ -286,6 +347,7 @@ class SpecWriterCallback(object):
             start=self.start,
             descriptor=self.descriptor,
             event=self.event,
+            event_page=self.event_page,
             bulk_events=self.bulk_events,
             datum=self.datum,
             resource=self.resource,
@@ -296,10 +358,12 @@ class SpecWriterCallback(object):
             token = document.get("uid") or document.get("datum_id")
             logger.debug("%s document, uid=%s", key, str(token))  # lgtm [py/clear-text-logging-sensitive-data]
             ts = document.get("time")
+            if isinstance(ts, list):  # event_page: most recent row
+                ts = ts[-1] if len(ts) > 0 else None
             if ts is None:
                 ts = datetime.datetime.now()
             else:
-                ts = datetime.datetime.fromtimestamp(document["time"])
+                ts = datetime.datetime.fromtimestamp(ts)
             self._datetime = ts
             xref[key](document)
         else:
@@ -316,6 +380,10 @@ class SpecWriterCallback(object):
             plan_type plan_name plan_args
         """.split()
 
+        if self._stream is not None:
+            logger.warning("No stop document for scan %s in SPEC file.", self.scan_id)
+            self._stream_close()
+
         self.clear()
         self.scanning = True
         self.uid = doc["uid"]
@@ -402,6 +470,9 @@ class SpecWriterCallback(object):
 
         self.data.update({k: [] for k in first_keys + epoch_keys + middle_keys + last_keys})
 
+        if self.streaming and self.auto_write:
+            self._stream_open()
+
     def event(self, doc):
         """
         handle *event* documents
@@ -428,10 +499,47 @@ class SpecWriterCallback(object):
                     v = doc["data"].get(k, 0)
                 self.data[k].append(v)
             self.num_primary_data += 1
+            if self._stream is not None:
+                self._stream_rows_write()
+
+    def event_page(self, doc):
+        """
+        handle *event_page* documents
+
+        Each column of the page is added to the scan data in one step.
+        """
+        descriptor = self._streams.get(doc["descriptor"])
+        if descriptor is None:
+            fmt = "descriptor UID {} not found"
+            raise KeyError(fmt.format(doc["descriptor"]))
+        if descriptor["name"] == self._motor_stream_name:
+            for k in self.positioners.keys():
+                self.positioners[k] = doc["data"][k][-1]  # get motor values
+        elif descriptor["name"] == "primary":
+            for k in doc["data"].keys():
+                if k not in self.data.keys():
+                    msg = f"unexpected failure here, key {k} not found"
+                    raise KeyError(msg)
+            elapsed = np.asarray(doc["time"], dtype=float) - self.time
+            num_rows = len(elapsed)
+            for k in self.data.keys():
+                if k == "Epoch":
+                    values = (elapsed + 0.5).astype(int).tolist()
+                elif k == "Epoch_float":
+                    values = elapsed.tolist()
+                else:
+                    # like SPEC, default to 0 if not found by name
+                    values = doc["data"].get(k, [0] * num_rows)
+                self.data[k].extend(values)
+            self.num_primary_data += num_rows
+            if self._stream is not None:
+                self._stream_rows_write()
 
     def bulk_events(self, doc):
         """handle *bulk_events* documents"""
-        pass
+        for events in doc.values():
+            for event in events:
+                self.event(event)
 
     def datum(self, doc):
         """handle *datum* documents"""
@@ -451,7 +559,9 @@ class SpecWriterCallback(object):
         else:
             self._cmt("stop", "exit_status = not available")
 
-        if self.auto_write:
+        if self._stream is not None:
+            self._stream_finish()
+        elif self.auto_write:
             self.write_scan()
 
         self.scanning = False
@@ -462,6 +572,13 @@ class SpecWriterCallback(object):
 
         :returns: [str] a list of lines to append to the data file
         """
+        lines = self._scan_header_lines()
+        lines += self._scan_data_lines(0, self.num_primary_data)
+        lines += self._scan_trailer_lines()
+        return lines
+
+    def _scan_header_lines(self):
+        """Lines of the scan, from ``#S`` through ``#L``."""
         dt = datetime.datetime.fromtimestamp(self.scan_epoch)
         lines = []
         lines.append("")
@@ -495,25 +612,48 @@ class SpecWriterCallback(object):
         lines.append("#N " + str(len(self.data.keys())))
         if len(self.data.keys()) > 0:
             lines.append("#L " + "  ".join(self.data.keys()))
-            for i in range(self.num_primary_data):
-                str_data = OrderedDict()
-                s = []
-                for k in self.data.keys():
-                    datum = self.data[k][i]
-                    if isinstance(datum, str):
+        else:
+            lines.append("#C no data column labels identified")
+        return lines
+
+    def _scan_data_lines(self, first, last):
+        """
+        Lines of scan data for rows ``first`` up to (not including) ``last``.
+
+        Rows are formatted column by column.  Text in a column is replaced
+        by the row number and reported after the row in a ``#U`` line.
+        """
+        columns = []
+        text = {}  # key: row number, value: [(column label, text)]
+        for k, values in self.data.items():
+            values = values[first:last]
+            if any(issubclass(t, str) for t in set(map(type, values))):
+                column = []
+                for i, v in enumerate(values, start=first):
+                    if isinstance(v, str):
                         # SPEC scan data is expected to be numbers
                         # this is text, substitute the row number
                         # and report after this line in a #U line
-                        str_data[k] = datum
-                        datum = i
-                    s.append(str(datum))
-                lines.append(" ".join(s))
-                for k in str_data.keys():
-                    # report the text data
-                    lines.append(f"#U {i} {k} {str_data[k]}")
-        else:
-            lines.append("#C no data column labels identified")
+                        text.setdefault(i, []).append((k, v))
+                        v = i
+                    column.append(str(v))
+            else:
+                column = list(map(str, values))
+            columns.append(column)
 
+        if len(text) == 0:
+            return list(map(" ".join, zip(*columns)))
+        lines = []
+        for i, row in enumerate(zip(*columns), start=first):
+            lines.append(" ".join(row))
+            for k, v in text.get(i, []):
+                # report the text data
+                lines.append(f"#U {i} {k} {v}")
+        return lines
+
+    def _scan_trailer_lines(self):
+        """Comment lines of the scan, after the scan data."""
+        lines = []
         for v in self.comments["event"]:
             lines.append("#C " + v)
 
@@ -528,6 +668,63 @@ class SpecWriterCallback(object):
 
         return lines
 
+    def _stream_open(self):
+        """Streaming: write the scan header and keep the file open."""
+        self._uid_index_update()  # in case the file was changed elsewhere
+        if self.uid in self.uid_index:
+            # raise exception if uid is already in the file!
+            msg = f"{self.spec_filename} already contains uid={self.uid}"
+            raise ValueError(msg)
+        lines = self._scan_header_lines()
+        if self.write_new_header:
+            self.write_header()
+            logger.info("wrote header to SPEC file: %s", self.spec_filename)
+        self._stream = open(self.spec_filename, "a")
+        self._stream_comments = {k: len(self.comments[k]) for k in ("start", "descriptor")}
+        self._stream_rows = 0
+        self._stream_write(lines, flush=True)
+
+    def _stream_write(self, lines, flush=False):
+        """Streaming: write lines, flush if requested or at the interval."""
+        if len(lines) > 0:
+            self._stream.write("\n".join(lines) + "\n")
+        now = time.time()
+        if flush or now - self._stream_flushed >= self.flush_interval:
+            self._stream.flush()
+            self._stream_flushed = now
+
+    def _stream_rows_write(self):
+        """Streaming: write the rows not yet written."""
+        lines = self._scan_data_lines(self._stream_rows, self.num_primary_data)
+        self._stream_rows = self.num_primary_data
+        self._stream_write(lines)
+
+    def _stream_close(self):
+        """Streaming: close the file."""
+        try:
+            self._stream.close()
+        finally:
+            self._stream = None
+
+    def _stream_finish(self):
+        """Streaming: write the rest of the scan and close the file."""
+        self._stream_rows_write()
+        lines = []
+        for k, n in self._stream_comments.items():
+            # comments received after the scan header was written
+            lines += ["#C " + v for v in self.comments[k][n:]]
+        lines += self._scan_trailer_lines()
+        self._stream_write(lines, flush=True)
+        self._stream_close()
+        logger.info(
+            "wrote scan %d to SPEC file: %s",
+            self.scan_id,
+            self.spec_filename,
+        )
+        self._uid_index_update()  # just the new scan
+        if self.uid_index_sidecar:
+            self._uid_index_save()
+
     def _write_lines_(self, lines, mode="a"):
         """write (more) lines to the file"""
         with open(self.spec_filename, mode) as f:
@@ -563,6 +760,111 @@ class SpecWriterCallback(object):
         self._write_lines_(lines, mode="a+")
         self.write_new_header = False
 
+    def _uid_index_reset(self):
+        """Empty the index of uids in the SPEC file."""
+        self.uid_index = {}  # key: uid, value: scan number (str)
+        self._uid_index_file = None  # index of this file
+        self._uid_index_offset = 0  # bytes of file already indexed
+        self._uid_index_max_scan = None  # highest #S scan number
+        self._uid_index_num_scans = 0  # number of #S lines
+        self._uid_index_scan = None  # most recent #S scan number
+        self._uid_index_tail = b""  # last bytes indexed, to detect changes
+
+    @property
+    def _uid_index_sidecar_file(self):
+        path = pathlib.Path(self.spec_filename)
+        return path.with_name(path.name + UID_INDEX_SIDECAR_SUFFIX)
+
+    def _uid_index_load(self):
+        """
+        Start a new index for the SPEC file.
+
+        Read the sidecar file, if allowed.  Otherwise, the index is built
+        (from the SPEC file) when first needed.  Return ``True`` if the index
+        was read from the sidecar file.
+        """
+        self._uid_index_reset()
+        self._uid_index_file = pathlib.Path(self.spec_filename)
+        sidecar = self._uid_index_sidecar_file
+        if not (self.uid_index_sidecar and sidecar.exists()):
+            return False
+        try:
+            with open(sidecar, "r") as f:
+                content = json.load(f)
+            self.uid_index = dict(content["uids"])
+            self._uid_index_offset = int(content["offset"])
+            self._uid_index_max_scan = content["max_scan"]
+            self._uid_index_num_scans = int(content["num_scans"])
+            self._uid_index_scan = content["scan"]
+            self._uid_index_tail = bytes.fromhex(content["tail"])
+        except (OSError, KeyError, TypeError, ValueError) as exc:
+            logger.warning("Ignoring SPEC uid index file %s: %s", sidecar, exc)
+            self._uid_index_reset()
+            self._uid_index_file = pathlib.Path(self.spec_filename)
+            return False
+        self._uid_index_update()  # anything added after the sidecar was written
+        return self._uid_index_offset > 0
+
+    def _uid_index_save(self):
+        """Write the index to the sidecar file."""
+        content = dict(
+            spec_file=self._uid_index_file.name,
+            offset=self._uid_index_offset,
+            max_scan=self._uid_index_max_scan,
+            num_scans=self._uid_index_num_scans,
+            scan=self._uid_index_scan,
+            tail=self._uid_index_tail.hex(),
+            uids=self.uid_index,
+        )
+        try:
+            with open(self._uid_index_sidecar_file, "w") as f:
+                json.dump(content, f)
+        except OSError as exc:
+            logger.warning("Could not write SPEC uid index file: %s", exc)
+
+    def _uid_index_update(self):
+        """Add new content of the SPEC file to the uid index."""
+        path = pathlib.Path(self.spec_filename)
+        if self._uid_index_file != path:
+            self._uid_index_load()  # a different file: start again
+        if not path.exists():
+            if self._uid_index_offset > 0:
+                self._uid_index_reset()
+                self._uid_index_file = path
+            return
+        with open(path, "rb") as f:
+            size = f.seek(0, 2)
+            tail = self._uid_index_tail
+            if size < self._uid_index_offset:
+                changed = True  # file is smaller
+            else:
+                f.seek(self._uid_index_offset - len(tail))
+                changed = f.read(len(tail)) != tail
+            if changed:
+                logger.info("SPEC file %s changed, rebuilding uid index.", path)
+                self._uid_index_reset()
+                self._uid_index_file = path
+            f.seek(self._uid_index_offset)
+            buf = f.read()
+
+        end = buf.rfind(b"\n") + 1  # index only complete lines
+        for line in buf[:end].decode("utf8", errors="replace").splitlines():
+            if line.startswith("#S "):
+                parts = line.split()
+                self._uid_index_scan = parts[1] if len(parts) > 1 else None
+                self._uid_index_num_scans += 1
+                try:
+                    number = float(self._uid_index_scan)
+                    self._uid_index_max_scan = max(number, self._uid_index_max_scan or number)
+                except (TypeError, ValueError):
+                    pass
+            for uid in UID_PATTERN.findall(line):
+                self.uid_index.setdefault(uid, self._uid_index_scan)
+        if end > 0:
+            self._uid_index_offset += end
+            self._uid_index_tail = (tail if not changed else b"") + buf[:end]
+            self._uid_index_tail = self._uid_index_tail[-64:]
+
     def write_scan(self):
         """
         write the most recent (completed) scan to the file
@@ -573,13 +875,11 @@ class SpecWriterCallback(object):
 
         note:  does nothing if there are no lines to be written
         """
-        if self.spec_filename.exists():
-            with open(self.spec_filename) as f:
-                buf = f.read()
-                if buf.find(self.uid) >= 0:
-                    # raise exception if uid is already in the file!
-                    msg = f"{self.spec_filename} already contains uid={self.uid}"
-                    raise ValueError(msg)
+        self._uid_index_update()  # in case the file was changed elsewhere
+        if self.uid in self.uid_index:
+            # raise exception if uid is already in the file!
+            msg = f"{self.spec_filename} already contains uid={self.uid}"
+            raise ValueError(msg)
         logger = logging.getLogger(__name__)
         lines = self.prepare_scan_contents()
         lines.append("")
@@ -593,6 +893,9 @@ class SpecWriterCallback(object):
                 self.scan_id,
                 self.spec_filename,
             )
+            self._uid_index_update()  # just the new scan
+            if self.uid_index_sidecar:
+                self._uid_index_save()
 
     def make_default_filename(self):
         """generate a file name to be used as default"""
@@ -605,19 +908,17 @@ class SpecWriterCallback(object):
         prepare to use a new SPEC data file
 
         but don't create it until we have data
+
+        If the file exists, the next scan number is (at least) the highest
+        used, found from the uid index (read from the sidecar file, if
+        available, or built from the file).
         """
         self.clear()
         filename = pathlib.Path(filename or self.make_default_filename())
-        if filename.exists():
-            from spec2nexus.spec import SpecDataFile
-
-            sdf = SpecDataFile(filename)
-            scan_list = sdf.getScanNumbers()
-            l = len(scan_list)
-            m = max(map(float, scan_list))
-            highest = int(max(l, m) + 0.9999)  # solves issue #128
-            scan_id = max(scan_id or 0, highest)
         self.spec_filename = filename
+        self._uid_index_load()
+        if filename.exists():
+            scan_id = max(scan_id or 0, self._highest_scan_number())
         self.spec_epoch = int(time.time())  # ! no roundup here!!!
         self.spec_host = socket.gethostname() or "localhost"
         self.spec_user = getpass.getuser() or "BlueskyUser"
@@ -635,11 +936,31 @@ class SpecWriterCallback(object):
             self.scan_id = scan_id
         return self.spec_filename
 
+    def _highest_scan_number(self):
+        """
+        Highest scan number used in the SPEC file.
+
+        From the uid index, which is read from the sidecar file (if
+        available) or built from the ``#S`` lines of the SPEC file.
+        """
+        # solves issue #128: the next scan number must exceed both the number
+        # of scans and the highest scan number (such as "12.1") in the file.
+        self._uid_index_update()  # builds the index if not read from sidecar
+        count = self._uid_index_num_scans
+        highest = self._uid_index_max_scan or 0
+        return int(max(count, highest) + 0.9999)
+
     def usefile(self, filename):
-        """read from existing SPEC data file"""
-        if not self.spec_filename.exists():
+        """
+        read from existing SPEC data file
+
+        Only the first (header) lines of the file are parsed.  The highest
+        scan number is found from the uid index (read from the sidecar file,
+        if available, or built from the file).
+        """
+        filename = pathlib.Path(filename)
+        if not filename.exists():
             raise IOError(f"file {filename} does not exist")
-        scan_id = None
         with open(filename, "r") as f:
             key = "#F"
             line = f.readline().strip()
@@ -667,19 +988,11 @@ class SpecWriterCallback(object):
             if len(p) > 4 and p[2] == "user":
                 username = p[4]
 
-            # find the highest scan number used
-            key = "#S"
-            scan_ids = []
-            for line in f.readlines():
-                if line.startswith(key + " ") and len(line.split()) > 1:
-                    scan_id = int(line.split()[1])
-                    scan_ids.append(scan_id)
-            scan_id = max(scan_ids)
-
         self.spec_filename = filename
+        self._uid_index_load()
         self.spec_epoch = epoch
         self.spec_user = username
-        return scan_id
+        return self._highest_scan_number()
 
 
 def spec_comment(comment, doc=None, writer=None):
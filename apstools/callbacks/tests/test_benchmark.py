@@ -0,0 +1,59 @@
+"""
+unit tests for the callback benchmark
+"""
+
+from .. import benchmark_callbacks
+from .. import default_benchmark_callbacks
+from .. import SignalStatsCallback
+from .. import synthetic_run_documents
+
+
+def test_synthetic_run_documents(tmp_path):
+    documents = synthetic_run_documents(
+        num_events=5,
+        num_signals=3,
+        num_baseline=4,
+        image_shape=(8, 10),
+        image_path=tmp_path,
+    )
+    keys = [key for key, doc in documents]
+    assert keys[0] == "start"
+    assert keys[-1] == "stop"
+    assert keys.count("descriptor") == 2
+    assert keys.count("resource") == 1
+    assert keys.count("datum") == 5
+    assert keys.count("event") == 5 + 2  # primary + baseline
+    descriptors = {doc["name"]: doc for key, doc in documents if key == "descriptor"}
+    assert len(descriptors["baseline"]["data_keys"]) == 4
+    assert "s002" in descriptors["primary"]["data_keys"]
+    assert descriptors["primary"]["data_keys"]["det_image"]["shape"] == [8, 10]
+    assert (tmp_path / "images_00001.h5").exists()
+
+
+def test_benchmark_callbacks(tmp_path):
+    documents = synthetic_run_documents(num_events=20, num_signals=3, num_baseline=10)
+    results = benchmark_callbacks(documents, path=tmp_path, report=False)
+    assert sorted(results) == sorted(default_benchmark_callbacks(tmp_path))
+    for result in results.values():
+        assert result["documents"] == len(documents)
+        assert result["docs_per_s"] > 0
+        assert result["stop_to_file"] >= 0
+        assert result["peak_rss"] > 0
+    assert len(list(tmp_path.glob("*.hdf"))) == 2  # NXWriter & NXWriterAPS
+    assert len(list(tmp_path.glob("*.dat"))) == 1
+
+
+def test_benchmark_rate():
+    documents = synthetic_run_documents(num_events=20, num_signals=3, num_baseline=0)
+    stats = []
+
+    def signal_stats():
+        stats.append(SignalStatsCallback())
+        stats[-1].stop_report = False
+        return stats[-1]
+
+    rate = 200
+    results = benchmark_callbacks(documents, callbacks=dict(stats=signal_stats), rate=rate)
+    assert results["stats"]["elapsed"] >= (len(documents) - 1) / rate
+    assert sorted(stats[0]._registers) == ["s000", "s001", "s002"]
+    assert stats[0]._registers["s000"].n == 20
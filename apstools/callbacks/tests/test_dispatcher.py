@@ -0,0 +1,133 @@
+"""
+unit tests for the CallbackDispatcher
+"""
+
+import queue
+import threading
+
+import pytest
+
+from .. import CallbackDispatcher
+from .. import SignalStatsCallback
+from .test_scan_signal_statistics import scan_documents
+
+
+class Recorder:
+    """Callback that remembers the document names it received."""
+
+    def __init__(self, gate=None):
+        self.names = []
+        self.gate = gate
+        self.thread = None
+
+    def receiver(self, key, doc):
+        if self.gate is not None:
+            self.gate.wait(timeout=10)
+        self.thread = threading.current_thread()
+        self.names.append(key)
+
+
+def test_CallbackDispatcher():
+    documents = list(scan_documents(num=5))
+    recorder = Recorder()
+    stats = SignalStatsCallback()
+    stats.stop_report = False
+    dispatcher = CallbackDispatcher(recorder.receiver, stats.receiver)
+
+    for key, doc in documents:
+        dispatcher.receiver(key, doc)
+    assert dispatcher.flush(timeout=10)
+
+    assert recorder.names == [key for key, doc in documents]
+    assert recorder.thread is not threading.current_thread()
+    assert stats._registers["det"].n == 5
+
+    report = dispatcher.report()
+    assert report["queued"] == 0
+    assert report["queue_wait"]["count"] == len(documents)
+    assert list(report["callbacks"]) == ["Recorder.receiver", "SignalStatsCallback.receiver"]
+    for counters in report["callbacks"].values():
+        assert counters["count"] == len(documents)
+        assert counters["max"] >= counters["mean"] >= 0
+
+    dispatcher.close(timeout=10)
+    assert dispatcher._thread is None
+
+
+def test_CallbackDispatcher_errors():
+    def failing(key, doc):
+        if key == "descriptor":
+            raise RuntimeError("intentional")
+
+    recorder = Recorder()
+    dispatcher = CallbackDispatcher(failing)
+    dispatcher.subscribe(recorder.receiver)
+    for key, doc in scan_documents(num=2):
+        dispatcher.receiver(key, doc)
+    assert dispatcher.flush(timeout=10)
+    assert recorder.names == "start descriptor event event stop".split()
+    assert len(dispatcher.errors) == 1
+    name, key, exc = dispatcher.errors[0]
+    assert key == "descriptor"
+    assert isinstance(exc, RuntimeError)
+    dispatcher.close()
+
+
+@pytest.mark.parametrize("overflow", "block drop raise".split())
+def test_CallbackDispatcher_overflow(overflow):
+    gate = threading.Event()
+    recorder = Recorder(gate=gate)
+    dispatcher = CallbackDispatcher(recorder.receiver, queue_size=2, overflow=overflow)
+    documents = list(scan_documents(num=5))
+
+    if overflow == "block":
+        sender = threading.Thread(target=lambda: [dispatcher.receiver(*item) for item in documents])
+        sender.start()
+        sender.join(timeout=0.5)
+        assert sender.is_alive()  # waiting for space in the queue
+        gate.set()
+        sender.join(timeout=10)
+        expected = [key for key, doc in documents]
+    elif overflow == "drop":
+        for key, doc in documents[:-1]:  # not the stop document
+            dispatcher.receiver(key, doc)
+        assert dispatcher.dropped > 0
+        gate.set()
+        dispatcher.receiver(*documents[-1])
+        expected = ["start", "descriptor"] + (5 - dispatcher.dropped) * ["event"] + ["stop"]
+    else:
+        with pytest.raises(queue.Full):
+            for key, doc in documents:
+                dispatcher.receiver(key, doc)
+        gate.set()
+        expected = None
+
+    assert dispatcher.flush(timeout=10)
+    if expected is not None:
+        assert recorder.names == expected
+    dispatcher.close()
+
+
+def test_CallbackDispatcher_plan():
+    from bluesky import RunEngine
+    from bluesky import plans as bp
+    from bluesky import preprocessors as bpp
+    from ophyd.sim import det
+    from ophyd.sim import motor
+
+    recorder = Recorder()
+    dispatcher = CallbackDispatcher(recorder.receiver)
+
+    def plan():
+        yield from bpp.subs_wrapper(bp.scan([det], motor, -1, 1, 3), dispatcher.receiver)
+        yield from dispatcher.flush_plan_stub()
+        assert dispatcher.pending == 0
+        assert recorder.names[-1] == "stop"
+
+    RE = RunEngine({})
+    RE(plan())
+    assert recorder.names.count("event") == 3
+    dispatcher.close()
+
+    with pytest.raises(ValueError):
+        CallbackDispatcher(overflow="unknown")
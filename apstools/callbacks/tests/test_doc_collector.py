@@ -0,0 +1,102 @@
+"""
+unit tests for the DocumentCollectorCallback
+"""
+
+import numpy
+import pytest
+
+from .. import DocumentCollectorCallback
+from .test_scan_signal_statistics import paged
+from .test_scan_signal_statistics import scan_documents
+
+
+def test_event_page():
+    collector = DocumentCollectorCallback()
+    for tag, doc in paged(scan_documents(num=5)):
+        collector.receiver(tag, doc)
+
+    assert len(collector.documents["event_page"]) == 1
+    assert "event" not in collector.documents
+    # start, descriptor, 5 events, stop
+    assert len(collector.uids) == 1 + 1 + 5 + 1
+
+
+def test_journal(tmp_path):
+    journal = tmp_path / "journal"
+    collector = DocumentCollectorCallback(journal=journal, ring_size=10)
+    runs = []
+    for i in range(3):
+        documents = list(scan_documents(num=5, center=i / 10))
+        if i == 1:
+            documents = list(paged(documents))
+        runs.append(documents)
+        for tag, doc in documents:
+            collector.receiver(tag, doc)
+
+    assert len(collector.uids) == 10
+    assert len(collector.recent) == 10
+    assert list(collector.documents) == ["start", "stop"]
+    assert collector.documents["start"] == runs[-1][0][1]
+
+    start_uids = [documents[0][1]["uid"] for documents in runs]
+    assert list(collector.runs) == start_uids
+    assert collector.runs[start_uids[0]]["counts"] == dict(start=1, descriptor=1, event=5, stop=1)
+    assert collector.runs[start_uids[1]]["counts"] == dict(start=1, descriptor=1, event_page=1, stop=1)
+
+    for documents in runs:
+        for tag, doc in documents:
+            token = doc.get("uid") or doc.get("datum_id")
+            for uid in token if isinstance(token, list) else [token]:
+                assert collector.get_document(uid) == (tag, doc)
+    stops = collector.get_documents("stop")
+    assert stops == [documents[-1][1] for documents in runs]
+    events = collector.get_documents("event", run_uid=start_uids[2])
+    assert events == [doc for tag, doc in runs[2] if tag == "event"]
+    with pytest.raises(KeyError):
+        collector.get_document("no such uid")
+
+
+def test_journal_rotation(tmp_path):
+    journal = tmp_path / "journal"
+    collector = DocumentCollectorCallback(journal=journal, journal_file_bytes=2000, journal_files=3)
+    start_uids = []
+    for i in range(20):
+        for tag, doc in scan_documents(num=5):
+            if tag == "start":
+                start_uids.append(doc["uid"])
+            doc = dict(doc, array=numpy.arange(3))  # numpy content, too
+            collector.receiver(tag, doc)
+    collector.close()
+
+    files = sorted(journal.iterdir())
+    assert len(files) == 3
+    assert max(path.stat().st_size for path in files) < 4000
+    assert len(collector.runs) < 20
+    assert start_uids[-1] in collector.runs
+    assert start_uids[0] not in collector.runs
+    with pytest.raises(KeyError):
+        collector.get_document(start_uids[0])
+    tag, doc = collector.get_document(start_uids[-1])
+    assert tag == "start"
+    assert doc["array"] == [0, 1, 2]
+    assert len(collector.get_documents("stop")) >= len(collector.runs)  # some runs started in removed files
+
+    # Continue the journal with new files.
+    collector = DocumentCollectorCallback(journal=journal)
+    for tag, doc in scan_documents(num=5):
+        collector.receiver(tag, doc)
+    collector.close()
+    assert sorted(journal.iterdir())[:3] == files
+    assert len(list(journal.iterdir())) == 4
+
+
+def test_get_document():
+    collector = DocumentCollectorCallback()
+    documents = list(paged(scan_documents(num=5)))
+    for tag, doc in documents:
+        collector.receiver(tag, doc)
+    tag, doc = documents[2]
+    assert tag == "event_page"
+    assert collector.get_document(doc["uid"][3]) == (tag, doc)
+    assert collector.get_documents("stop") == [documents[-1][1]]
+    assert collector.get_documents("stop", run_uid="other") == []
@@ -2,10 +2,13 @@
 unit tests for the filewriters
 """
 
+import concurrent.futures
+import os
 import pathlib
 import tempfile
 
 import databroker
+import event_model
 import h5py
 import numpy
 import pytest
@@ -15,9 +18,14 @@ from ...utils import replay
 from .. import NEXUS_FILE_EXTENSION
 from .. import NEXUS_RELEASE
 from .. import NXWriter
+from .. import FileWriterProcess
 from .. import NXWriterAPS
 from .. import SpecWriterCallback
+from ..callback_base import BufferMemory
+from ..callback_base import ColumnBuffer
 from ..callback_base import FileWriterCallbackBase
+from ..process_writer import _export_arrays
+from ..process_writer import _import_arrays
 
 CATALOG = "usaxs_test"
 TUNE_AR = 103  # <-- scan_id,  uid: "3554003"
@@ -49,6 +57,22 @@ def write_stream(specwriter, stream):
         specwriter.receiver(tag, doc)
 
 
+def paged(documents):
+    """Replace consecutive event documents with an event_page document."""
+    events = []
+    for tag, doc in documents:
+        if tag == "event" and (len(events) == 0 or doc["descriptor"] == events[0]["descriptor"]):
+            events.append(doc)
+            continue
+        if len(events) > 0:
+            yield "event_page", event_model.pack_event_page(*events)
+            events = []
+        if tag == "event":
+            events.append(doc)
+        else:
+            yield tag, doc
+
+
 @pytest.mark.parametrize(
     "ref, md_tag, md_key, md_value",
     [
@@ -290,6 +314,454 @@ def test_NXWriter_receiver_battery(cat, tempdir):
             assert "undulator" not in nxinstrument
 
 
+def test_NXWriter_streaming(cat, tempdir):
+    """Streaming mode writes the same content as the default mode."""
+    files = {}
+    for streaming in (False, True):
+        callback = NXWriter()
+        callback.warn_on_missing_content = False
+        callback.streaming = streaming
+        callback.streaming_batch_size = 5  # several batches per stream
+        callback.file_name = tempdir / f"streaming_{streaming}.h5"
+
+        replay(cat.v1[TUNE_MR], callback.receiver)
+        callback.wait_writer()
+        assert callback.root is None
+        assert callback.file_name.exists()
+        files[streaming] = callback.file_name
+
+    with h5py.File(files[False], "r") as reference, h5py.File(files[True], "r") as streamed:
+        addresses = []
+        reference.visit(addresses.append)
+        streamed_addresses = []
+        streamed.visit(streamed_addresses.append)
+        assert sorted(addresses) == sorted(streamed_addresses)
+
+        for addr in addresses:
+            if not isinstance(reference[addr], h5py.Dataset):
+                continue
+            if addr.endswith("file_time"):
+                continue
+            assert numpy.array_equal(reference[addr][()], streamed[addr][()]), f"{addr=}"
+
+        primary = streamed["/entry/instrument/bluesky/streams/primary"]
+        ds = primary["I0_USAXS/value"]
+        assert ds.maxshape == (None,)
+        assert ds.chunks is not None
+        assert ds.shape == primary["I0_USAXS/EPOCH"].shape
+
+
+def test_NXWriter_streaming_same_file(cat, tempdir):
+    """Streaming back-to-back runs to the same file waits for the writer."""
+    callback = NXWriter()
+    callback.warn_on_missing_content = False
+    callback.streaming = True
+    callback.file_name = tempdir / "same_file.h5"
+
+    uids = [cat.v1[ref].start["uid"] for ref in (TUNE_MR, -1)]
+    for uid in uids:
+        replay(cat.v1[uid], callback.receiver)  # no wait between runs
+    assert callback.wait_writer() == {}
+    with h5py.File(callback.file_name, "r") as root:
+        assert root["/entry/entry_identifier"][()].decode() == uids[-1]
+
+
+def test_NXWriter_streaming_no_stop(cat, tempdir):
+    """Streaming: a run without a stop document does not keep its file open."""
+    callback = NXWriter()
+    callback.warn_on_missing_content = False
+    callback.streaming = True
+    callback.file_name = tempdir / "no_stop.h5"
+
+    for key, doc in cat.v1[TUNE_MR].documents():
+        if key == "descriptor":
+            callback.receiver(key, doc)
+            break
+        callback.receiver(key, doc)  # start
+    abandoned = callback.root
+    assert abandoned
+
+    uid = cat.v1[-1].start["uid"]
+    replay(cat.v1[uid], callback.receiver)  # start, descriptor, ..., stop
+    assert not abandoned  # closed
+    assert callback.wait_writer() == {}
+    with h5py.File(callback.file_name, "r") as root:
+        assert root["/entry/entry_identifier"][()].decode() == uid
+
+
+def test_NXWriter_writer_pool(cat, tempdir):
+    """Back-to-back runs: each file has the content of its own run."""
+    callback = NXWriter()
+    callback.warn_on_missing_content = False
+    callback.file_path = str(tempdir)
+    callback.writer_pool_size = 2
+    callback.writer_queue_depth = 2
+
+    files = {}
+    for uid in cat:
+        replay(cat.v1[uid], callback.receiver)  # no wait between runs
+        files[uid] = pathlib.Path(callback.make_file_name())
+
+    for uid, fname in files.items():
+        callback.wait_writer(uid)
+        assert fname.exists()
+        with h5py.File(fname, "r") as nxroot:
+            assert to_string(nxroot["/entry/entry_identifier"][()]) == uid
+            run = cat.v1[uid]
+            streams = nxroot["/entry/instrument/bluesky/streams"]
+            assert sorted(streams) == sorted(run.stream_names)
+
+    callback.wait_writer()
+    assert not callback._writer_active
+    assert len(callback._writer_futures) == 0
+    assert list(callback.wait_writer_plan_stub()) == []
+
+
+def test_FileWriterCallbackBase_writer_errors():
+    """Failed writers are reported once by wait_writer(), and not kept forever."""
+
+    class FailingWriter(FileWriterCallbackBase):
+        def writer(self):
+            self.submit_writer(lambda snapshot: 1 / 0)
+
+    def run(callback):
+        run = event_model.compose_run(metadata=dict(plan_name="count", scan_id=1))
+        callback.receiver("start", run.start_doc)
+        callback.receiver("stop", run.compose_stop())
+        return run.start_doc["uid"]
+
+    callback = FailingWriter()
+    callback.max_writer_errors = 3
+    callback.writer_pool_size = 1  # runs fail in order
+    uids = [run(callback) for _ in range(5)]
+    assert len(callback.wait_writer()) == 3  # only the newest failures were kept
+    assert list(callback._writer_errors) == []
+
+    uids = [run(callback) for _ in range(5)]
+    concurrent.futures.wait(callback._pending_writers())
+    assert callback.wait_writer(uids[0]) == {}  # the oldest was forgotten
+    assert list(callback._writer_errors) == uids[-3:]
+    errors = callback.wait_writer(uids[-1])
+    assert list(errors) == [uids[-1]]
+    assert isinstance(errors[uids[-1]], ZeroDivisionError)
+    assert list(callback._writer_errors) == uids[-3:-1]
+    assert list(callback.wait_writer()) == uids[-3:-1]
+    assert callback._writer_errors == {}
+
+
+@pytest.mark.parametrize(
+    "dtype, values, kind, shape",
+    [
+        ["number", [1.5, 2, 3], "f", (3,)],
+        ["integer", list(range(40)), "i", (40,)],  # grows
+        ["integer", [1, 2, 3.5], "f", (3,)],  # promoted
+        ["boolean", [True, False], "b", (2,)],
+        ["array", [[1, 2], [3, 4], [5, 6]], "i", (3, 2)],
+        ["array", [[1, 2], [3, 4, 5]], None, None],  # ragged
+        ["number", [1.0, None], None, None],  # mixed
+        ["string", ["a", "bc"], None, None],
+        ["number", [2**70, 1], None, None],  # too big
+    ],
+)
+def test_ColumnBuffer(dtype, values, kind, shape):
+    for how in "append extend".split():
+        buffer = ColumnBuffer(dtype)
+        if how == "append":
+            for value in values:
+                buffer.append(value)
+        else:
+            buffer.extend(values[:1])
+            buffer.extend(values[1:])
+        assert len(buffer) == len(values)
+        if kind is None:
+            assert isinstance(buffer.values, list)
+            assert [numpy.asarray(v).tolist() for v in buffer] == values
+        else:
+            assert isinstance(buffer.values, numpy.ndarray)
+            assert buffer.values.dtype.kind == kind
+            assert buffer.values.shape == shape
+            assert numpy.array_equal(buffer.values, numpy.array(values))
+
+        buffer.clear()
+        assert len(buffer) == 0
+
+
+def test_ColumnBuffer_spill(tempdir):
+    memory = BufferMemory(limit=1000, directory=tempdir)
+    small = ColumnBuffer("number", memory=memory)
+    small.extend([1.0, 2.0])
+    assert not small.spilled
+    assert memory.used == 16 * 8
+
+    buffer = ColumnBuffer("integer", memory=memory)
+    for i in range(50):
+        buffer.append(i)
+    assert not buffer.spilled
+    buffer.extend(numpy.arange(50, 200))
+    assert buffer.spilled
+    assert isinstance(buffer.values, numpy.memmap)
+    assert numpy.array_equal(buffer.values, numpy.arange(200))
+    assert memory.used == 16 * 8  # just the small buffer
+    assert memory.spilled >= 200 * 8
+
+    buffer.append(200.5)  # promote, while spilled
+    assert buffer.spilled
+    assert buffer.values.dtype.kind == "f"
+    assert buffer.values[-1] == 200.5
+    assert numpy.array_equal(buffer.values[:200], numpy.arange(200))
+
+    buffer.append("text")  # values of mixed type
+    assert not buffer.spilled
+    assert len(buffer) == 202
+    assert buffer.values[-2:] == [200.5, "text"]
+    assert memory.spilled == 0
+
+
+def test_NXWriter_buffer_memory_limit(cat, tempdir):
+    run = cat.v1[TUNE_MR]
+    results = {}
+    for limit in (None, 0):
+        callback = NXWriter()
+        callback.warn_on_missing_content = False
+        callback.file_path = tempdir / str(limit)
+        callback.file_path.mkdir()
+        callback.buffer_memory_limit = limit
+        callback.buffer_spill_directory = tempdir
+        replay(run, callback.receiver)
+        if limit == 0:
+            assert callback.buffer_memory.used == 0
+            assert callback.buffer_memory.spilled > 0
+        callback.wait_writer()
+
+        address = "/entry/instrument/bluesky/streams/primary"
+        with h5py.File(callback.output_nexus_file, "r") as root:
+            group = root[address]
+            results[limit] = {k: group[f"{k}/value"][()] for k in group}
+
+    assert sorted(results[None]) == sorted(results[0])
+    for k, v in results[None].items():
+        assert numpy.array_equal(v, results[0][k]), k
+    assert list(tempdir.glob("apstools-buffer-*")) == []  # anonymous files
+
+
+def test_FileWriterProcess_shared_memory():
+    image = numpy.arange(24, dtype="uint16").reshape((2, 3, 4))
+    doc = dict(data=dict(image=image, small=numpy.arange(3), n=1), seq_num=[1, 2])
+    segments = []
+    exported = _export_arrays(doc, image.nbytes, segments)
+    assert segments == [image.nbytes]
+    assert exported is not doc
+    assert isinstance(exported["data"]["image"], dict)
+    assert exported["data"]["small"] is doc["data"]["small"]
+    assert exported["seq_num"] is doc["seq_num"]
+
+    restored = _import_arrays(exported)
+    assert numpy.array_equal(restored["data"]["image"], image)
+    assert restored["data"]["image"].dtype == image.dtype
+    assert restored["data"]["n"] == 1
+
+    assert _export_arrays(doc, image.nbytes + 1, segments) is doc
+
+
+def test_FileWriterProcess(cat, tempdir):
+    """NXWriter in a separate process writes the same content."""
+    run = cat.v1[TUNE_MR]
+    uid = run.start["uid"]
+    path = tempdir / "process"
+    path.mkdir()
+
+    callback = FileWriterProcess(
+        NXWriter,
+        file_path=path,
+        warn_on_missing_content=False,
+    )
+    replay(run, callback.receiver)
+    assert callback.wait(uid, timeout=60)
+
+    health = callback.health()
+    assert health["alive"]
+    assert health["pending_runs"] == []
+    assert health["runs_failed"] == 0
+
+    report = callback.reports[uid]
+    assert report["status"] == "ok"
+    assert report["documents"]["start"] == 1
+    assert report["documents"]["stop"] == 1
+    assert report["num_documents"] == len(list(run.documents()))
+    assert report["latency"]["max"] >= report["latency"]["mean"] > 0
+    callback.close()
+    assert callback.process is None
+
+    reference = NXWriter()
+    reference.warn_on_missing_content = False
+    reference.file_path = str(tempdir)
+    replay(run, reference.receiver)
+    reference.wait_writer()
+
+    fname = pathlib.Path(report["file_name"])
+    assert fname.exists()
+    assert fname.parent.name == "process"
+    address = "/entry/instrument/bluesky/streams/primary"
+    with h5py.File(fname, "r") as h5, h5py.File(reference.output_nexus_file, "r") as ref:
+        assert sorted(h5[address]) == sorted(ref[address])
+        for key in ref[address]:
+            assert numpy.array_equal(h5[f"{address}/{key}/value"][()], ref[f"{address}/{key}/value"][()])
+
+
+class CrashingWriter:
+    """File writer that ends its process with the descriptor document."""
+
+    def receiver(self, key, doc):
+        if key == "descriptor":
+            os._exit(3)
+
+
+def test_FileWriterProcess_crash():
+    """Runs pending in a writer process that ended are reported as failed."""
+    from multiprocessing import shared_memory
+
+    image = numpy.arange(64 * 1024, dtype="uint16")
+
+    def run_documents():
+        run = event_model.compose_run(metadata=dict(plan_name="count"))
+        stream = run.compose_descriptor(
+            name="primary",
+            data_keys=dict(image=dict(source="PV:image", dtype="array", shape=list(image.shape))),
+        )
+        event = stream.compose_event(data=dict(image=image), timestamps=dict(image=0))
+        return run.start_doc["uid"], [
+            ("start", run.start_doc),
+            ("descriptor", stream.descriptor_doc),
+            ("event", event),  # The writer process ends before reading this.
+        ]
+
+    callback = FileWriterProcess(CrashingWriter)
+    callback.start_method = "fork"  # CrashingWriter is defined in this test module.
+    uid, documents = run_documents()
+    for key, doc in documents:
+        callback.receiver(key, doc)
+    callback.process.join(60)
+    assert callback.process.exitcode == 3
+    segments = list(callback._segments[uid])
+    assert len(segments) == 1
+
+    assert not callback.wait(uid)  # Does not wait forever.
+    assert callback.pending == []
+    assert callback.reports[uid]["status"] == "error"
+    assert "exitcode=3" in callback.reports[uid]["errors"][0]
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=segments[0])  # released
+
+    # The next run starts a new writer process, which also ends.
+    uid, documents = run_documents()
+    for key, doc in documents:
+        callback.receiver(key, doc)
+    callback.process.join(60)
+    uid2, documents = run_documents()
+    callback.receiver(*documents[0])  # restarts the writer process
+    assert callback.reports[uid]["status"] == "error"
+    assert callback.pending == [uid2]
+    assert callback._segments == {}
+    callback.close()
+    assert callback.reports[uid2]["status"] == "error"
+
+
+def ad_hdf5_documents(path, num_frames=4, shape=(3, 5)):
+    """Document stream of a count with images in an external AD_HDF5 file."""
+    import time
+
+    import event_model
+
+    image_file = path / "images.h5"
+    frames = numpy.arange(num_frames * shape[0] * shape[1], dtype="uint16")
+    with h5py.File(image_file, "w") as root:
+        root.create_dataset("/entry/data/data", data=frames.reshape((num_frames, *shape)))
+
+    run = event_model.compose_run(metadata=dict(plan_name="count", scan_id=1))
+    yield "start", run.start_doc
+    data_keys = dict(
+        camera_image=dict(source="PV:image", dtype="array", shape=list(shape), external="FILESTORE:"),
+    )
+    stream = run.compose_descriptor(name="primary", data_keys=data_keys)
+    yield "descriptor", stream.descriptor_doc
+    resource = run.compose_resource(
+        spec="AD_HDF5",
+        root=str(path),
+        resource_path=image_file.name,
+        resource_kwargs=dict(frame_per_point=1),
+    )
+    yield "resource", resource.resource_doc
+    for i in range(num_frames):
+        datum = resource.compose_datum(datum_kwargs=dict(point_number=i))
+        yield "datum", datum
+        t = time.time()
+        event = stream.compose_event(
+            data=dict(camera_image=datum["datum_id"]),
+            timestamps=dict(camera_image=t),
+            filled=dict(camera_image=False),
+        )
+        yield "event", event
+    yield "stop", run.compose_stop()
+
+
+@pytest.mark.parametrize("mode", "copy link vds".split())
+def test_NXWriter_external_data_mode(mode, tempdir):
+    callback = NXWriter()
+    callback.warn_on_missing_content = False
+    callback.external_data_mode = mode
+    callback.external_copy_frames = 3  # not a divisor of the number of frames
+    callback.file_name = tempdir / f"{mode}.h5"
+    for key, doc in ad_hdf5_documents(tempdir):
+        callback.receiver(key, doc)
+    callback.wait_writer()
+
+    with h5py.File(callback.file_name, "r") as root:
+        group = root["/entry/instrument/bluesky/streams/primary/camera_image"]
+        link = group.get("value", getlink=True)
+        assert isinstance(link, h5py.ExternalLink) == (mode == "link")
+        frames = group["value"]
+        assert frames.shape == (4, 3, 5)
+        assert frames[-1, -1, -1] == 4 * 3 * 5 - 1
+        assert frames.is_virtual == (mode == "vds")
+        assert root["/entry/data/camera_image"].shape == (4, 3, 5)
+
+
+def test_event_page(cat, tempdir):
+    """Event pages give the same content as events."""
+    run = cat.v1[TUNE_MR]
+    assert "event_page" in dict(paged(run.documents()))
+
+    results = {}
+    for style in "event event_page".split():
+        path = tempdir / style
+        path.mkdir()
+        documents = list(run.documents())
+        if style == "event_page":
+            documents = list(paged(documents))
+
+        nxwriter = NXWriter()
+        nxwriter.warn_on_missing_content = False
+        nxwriter.file_path = path
+        specwriter = SpecWriterCallback(filename=path / "spec.dat")
+        for tag, doc in documents:
+            nxwriter.receiver(tag, doc)
+            specwriter.receiver(tag, doc)
+        nxwriter.wait_writer()
+
+        address = "/entry/instrument/bluesky/streams/primary"
+        with h5py.File(nxwriter.output_nexus_file, "r") as root:
+            group = root[address]
+            results[style] = {k: group[f"{k}/value"][()] for k in group}
+        scan = spec2nexus.spec.SpecDataFile(specwriter.spec_filename).getScan(TUNE_MR)
+        results[f"spec_{style}"] = scan.data
+
+    assert len(results["event"]) > 0
+    assert sorted(results["event"]) == sorted(results["event_page"])
+    for k, v in results["event"].items():
+        assert numpy.array_equal(v, results["event_page"][k]), k
+    assert results["spec_event"] == results["spec_event_page"]
+
+
 def test_SpecWriterCallback_writer_default_name(cat, tempdir):
     specwriter = SpecWriterCallback()
     path = pathlib.Path(specwriter.spec_filename).parent
@@ -393,6 +865,119 @@ def test_SpecWriterCallback_newfile_exists(cat, tempdir):
         assert RE.md["scan_id"] == s
 
 
+@pytest.mark.parametrize("sidecar", [False, True])
+def test_SpecWriterCallback_uid_index(cat, tempdir, sidecar):
+    testfile = tempdir / "index.dat"
+    sidecar_file = tempdir / "index.dat.uids.json"
+    specwriter = SpecWriterCallback(filename=testfile, uid_index_sidecar=sidecar)
+    assert specwriter.uid_index == {}
+
+    uids = {}
+    for scan_id in (TUNE_AR, TUNE_MR):
+        run = cat.v1[scan_id]
+        write_stream(specwriter, run.documents())
+        uids[run.start["uid"]] = str(scan_id)
+        # only the new content is read
+        assert specwriter._uid_index_offset == testfile.stat().st_size
+    assert specwriter.uid_index == uids
+    assert sidecar_file.exists() == sidecar
+
+    # duplicate uid is not written
+    another = SpecWriterCallback(filename=tempdir / "another.dat")
+    another.newfile(testfile)
+    with pytest.raises(ValueError) as exinfo:
+        write_stream(another, cat.v1[TUNE_MR].documents())
+    assert "already contains uid" in str(exinfo.value)
+
+    # content added by others is indexed
+    other_uid = "0123abcd-0000-1111-2222-333344445555"
+    with open(testfile, "a") as f:
+        f.write(f"\n#S 999  other\n#D Mon Jan 28 12:48:09 2019\n#C uid = {other_uid}\n")
+    specwriter.uid = other_uid
+    with pytest.raises(ValueError):
+        specwriter.write_scan()
+    assert specwriter.uid_index[other_uid] == "999"
+
+    # reopen (with sidecar, if available)
+    reopened = SpecWriterCallback(filename=tempdir / "other.dat", uid_index_sidecar=sidecar)
+    reopened.newfile(testfile)
+    assert reopened._highest_scan_number() == 999
+    assert len(reopened.uid_index) == 3  # from sidecar or built from the file
+    reopened._uid_index_update()
+    assert reopened.uid_index == specwriter.uid_index
+
+    # file replaced: index is rebuilt
+    testfile.unlink()
+    replacement = SpecWriterCallback(filename=testfile)
+    run = cat.v1[TUNE_AR]
+    write_stream(replacement, run.documents())
+    reopened._uid_index_update()
+    assert reopened.uid_index == {run.start["uid"]: str(TUNE_AR)}
+
+
+def test_SpecWriterCallback_reopen(cat, tempdir):
+    testfile = tempdir / "reopen.dat"
+    specwriter = SpecWriterCallback(filename=testfile)
+    for scan_id in (TUNE_AR, TUNE_MR):
+        write_stream(specwriter, cat.v1[scan_id].documents())
+
+    reopened = SpecWriterCallback(filename=testfile)  # calls usefile()
+    assert reopened.spec_filename == testfile
+    assert reopened.usefile(testfile) == TUNE_MR
+    assert reopened.spec_user == specwriter.spec_user
+
+
+def test_SpecWriterCallback_decreasing_scan_numbers(tempdir):
+    # issue #128: scan numbers in the file may decrease
+    testfile = tempdir / "decreasing.dat"
+    header = (
+        "#F decreasing.dat\n"
+        "#E 1700000000\n"
+        "#D Tue Nov 14 16:13:20 2023\n"
+        "#C Bluesky  user = bsuser  host = host\n"
+    )
+    scans = ["#S 12.1  scan\n", "#S 3  scan\n", "#S 2  scan\n"]
+    testfile.write_text(header + "\n".join(scans) + "#C no newline after this #S 99")
+
+    specwriter = SpecWriterCallback()
+    assert specwriter.usefile(testfile) == 13  # highest
+
+    testfile.write_text(header + "\n".join(["#S 2  scan\n"] * 5))
+    specwriter = SpecWriterCallback()
+    assert specwriter.usefile(testfile) == 5  # number of scans
+
+
+def test_SpecWriterCallback_streaming(cat, tempdir):
+    reference = tempdir / "reference.dat"
+    specwriter = SpecWriterCallback(filename=reference)
+    for scan_id in (TUNE_AR, TUNE_MR):
+        write_stream(specwriter, cat.v1[scan_id].documents())
+
+    testfile = tempdir / "streaming.dat"
+    specwriter = SpecWriterCallback(filename=testfile, streaming=True, flush_interval=0)
+    for scan_id in (TUNE_AR, TUNE_MR):
+        for key, doc in cat.v1[scan_id].documents():
+            specwriter.receiver(key, doc)
+            if key == "event":
+                # rows are in the file before the stop document
+                lines = testfile.read_text().split("#L ")[-1].splitlines()
+                assert len(lines) == 1 + specwriter.num_primary_data
+        assert specwriter.num_primary_data > 0
+        assert specwriter._stream is None
+
+    def scans(path):
+        # remove the file's header (#F, #E, #D lines)
+        return path.read_text().split("#S ", 1)[-1]
+
+    assert scans(testfile) == scans(reference)
+    assert len(specwriter.uid_index) == 2
+
+    specwriter = SpecWriterCallback(filename=testfile, streaming=True)
+    with pytest.raises(ValueError) as exinfo:
+        write_stream(specwriter, cat.v1[TUNE_MR].documents())
+    assert "already contains uid" in str(exinfo.value)
+
+
 def test_SpecWriterCallback__rebuild_scan_command(cat):
     from ..spec_file_writer import _rebuild_scan_command
 
@@ -0,0 +1,147 @@
+"""
+unit tests for the ImageStatsCallback
+"""
+
+import threading
+import time
+
+import event_model
+import h5py
+import numpy
+import pytest
+
+from .. import ImageStatsCallback
+
+SHAPE = (40, 60)  # rows, columns
+
+
+def spot(column, row, width=3):
+    """Image with a Gaussian spot."""
+    y, x = numpy.indices(SHAPE)
+    return 1000 * numpy.exp(-((x - column) ** 2 + (y - row) ** 2) / (2 * width**2))
+
+
+def positions(num):
+    """Positions (column, row) of the spot in each image."""
+    return [(20 + 2 * i, 10 + i) for i in range(num)]
+
+
+def image_documents(path=None, num=5):
+    """Count with an image per event (in an AD_HDF5 file if path is given)."""
+    frames = numpy.array([spot(*p) for p in positions(num)])
+    run = event_model.compose_run(metadata=dict(detectors=["cam"], plan_name="count"))
+    yield "start", run.start_doc
+    data_key = dict(source="PV:image", dtype="array", shape=list(SHAPE))
+    if path is not None:
+        data_key["external"] = "FILESTORE:"
+    stream = run.compose_descriptor(name="primary", data_keys=dict(cam_image=data_key))
+    yield "descriptor", stream.descriptor_doc
+    if path is not None:
+        image_file = path / "images.h5"
+        with h5py.File(image_file, "w") as root:
+            root.create_dataset("/entry/data/data", data=frames)
+        resource = run.compose_resource(
+            spec="AD_HDF5",
+            root=str(path),
+            resource_path=image_file.name,
+            resource_kwargs=dict(frame_per_point=1),
+        )
+        yield "resource", resource.resource_doc
+    for i, frame in enumerate(frames):
+        if path is None:
+            value = frame
+        else:
+            datum = resource.compose_datum(datum_kwargs=dict(point_number=i))
+            yield "datum", datum
+            value = datum["datum_id"]
+        yield "event", stream.compose_event(data=dict(cam_image=value), timestamps=dict(cam_image=0))
+    yield "stop", run.compose_stop()
+
+
+def paged(documents):
+    """Replace all event documents with one event_page document."""
+    documents = list(documents)
+    events = [doc for tag, doc in documents if tag == "event"]
+    for tag, doc in documents:
+        if tag == "event":
+            if doc is events[-1]:
+                yield "event_page", event_model.pack_event_page(*events)
+        else:
+            yield tag, doc
+
+
+@pytest.mark.parametrize("source", "array file page".split())
+def test_ImageStatsCallback(source, tmp_path):
+    documents = image_documents(path=tmp_path if source == "file" else None)
+    if source == "page":
+        documents = paged(documents)
+
+    published = []
+    stats = ImageStatsCallback()
+    stats.rois = dict(corner=(0, 0, 5, 5), spot=(10, 0, 40, 30))
+    stats.publish = lambda key, doc: published.append((key, doc))
+    for key, doc in documents:
+        stats.receiver(key, doc)
+
+    assert len(stats.results) == 5
+    assert stats.errors == []
+    for i, result in enumerate(stats.results):
+        assert result["seq_num"] == i + 1
+        assert result["image_key"] == "cam_image"
+        assert result["peak_position"] == positions(5)[i]
+        assert result["centroid"] == pytest.approx(positions(5)[i], abs=0.01)
+        assert result["sigma"] == pytest.approx((3, 3), abs=0.01)
+        assert result["roi_sums"]["corner"] < 0.01
+    assert stats.results[0]["roi_sums"]["spot"] == pytest.approx(stats.results[0]["total"], rel=1e-3)
+    assert stats.latest is stats.results[-1]
+
+    assert [key for key, doc in published] == ["descriptor"] + 5 * ["event"]
+    descriptor = published[0][1]
+    assert descriptor["name"] == "image_stats"
+    assert "roi_spot" in descriptor["data_keys"]
+    assert [doc["seq_num"] for key, doc in published[1:]] == [1, 2, 3, 4, 5]
+
+
+def test_ImageStatsCallback_frame_source():
+    frames = iter([spot(*p) for p in positions(5)])
+    seen = []
+    stats = ImageStatsCallback()
+    stats.frame_source = lambda: next(frames)
+    stats.on_result = lambda result: seen.append(result["seq_num"])
+    for key, doc in image_documents():
+        stats.receiver(key, doc)
+    assert [r["peak_position"] for r in stats.results] == positions(5)
+    assert sorted(seen) == [1, 2, 3, 4, 5]
+
+
+def test_ImageStatsCallback_max_pending():
+    release = threading.Event()
+    stats = ImageStatsCallback()
+    stats.max_pending = 2
+    stats.on_result = lambda result: release.wait(timeout=10)
+    documents = list(image_documents())
+    for key, doc in documents[:-1]:  # not the stop document
+        stats.receiver(key, doc)
+    assert stats.dropped == 3
+    release.set()
+    stats.receiver(*documents[-1])
+    assert [r["seq_num"] for r in stats.results] == [1, 2]
+
+
+def test_ImageStatsCallback_stop_timeout():
+    release = threading.Event()
+    published = []
+    stats = ImageStatsCallback()
+    stats.stop_timeout = 0.2
+    stats.on_result = lambda result: release.wait(timeout=10)
+    stats.publish = lambda key, doc: published.append(key)
+    t0 = time.time()
+    for key, doc in image_documents(num=2):
+        stats.receiver(key, doc)
+    assert time.time() - t0 < 5  # stop did not wait for the analysis
+    assert stats.results == []
+
+    release.set()
+    assert stats.wait(timeout=10)
+    assert [r["seq_num"] for r in stats.results] == [1, 2]
+    assert published == []  # not after the stop document
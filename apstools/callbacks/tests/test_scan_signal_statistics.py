@@ -0,0 +1,211 @@
+"""
+unit tests for the SignalStatsCallback
+"""
+
+import event_model
+import numpy
+import pysumreg
+import pytest
+
+from .. import SignalStatsCallback
+from ..scan_signal_statistics import SummationRegisterArray
+
+
+def scan_documents(num=21, center=0.2, width=0.1):
+    """Documents of a synthetic 1-D scan (motor m1, detector det) with a peak."""
+    run = event_model.compose_run(metadata=dict(detectors=["det"], motors=["m1"], plan_name="scan"))
+    yield "start", run.start_doc
+    # fmt: off
+    data_keys = {
+        "m1": dict(source="sim", dtype="number", shape=[]),
+        "det": dict(source="sim", dtype="number", shape=[]),
+    }
+    hints = {"m1": {"fields": ["m1"]}, "det": {"fields": ["det"]}}
+    # fmt: on
+    stream = run.compose_descriptor(name="primary", data_keys=data_keys, hints=hints)
+    yield "descriptor", stream.descriptor_doc
+    for x in numpy.linspace(-1, 1, num):
+        y = 1000 * numpy.exp(-(((x - center) / width) ** 2) / 2)
+        yield "event", stream.compose_event(
+            data=dict(m1=float(x), det=float(y)),
+            timestamps=dict(m1=0, det=0),
+        )
+    yield "stop", run.compose_stop()
+
+
+def paged(documents):
+    """Replace all event documents with one event_page document."""
+    documents = list(documents)
+    events = [doc for tag, doc in documents if tag == "event"]
+    for tag, doc in documents:
+        if tag == "event":
+            if doc is events[-1]:
+                yield "event_page", event_model.pack_event_page(*events)
+        else:
+            yield tag, doc
+
+
+def test_event_page():
+    stats = {}
+    for style in "event event_page".split():
+        documents = scan_documents()
+        if style == "event_page":
+            documents = paged(documents)
+        stats[style] = SignalStatsCallback()
+        stats[style].stop_report = False
+        for tag, doc in documents:
+            stats[style].receiver(tag, doc)
+
+    for style, callback in stats.items():
+        register = callback._registers["det"]
+        assert register.n == 21, style
+        assert register.centroid == pytest.approx(0.2, abs=0.01), style
+        assert register.x_at_max_y == pytest.approx(0.2), style
+    expected = stats["event"]._registers["det"].to_dict()
+    assert stats["event_page"]._registers["det"].to_dict() == pytest.approx(expected)
+
+
+def test_SummationRegisterArray():
+    rng = numpy.random.default_rng(1234)
+    x = numpy.linspace(-1, 1, 31)
+    y = rng.uniform(1, 100, size=(3, x.size))
+    y[1, 5] = y[1, 25] = 200  # repeated maximum: x of the last one
+
+    registers = SummationRegisterArray("a b c".split())
+    assert registers["b"].n == 0
+    assert registers["b"].max_y is None
+    with pytest.raises(ZeroDivisionError):
+        registers["b"].centroid
+
+    registers.add(x[:10], y[:, :10])  # as from an event_page
+    for i in range(10, x.size):  # as from events
+        registers.add(x[i], y[:, i])
+
+    for i, name in enumerate(registers.names):
+        expected = pysumreg.SummationRegisters()
+        for xv, yv in zip(x, y[i]):
+            expected.add(xv, yv)
+        assert registers[name].to_dict(use_registers=True) == pytest.approx(
+            expected.to_dict(use_registers=True)
+        )
+    assert registers["b"].x_at_max_y == x[25]
+
+    with pytest.raises(TypeError):
+        registers["a"].add(0, 1)
+
+
+def grid_documents(center=(0.2, -0.3), width=(0.1, 0.2)):
+    """Documents of a synthetic grid scan (motors m1 & m2, detectors d1 & d2)."""
+    run = event_model.compose_run(metadata=dict(detectors=["d1", "d2"], motors=["m1", "m2"], plan_name="grid_scan"))
+    yield "start", run.start_doc
+    keys = "m1 m2 d1 d2".split()
+    data_keys = {k: dict(source="sim", dtype="number", shape=[]) for k in keys}
+    hints = {k: {"fields": [k]} for k in keys}
+    stream = run.compose_descriptor(name="primary", data_keys=data_keys, hints=hints)
+    yield "descriptor", stream.descriptor_doc
+    for x1 in numpy.linspace(-1, 1, 21):
+        for x2 in numpy.linspace(-1, 1, 21):
+            y = 1000 * numpy.exp(
+                -(((x1 - center[0]) / width[0]) ** 2) / 2 - (((x2 - center[1]) / width[1]) ** 2) / 2
+            )
+            yield "event", stream.compose_event(
+                data=dict(m1=float(x1), m2=float(x2), d1=float(y), d2=1.0),
+                timestamps={k: 0 for k in keys},
+            )
+    yield "stop", run.compose_stop()
+
+
+@pytest.mark.parametrize("style", "event event_page".split())
+def test_grid_scan(style, capsys):
+    documents = grid_documents()
+    if style == "event_page":
+        documents = paged(documents)
+    stats = SignalStatsCallback()
+    for tag, doc in documents:
+        stats.receiver(tag, doc)
+
+    assert list(stats._motor_registers) == ["m1", "m2"]
+    assert stats._registers["d1"].n == 21 * 21
+    assert stats._motor_registers["m2"]["d1"].centroid == pytest.approx(-0.3, abs=0.01)
+
+    result = stats.statistics_2d()
+    assert result["motors"] == ["m1", "m2"]
+    assert result["centroid"] == pytest.approx([0.2, -0.3], abs=0.01)
+    assert result["sigma"] == pytest.approx([0.1, 0.2], abs=0.01)
+    assert result["covariance"] == pytest.approx(0, abs=1e-6)
+    result = stats.statistics_2d("d2")
+    assert result["centroid"] == pytest.approx([0, 0], abs=1e-9)
+
+    out = capsys.readouterr().out
+    assert "Motor: m2" in out
+    assert "Motors: m1, m2" in out
+
+    stats.receiver("start", next(scan_documents())[1])  # only one motor now
+    with pytest.raises(ValueError):
+        stats.statistics_2d()
+
+
+@pytest.mark.parametrize(
+    "points_after, fraction, min_height, found_after",
+    [
+        [2, 0.5, 0, 16],  # peak at point 13 (x=0.2)
+        [4, 0.5, 0, 18],
+        [2, 0.01, 0, 18],
+        [2, 0.5, 2000, None],  # peak is not high enough
+    ],
+)
+def test_peak_detection(points_after, fraction, min_height, found_after):
+    stats = SignalStatsCallback()
+    stats.stop_report = False
+    stats.peak_detection = True
+    stats.peak_points_after = points_after
+    stats.peak_fraction = fraction
+    stats.peak_min_height = min_height
+
+    found = None
+    for tag, doc in scan_documents():
+        stats.receiver(tag, doc)
+        if stats.peak_found and found is None:
+            found = stats._registers["det"].n
+    assert found == found_after
+
+
+def test_peak_detection_in_scan():
+    from bluesky import RunEngine
+    from bluesky import plans as bp
+    from bluesky import preprocessors as bpp
+    from ophyd.sim import SynAxis
+    from ophyd.sim import SynGauss
+
+    motor = SynAxis(name="motor")
+    det = SynGauss("det", motor, "motor", center=-0.5, Imax=1000, sigma=0.1)
+    det.kind = "hinted"
+    stats = SignalStatsCallback()
+    stats.stop_report = False
+    stats.peak_detection = True
+
+    RE = RunEngine({})
+    plan = bp.scan([det], motor, -1, 1, 41, per_step=stats.per_step)
+    (uid,) = RE(bpp.subs_wrapper(plan, stats.receiver))
+    assert stats.peak_found
+    assert stats._registers["det"].n < 25  # not all 41 points
+    assert stats._registers["det"].x_at_max_y == pytest.approx(-0.5)
+
+
+def test_lineup2_stop_at_peak_restores_peak_detection():
+    from bluesky import RunEngine
+    from ophyd.sim import SynAxis
+    from ophyd.sim import SynGauss
+
+    from ...plans.alignment import lineup2
+
+    motor = SynAxis(name="motor")
+    det = SynGauss("det", motor, "motor", center=-0.5, Imax=1000, sigma=0.1)
+    det.kind = "hinted"
+    stats = SignalStatsCallback()
+    assert not stats.peak_detection
+
+    RE = RunEngine({})
+    RE(lineup2([det], motor, -1, 1, 41, nscans=1, signal_stats=stats, stop_at_peak=True))
+    assert stats._registers["det"].n < 41  # stopped after the peak
+    assert not stats.peak_detection  # restored for later scans
@@ -333,6 +333,7 @@ def lineup2(
     nscans=2,
     signal_stats=None,
     md={},
+    stop_at_peak=False,
     # fmt: on
 ):
     """
@@ -400,6 +401,13 @@ def lineup2(
 
     md *dict*:
         User-supplied metadata for this scan.
+
+    stop_at_peak *bool*:
+        If ``True``, skip the remaining points of a scan once the signal has
+        passed a peak.  (default: ``False``)  See the ``peak_detection``
+        attributes of
+        :class:`~apstools.callbacks.scan_signal_statistics.SignalStatsCallback`.
+        (new in release 1.6.21)
     """
     from ..callbacks import SignalStatsCallback
     from ..callbacks import factor_fwhm
@@ -459,27 +467,48 @@ def lineup2(
         except ZeroDivisionError:  # not enough samples
             return True
 
+    per_step = None
+    peak_detection = signal_stats.peak_detection  # restored after the scans
+    if stop_at_peak:
+        signal_stats.peak_detection = True
+        per_step = signal_stats.per_step
+
     @bpp.subs_decorator(signal_stats.receiver)
     def _inner():
         """Run the scan, collecting statistics at each step."""
         # TODO: save signal stats into separate stream
-        yield from bp.rel_scan(detectors, mover, rel_start, rel_end, points, md=_md)
+        # fmt: off
+        yield from bp.rel_scan(
+            detectors, mover, rel_start, rel_end, points, per_step=per_step, md=_md
+        )
+        # fmt: on
 
-    while nscans > 0:  # allow for repeated scans
-        yield from _inner()  # Run the scan.
-        nscans -= 1
+    def _scans():
+        """Repeat the scan (moving to the feature) ``nscans`` times."""
+        nonlocal nscans, rel_start, rel_end
 
-        target = get_x_by_feature()
-        if target is None:
-            nscans = 0  # Nothing found, no point scanning again.
-        else:
-            yield from bps.mv(mover, target)  # Move to the feature position.
-            logger.info("Moved %s to %s: %f", mover.name, feature, target)
+        while nscans > 0:  # allow for repeated scans
+            yield from _inner()  # Run the scan.
+            nscans -= 1
+
+            target = get_x_by_feature()
+            if target is None:
+                nscans = 0  # Nothing found, no point scanning again.
+            else:
+                yield from bps.mv(mover, target)  # Move to the feature position.
+                logger.info("Moved %s to %s: %f", mover.name, feature, target)
+
+                if nscans > 0:
+                    # move the end points for the next scan
+                    rel_end = principal_signal_stats().sigma * factor_fwhm
+                    rel_start = -rel_end
+
+    def _restore():
+        """Do not leave peak detection on for the caller's later scans."""
+        signal_stats.peak_detection = peak_detection
+        yield from bps.null()
 
-            if nscans > 0:
-                # move the end points for the next scan
-                rel_end = principal_signal_stats().sigma * factor_fwhm
-                rel_start = -rel_end
+    yield from bpp.finalize_wrapper(_scans(), _restore())
 
 
 class TuneAxis(object):
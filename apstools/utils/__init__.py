@@ -41,12 +41,15 @@ from .device_info import listdevice
 from .email import EmailNotifications
 from .image_analysis import analyze_1D
 from .image_analysis import analyze_2D
+from .image_analysis import image_statistics
 from .list_plans import listplans
 from .list_runs import ListRuns
+from .list_runs import RunDataCache
 from .list_runs import getRunData
 from .list_runs import getRunDataValue
 from .list_runs import listRunKeys
 from .list_runs import listruns
+from .list_runs import run_data_cache
 from .list_runs import summarize_runs
 from .log_utils import file_log_handler
 from .log_utils import get_log_path
@@ -61,6 +64,7 @@ from .misc import count_common_subdirs
 from .misc import dictionary_table
 from .misc import full_dotted_name
 from .misc import itemizer
+from .misc import json_default
 from .misc import listobjects
 from .misc import pairwise
 from .misc import print_RE_md
@@ -85,6 +89,9 @@ from .profile_support import ipython_shell_namespace
 from .pvregistry import findbyname
 from .pvregistry import findbypv
 from .query import db_query
+from .run_export import export_runs
+from .run_export import read_exported_runs
+from .run_index import RunMetadataIndex
 from .slit_core import SlitGeometry
 from .spreadsheet import ExcelDatabaseFileBase
 from .spreadsheet import ExcelDatabaseFileGeneric
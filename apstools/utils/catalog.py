@@ -14,7 +14,11 @@ Working with databroker catalogs
    ~quantify_md_key_use
 """
 
+import concurrent.futures
 import logging
+import pathlib
+import threading
+import time
 
 import databroker
 import databroker._drivers.mongo_normalized
@@ -24,17 +28,128 @@ import pandas as pd
 import pyRestTable
 
 from ._core import CATALOG_CLASSES
-from .list_runs import getRunData
+from .list_runs import _getRunTable
+from .list_runs import _run_metadata
 from .profile_support import getDefaultNamespace
 from .profile_support import ipython_shell_namespace
+from .query import _count_key_values
+from .query import _count_values
 
 logger = logging.getLogger(__name__)
 
 
-def copy_filtered_catalog(source_cat, target_cat, query=None):
+def _batched_documents(documents, batch_size, datums=True):
+    """
+    Pack consecutive *event* (and *datum*) documents into pages.
+
+    Pages have at most ``batch_size`` rows.  Existing pages are repacked.
+    With ``datums=False``, *datum* and *datum_page* documents pass unchanged.
+    """
+    import event_model
+
+    kinds = dict(
+        event=("event", event_model.pack_event_page, "descriptor"),
+        event_page=("event", event_model.pack_event_page, "descriptor"),
+    )
+    if datums:
+        kinds.update(
+            datum=("datum", event_model.pack_datum_page, "resource"),
+            datum_page=("datum", event_model.pack_datum_page, "resource"),
+        )
+    unpackers = dict(
+        event_page=event_model.unpack_event_page,
+        datum_page=event_model.unpack_datum_page,
+    )
+    batch, batch_kind, batch_parent = [], None, None
+
+    def flush():
+        if len(batch) > 0:
+            kind, pack, _ = kinds[batch_kind]
+            yield f"{kind}_page", pack(*batch)
+            batch.clear()
+
+    for name, doc in documents:
+        if name not in kinds:
+            yield from flush()
+            yield name, doc
+            continue
+        kind, _pack, parent_key = kinds[name]
+        parent = doc[parent_key]
+        if (kind, parent) != (batch_kind, batch_parent):
+            yield from flush()
+            batch_kind, batch_parent = kind, parent
+        rows = unpackers[name](doc) if name in unpackers else [doc]
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield from flush()
+    yield from flush()
+
+
+def _estimate_run_documents(md):
+    """Number of documents of a run (estimated from its stop document)."""
+    stop = md.get("stop") or {}
+    num_events = stop.get("num_events") or {}
+    # start, stop, a descriptor per stream, and the events
+    return 2 + len(num_events) + sum(num_events.values())
+
+
+def _remove_run(catalog, uid):
+    """
+    Remove the documents of run ``uid`` (a partial copy) from ``catalog``.
+
+    Supports MongoDB and msgpack catalogs.  Return ``True`` if the run was
+    found.  Raise ``RuntimeError`` if the run cannot be removed.
+    """
+    if isinstance(catalog, databroker._drivers.mongo_normalized.BlueskyMongoCatalog):
+        if catalog._run_start_collection.find_one({"uid": uid}) is None:
+            return False
+        descriptors = [d["uid"] for d in catalog._event_descriptor_collection.find({"run_start": uid})]
+        resources = [r["uid"] for r in catalog._resource_collection.find({"run_start": uid})]
+        catalog._event_collection.delete_many({"descriptor": {"$in": descriptors}})
+        catalog._datum_collection.delete_many({"resource": {"$in": resources}})
+        catalog._resource_collection.delete_many({"run_start": uid})
+        catalog._event_descriptor_collection.delete_many({"run_start": uid})
+        catalog._run_stop_collection.delete_many({"run_start": uid})
+        catalog._run_start_collection.delete_many({"uid": uid})  # last
+        return True
+    if isinstance(catalog, databroker._drivers.msgpack.BlueskyMsgpackCatalog):
+        # same file name as the serializer uses
+        path = pathlib.Path(catalog.paths[0]).parent / f"{uid}.msgpack"
+        if not path.exists():
+            return False
+        path.unlink()
+        return True
+    if uid in catalog:
+        raise RuntimeError(f"Cannot remove partial copy of run {uid} from {catalog}.")
+    return False
+
+
+def copy_filtered_catalog(
+    source_cat,
+    target_cat,
+    query=None,
+    max_workers=4,
+    batch_size=1000,
+    checkpoint=None,
+    dry_run=False,
+    progress_interval=10,
+):
     """
     copy filtered runs from source_cat to target_cat
 
+    Runs are copied in parallel (``max_workers`` threads, one run per
+    thread at a time).  Consecutive *event* (and *datum*) documents are
+    inserted as pages of up to ``batch_size`` rows.  Progress (runs and
+    documents/s) is logged every ``progress_interval`` seconds.
+
+    The ``uid`` of each run copied is added to the ``checkpoint`` file.
+    Runs listed in that file are skipped, so an interrupted copy resumes
+    where it stopped.  A run not listed in that file but found in
+    ``target_cat`` (such as a run partially copied before an interruption)
+    is removed from ``target_cat`` and copied again.  Only MongoDB and
+    msgpack catalogs support this removal.
+
     PARAMETERS
 
     source_cat
@@ -49,24 +164,122 @@ def copy_filtered_catalog(source_cat, target_cat, query=None):
         (default: ``{}``)
 
         see: https://docs.mongodb.com/manual/reference/operator/query/
+    max_workers
+        *int* :
+        Number of runs copied at the same time.  (default: ``4``)
+    batch_size
+        *int* :
+        Maximum number of events (or datums) in each page.  (default: ``1000``)
+    checkpoint
+        *str* :
+        Name of a file with the uids of the runs already copied.
+        (default: ``None``, no checkpoint file)
+    dry_run
+        *bool* :
+        If ``True``, do not copy.  Estimate the number of runs and
+        documents (from the *stop* documents) to be copied.
+        (default: ``False``)
+    progress_interval
+        *float* :
+        Time (s) between progress reports.  (default: ``10``)
+
+    RETURNS
+
+    *dict* :
+        Summary: ``runs`` copied (or to copy), ``skipped`` (in the
+        checkpoint), ``documents``, ``elapsed`` time (s), and ``docs_per_s``.
+
+    Raises ``RuntimeError`` (after all other runs are copied) if any runs
+    could not be copied.
 
     example::
 
         copy_filtered_catalog(
             databroker.Broker.named("mongodb_config"),
             databroker.catalog["test1"],
-            {'plan_name': 'snapshot'})
+            {'plan_name': 'snapshot'},
+            checkpoint="copied_uids.txt",
+        )
     """
     query = query or {}
-    for i, uid in enumerate(source_cat.v2.search(query)):
-        run = source_cat.v1[uid]
-        # fmt: off
-        logger.debug(
-            "%d  %s  #docs=%d", i + 1, uid, len(list(run.documents()))
-        )
-        # fmt: on
-        for key, doc in run.documents():
-            target_cat.v1.insert(key, doc)
+    t0 = time.time()
+    source = source_cat.v2.search(query)
+    target = target_cat.v2
+
+    done = set()
+    if checkpoint is not None:
+        checkpoint = pathlib.Path(checkpoint)
+        if checkpoint.exists():
+            done = set(checkpoint.read_text().split())
+    uids = [uid for uid in source if uid not in done]
+    summary = dict(runs=0, skipped=len(source) - len(uids), documents=0)
+
+    if dry_run:
+        for uid in uids:
+            summary["documents"] += _estimate_run_documents(_run_metadata(source, uid))
+        summary["runs"] = len(uids)
+        summary.update(elapsed=time.time() - t0, docs_per_s=None)
+        logger.info("Dry run: would copy %d runs, about %d documents.", len(uids), summary["documents"])
+        return summary
+
+    page_rows = dict(event_page="seq_num", datum_page="datum_id")
+    lock = threading.Lock()
+    local = threading.local()  # a serializer for each thread
+    failed = {}
+    progress = dict(t=t0)
+
+    def report(force=False):
+        now = time.time()
+        if force or now - progress["t"] >= progress_interval:
+            progress["t"] = now
+            elapsed = now - t0
+            logger.info(
+                "Copied %d/%d runs, %d documents, %.0f docs/s",
+                summary["runs"],
+                len(uids),
+                summary["documents"],
+                summary["documents"] / elapsed if elapsed > 0 else 0,
+            )
+
+    def copy_run(uid):
+        if not hasattr(local, "serializer"):
+            local.serializer = target._get_serializer()
+        if _remove_run(target, uid):
+            logger.info("Removed partial copy of run %s, copying again.", uid)
+        count = 0
+        documents = source[uid].documents(fill="no")
+        for name, doc in _batched_documents(documents, batch_size):
+            local.serializer(name, doc)
+            # count each row of a page as a document
+            count += len(doc[page_rows[name]]) if name in page_rows else 1
+        with lock:
+            summary["runs"] += 1
+            summary["documents"] += count
+            if checkpoint is not None:
+                with open(checkpoint, "a") as f:
+                    f.write(f"{uid}\n")
+            report()
+        logger.debug("%s  #docs=%d", uid, count)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(copy_run, uid): uid for uid in uids}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as exc:
+                uid = futures[future]
+                logger.error("Could not copy run %s: %s", uid, exc)
+                failed[uid] = exc
+
+    if hasattr(target, "force_reload"):
+        # Make a reasonable effort to keep the catalog in sync with new data.
+        target.force_reload()
+    report(force=True)
+    elapsed = time.time() - t0
+    summary.update(elapsed=elapsed, docs_per_s=summary["documents"] / elapsed if elapsed > 0 else None)
+    if len(failed) > 0:
+        raise RuntimeError(f"Could not copy {len(failed)} run(s): {sorted(failed)}")
+    return summary
 
 
 def findCatalogsInNamespace():
@@ -294,7 +507,15 @@ def getStreamValues(scan_id, key_fragment="", db=None, stream="baseline", query=
     if use_v1 is None:
         use_v1 = True
 
-    data = getRunData(scan_id, db=db, stream=stream, query=query, use_v1=use_v1)
+    # Read only the columns with key_fragment.
+    data = _getRunTable(
+        scan_id,
+        db=db,
+        stream=stream,
+        query=query,
+        use_v1=use_v1,
+        select=(lambda k: key_fragment in k) if key_fragment else None,
+    )
 
     indices = [1, 2] if len(data["time"]) == 2 else [1]
     dd = {}
@@ -324,10 +545,14 @@ def quantify_md_key_use(
     since=None,
     until=None,
     query=None,
+    index=None,
 ):
     """
     Print table of different ``key`` values and how many times each appears.
 
+    With MongoDB, the runs are counted on the server (one aggregation).
+    Otherwise, only the *start* documents are read.
+
     PARAMETERS
 
     key *str* :
@@ -350,6 +575,12 @@ def quantify_md_key_use(
         (default: ``{}``)
 
         see: https://docs.mongodb.com/manual/reference/operator/query/
+    index *object* :
+        Local index of run metadata
+        (:class:`~apstools.utils.run_index.RunMetadataIndex`).
+        When given, the runs are counted from the index (refreshed first)
+        and neither ``db`` nor ``catalog_name`` is used.
+        (default: ``None``)
 
     EXAMPLES::
 
@@ -393,29 +624,28 @@ def quantify_md_key_use(
     since = since or "1995-01-01"
     until = until or "2100-12-31"
 
-    cat = (
-        (db or databroker.catalog[catalog_name])
-        .v2.search(databroker.queries.TimeRange(since=since, until=until))
-        .search(query)
-    )
-
-    items = []
-    while True:
-        runs = cat.search({key: {"$exists": True, "$nin": items}})
-        if len(runs) == 0:
-            break
-        else:
-            items.append(runs.v1[-1].start.get(key))
+    if index is not None:
+        index.refresh()
+        start_docs = (md["start"] for uid, md in index.runs(since=since, until=until, query=query))
+        counts = _count_values(start_docs, key)
+    else:
+        cat = (
+            (db or databroker.catalog[catalog_name])
+            .v2.search(databroker.queries.TimeRange(since=since, until=until))
+            .search(query)
+        )
+        counts = _count_key_values(cat, key)
 
-    def sorter(key):
+    def sorter(item):
+        key = item[0]
         if key is None:
             key = " None"
         return str(key)
 
     table = pyRestTable.Table()
     table.labels = f"{key} #runs".split()
-    for item in sorted(items, key=sorter):
-        table.addRow((item, len(cat.search({key: item}))))
+    for item, count in sorted(counts, key=sorter):
+        table.addRow((item, count))
     print(table)
 
 
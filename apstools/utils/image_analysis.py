@@ -2,34 +2,126 @@
 Statistical peak analysis functions
 +++++++++++++++++++++++++++++++++++++++
 
-Uses *pysumreg* package (https://prjemian.github.io/pysumreg/) to obtain summary
-statistics.
+Summary statistics, as from the *pysumreg* package
+(https://prjemian.github.io/pysumreg/), computed with numpy.
 
 .. autosummary::
 
    ~analyze_1D
    ~analyze_2D
+   ~image_statistics
 """
 
 __all__ = """
     analyze_1D
     analyze_2D
+    image_statistics
 """.split()
 
 import logging
 
 import numpy as np
-from pysumreg import SummationRegisters
 
 logger = logging.getLogger(__name__)
 logger.info(__file__)
 
+REGISTER_KEYS = "n X Y XX XY XXY YY".split()
+
+
+def _extremum(values):
+    """
+    Minimum and its (last) index, along the last axis of 2-D ``values``.
+
+    Same as the running minimum of ``pysumreg.SummationRegisters``, which
+    starts again with the next value after the minimum has been zero.
+    """
+    rows, n = values.shape
+    index = np.arange(n)
+    negative = values < 0
+    first_negative = np.where(negative.any(axis=1), negative.argmax(axis=1), n)
+    zeros = (values == 0) & (index < first_negative[:, None])
+    last_zero = n - 1 - zeros[:, ::-1].argmax(axis=1)
+    first = np.where(zeros.any(axis=1), last_zero + 1, 0)
+    first = np.minimum(first, n - 1)  # zero was the last value
+
+    in_range = index >= first[:, None]
+    minimum = np.where(in_range, values, np.inf).min(axis=1)
+    minimum = np.where(first == n - 1, values[:, -1], minimum)
+    at_minimum = in_range & (values == minimum[:, None])
+    return minimum, n - 1 - at_minimum[:, ::-1].argmax(axis=1)
+
+
+def _analyze(y, x):
+    """
+    Statistics of each row of 2-D ``y`` vs. 1-D ``x``.
+
+    Returns a list (one for each row) of dictionaries, with the same content
+    as ``pysumreg.SummationRegisters().to_dict(use_registers=True)``.
+    """
+    rows, n = y.shape
+    if n == 0:
+        return [{"n": 0, **{k: 0 for k in REGISTER_KEYS[1:]}} for _ in range(rows)]
+    xf = x.astype(float)
+    yf = y.astype(float)
+    xy = yf * xf
+    regs = dict(
+        X=np.full(rows, xf.sum()),
+        Y=yf.sum(axis=1),
+        XX=np.full(rows, (xf * xf).sum()),
+        XY=xy.sum(axis=1),
+        XXY=(xy * xf).sum(axis=1),
+        YY=(yf * yf).sum(axis=1),
+    )
+    X, Y, XX, XY, XXY, YY = (regs[k] for k in REGISTER_KEYS[1:])
+
+    with np.errstate(all="ignore"):
+        stats = dict(
+            mean_x=X / n,
+            mean_y=Y / n,
+            stddev_x=np.sqrt(np.maximum(0, XX - X * X / n) / (n - 1)),
+            stddev_y=np.sqrt(np.maximum(0, YY - Y * Y / n) / (n - 1)),
+            slope=(n * XY - X * Y) / (n * XX - X * X),
+        )
+        stats["intercept"] = (Y - stats["slope"] * X) / n
+        stats["correlation"] = (n * XY - X * Y) / np.sqrt((n * XX - X * X) * (n * YY - Y * Y))
+        stats["centroid"] = XY / Y
+        stats["sigma"] = np.sqrt((XXY - stats["centroid"] * XY) / Y)
+
+    x_rows = np.broadcast_to(x, (1, n))
+    min_x, _i = _extremum(x_rows)
+    max_x, _i = _extremum(-x_rows)
+    min_y, i_min = _extremum(y)
+    max_y, i_max = _extremum(-y)
+    extrema = dict(
+        min_x=np.full(rows, min_x[0]).astype(x.dtype),
+        max_x=np.full(rows, -max_x[0]).astype(x.dtype),
+        min_y=min_y,
+        max_y=-max_y,
+        x_at_max_y=x[i_max],
+        x_at_min_y=x[i_min],
+    )
+
+    def value(arr, i):
+        v = arr[i].item()
+        if isinstance(v, float) and not np.isfinite(v):
+            return None  # undefined (such as division by zero)
+        return v
+
+    results = []
+    for i in range(rows):
+        d = {k: value(v, i) for k, v in stats.items()}
+        d.update({k: value(v, i) for k, v in extrema.items()})
+        d["n"] = n
+        d.update({k: value(v, i) for k, v in regs.items()})
+        results.append(d)
+    return results
+
 
 def analyze_1D(y_arr, x_arr=None):
     """
     Measures of 1D data peak center & width.
 
-    Return result is a dictionary prepared by the
+    Return result is a dictionary with the same content as the
     ``to_dict(use_registers=True)`` method of the
     ``pysumreg.SummationRegisters()`` class.
 
@@ -43,18 +135,21 @@ def analyze_1D(y_arr, x_arr=None):
         'x_at_max_y': 2,
         'n': 5, 'X': 10, 'Y': 36, 'XX': 30, 'XY': 72,
         'XXY': 192, 'YY': 304}
+
+    If ``y_arr`` is 2-D (a stack of 1-D data, each with the same ``x_arr``),
+    return a list of dictionaries, one for each row of ``y_arr``.
     """
+    y = np.asarray(y_arr)
+    if y.ndim not in (1, 2):
+        raise ValueError(f"Expected 1-D (or a stack of 1-D) data, received shape {y.shape}.")
     if x_arr is None:
-        x_arr = list(range(len(y_arr)))
-    if len(x_arr) != len(y_arr):
+        x_arr = np.arange(y.shape[-1])
+    x = np.asarray(x_arr)
+    if x.ndim != 1 or len(x) != y.shape[-1]:
         raise ValueError("x and y arrays are not of the same length.")
 
-    regs = SummationRegisters()
-    regs.clear()
-    for u, v in zip(x_arr, y_arr):
-        regs.add(u, v)
-
-    return regs.to_dict(use_registers=True)
+    results = _analyze(y.reshape(-1, y.shape[-1]), x)
+    return results[0] if y.ndim == 1 else results
 
 
 def analyze_2D(image):
@@ -82,18 +177,67 @@ def analyze_2D(image):
          'sigma': (1.1192, 0.8695),
          'peak_position': (3, 2),
          'max_y': 10}
-    """
-    if not isinstance(image, np.ndarray):
-        image = np.array(image)
 
-    axis_0 = analyze_1D(image.sum(axis=0))
-    axis_1 = analyze_1D(image.sum(axis=1))
+    If ``image`` is 3-D (a stack of frames, such as from an area detector
+    HDF5 file), return a list of dictionaries, one for each frame.
+    """
+    image = np.asarray(image)
+    if image.ndim not in (2, 3):
+        raise ValueError(f"Expected a 2-D image (or a stack of images), received shape {image.shape}.")
+    frames = image.reshape(-1, *image.shape[-2:])
+
+    axis_0 = analyze_1D(frames.sum(axis=1))  # vs. column
+    axis_1 = analyze_1D(frames.sum(axis=2))  # vs. row
+    results = []
     key_list = "n centroid sigma".split()
-    results = {k: (axis_0[k], axis_1[k]) for k in key_list}
     k = "x_at_max_y"
-    results["peak_position"] = (axis_0[k], axis_1[k])
-    results["max_y"] = image[axis_1[k]][axis_0[k]]
-    return results
+    for frame, a0, a1 in zip(frames, axis_0, axis_1):
+        result = {key: (a0[key], a1[key]) for key in key_list}
+        result["peak_position"] = (a0[k], a1[k])
+        result["max_y"] = frame[a1[k]][a0[k]]
+        results.append(result)
+    return results[0] if image.ndim == 2 else results
+
+
+def image_statistics(image, rois=None):
+    """
+    Peak statistics of 2-D (image) data: :func:`analyze_2D`, with more.
+
+    The result of :func:`analyze_2D` (pairs are (column, row), as
+    ``frame[rows][columns]``), with the image ``total`` and the sum of the
+    image in each of the ``rois``.  As for :func:`analyze_2D`, the
+    ``peak_position`` is found from the row & column sums of the image (not
+    the brightest pixel) and centroid and sigma are ``None`` when the image
+    total is zero.
+
+    PARAMETERS
+
+    image
+        *array* :
+        2-D image data.
+    rois
+        *dict* :
+        (optional) Regions of interest, keyed by name.  Each value is
+        ``(min_x, min_y, size_x, size_y)``, in pixels, as the EPICS area
+        detector ROI plugin.
+
+    (new in release 1.6.21)
+    """
+    image = np.asarray(image)
+    if image.ndim != 2:
+        raise ValueError(f"Expected a 2-D image, received shape {image.shape}.")
+    rois = rois or {}
+
+    result = analyze_2D(image)
+    result["max_y"] = result["max_y"].item()
+    result["total"] = float(image.sum(dtype=float))
+    result["roi_sums"] = {
+        # fmt: off
+        name: float(image[y0:y0 + ny, x0:x0 + nx].sum(dtype=float))
+        for name, (x0, y0, nx, ny) in rois.items()
+        # fmt: on
+    }
+    return result
 
 
 # -----------------------------------------------------------------------------
@@ -9,16 +9,19 @@ Directory of bluesky runs
    ~listRunKeys
    ~ListRuns
    ~listruns
+   ~RunDataCache
    ~summarize_runs
 """
 
+import collections
+import concurrent.futures
 import dataclasses
 import datetime
+import itertools
 import logging
-import time
+import threading
 import typing
 import warnings
-from collections import defaultdict
 
 import databroker
 import databroker._drivers.mongo_normalized
@@ -29,11 +32,195 @@ from ._core import FIRST_DATA
 from ._core import LAST_DATA
 from ._core import MONGO_CATALOG_CLASSES
 from ._core import TableStyle
+from .query import _count_key_values
+from .query import _count_values
 from .query import db_query
 
 logger = logging.getLogger(__name__)
 
 
+def _run_metadata(cat, key):
+    """
+    Return the *start* and *stop* documents of a run (as ``run.metadata``).
+
+    Does not construct the ``BlueskyRun`` object of the run, when the
+    catalog allows.
+    """
+    entries = getattr(cat, "_entries", None)
+    if hasattr(entries, "_find_run_start_doc"):
+        # MongoDB: the two documents only
+        start = entries._find_run_start_doc(key)
+        start.pop("_id", None)
+        return dict(start=start, stop=cat._get_run_stop(start["uid"]))
+    if isinstance(entries, dict) and key in entries:
+        # msgpack, JSONL: from memory
+        return entries[key].describe()["metadata"]
+    return cat[key].metadata
+
+
+class RunDataCache:
+    """
+    Cache of run stream tables, least recently used are removed first.
+
+    :func:`getRunData`, :func:`getRunDataValue`, :func:`listRunKeys`, and
+    :func:`~apstools.utils.catalog.getStreamValues` read a whole stream of a
+    run as a table.  The tables are kept in this cache (``run_data_cache``),
+    keyed by (catalog name, run uid, stream, API version, fields), so that
+    several values from the same run do not read the stream again.  (The
+    ``fields`` are ``None`` for a table with all the columns.)  The ``scan_id``
+    is resolved to the run's ``uid`` first (so ``-1`` finds the newest run).
+    Tables of runs not finished (without a *stop* document) are not cached.
+
+    When the tables use more than ``max_bytes`` of memory, the least recently
+    used are removed.  ``max_bytes=0`` disables the cache.
+
+    EXAMPLE::
+
+        from apstools.utils import run_data_cache
+
+        run_data_cache.max_bytes = 2**30  # 1 GB
+        print(run_data_cache)
+        run_data_cache.invalidate(uid)  # this run only
+        run_data_cache.clear()  # all runs
+
+    .. autosummary::
+
+       ~get
+       ~put
+       ~invalidate
+       ~clear
+
+    (new in release 1.6.21)
+    """
+
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._lock = threading.Lock()
+        self._tables = collections.OrderedDict()  # key: (table, nbytes)
+
+    def __contains__(self, key):
+        return key in self._tables
+
+    def __len__(self):
+        return len(self._tables)
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(tables={len(self)}, nbytes={self.nbytes}"
+            f", max_bytes={self.max_bytes}, hits={self.hits}, misses={self.misses})"
+        )
+
+    def get(self, key):
+        """Return the cached table (``None`` if not cached)."""
+        with self._lock:
+            if key not in self._tables:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._tables.move_to_end(key)
+            return self._tables[key][0]
+
+    def put(self, key, table):
+        """Add the table to the cache, remove the least recently used."""
+        nbytes = int(table.memory_usage(deep=True).sum())
+        with self._lock:
+            self._remove(key)
+            if nbytes > self.max_bytes:
+                return
+            self._tables[key] = (table, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self._remove(next(iter(self._tables)))
+
+    def _remove(self, key):
+        if key in self._tables:
+            self.nbytes -= self._tables.pop(key)[1]
+
+    def invalidate(self, uid):
+        """Remove all tables of the run with this ``uid``."""
+        with self._lock:
+            for key in [k for k in self._tables if k[1] == uid]:
+                self._remove(key)
+
+    def clear(self):
+        """Remove all tables."""
+        with self._lock:
+            self._tables.clear()
+            self.nbytes = 0
+
+
+run_data_cache = RunDataCache()
+
+
+def _getRunTable(scan_id, db=None, stream="primary", query=None, use_v1=True, select=None):
+    """
+    Return the table of the run's stream, from the cache if possible.
+
+    Same as :func:`getRunData` but returns the cached table (not a copy).
+
+    With ``select`` (a function of a data key name), read only the columns
+    of the data keys selected (and ``time``).  If no data keys are selected,
+    read all the columns.
+    """
+    from . import getCatalog
+
+    cat = getCatalog(db)
+    catalog_name = getattr(cat, "name", None)
+    if query:
+        cat = db_query(cat, query)
+
+    stream = stream or "primary"
+    use_v1 = use_v1 is None or bool(use_v1)
+    api = "v1" if use_v1 else "v2"
+
+    # Resolve scan_id to uid, so the cache is never stale.
+    md = _run_metadata(cat.v2, scan_id)
+    uid = md["start"]["uid"]
+    key = (catalog_name, uid, stream, api, None)
+    table = run_data_cache.get(key)
+    if table is not None:
+        if select is not None:
+            columns = [c for c in table.columns if c == "time" or select(c)]
+            if len(columns) > int("time" in table.columns):
+                return table[columns]
+        return table
+
+    if use_v1:
+        run = cat.v1[uid]
+        if stream not in run.stream_names:
+            raise AttributeError(f"No such stream '{stream}' in run '{scan_id}'.")
+        descriptors = [d for d in run.descriptors if d.get("name") == stream]
+    else:
+        run = cat.v2[uid]
+        if not hasattr(run, stream):
+            raise AttributeError(f"No such stream '{stream}' in run '{scan_id}'.")
+        descriptors = run[stream].metadata["descriptors"]
+
+    fields = None
+    if select is not None:
+        # Column projection: read only these fields.
+        data_keys = {k: None for d in descriptors for k in d["data_keys"]}  # ordered set
+        fields = [k for k in data_keys if select(k)] or None
+        key = key[:-1] + (None if fields is None else tuple(fields),)
+        table = run_data_cache.get(key)
+        if table is not None:
+            return table
+
+    if use_v1:
+        table = run.table(stream_name=stream, fields=fields)
+    elif fields is None:
+        table = run[stream].read().to_dataframe()
+    else:
+        table = run[stream].to_dask()[fields].load().to_dataframe()
+
+    if md["stop"] is not None:
+        run_data_cache.put(key, table)
+    return table
+
+
 def getRunData(scan_id, db=None, stream="primary", query=None, use_v1=True):
     """
     Convenience function to get the run's data.  Default is the ``primary`` stream.
@@ -70,26 +257,12 @@ def getRunData(scan_id, db=None, stream="primary", query=None, use_v1=True):
         Chooses databroker API version between 'v1' or 'v2'.
         Default: ``True`` (meaning use the v1 API)
 
+    Tables are cached (see :class:`RunDataCache`).  This function returns
+    a copy of the table.
+
     (new in apstools 1.5.1)
     """
-    from . import getCatalog
-
-    cat = getCatalog(db)
-    if query:
-        cat = db_query(cat, query)
-
-    stream = stream or "primary"
-
-    if use_v1 is None or use_v1:
-        run = cat.v1[scan_id]
-        if stream in run.stream_names:
-            return run.table(stream_name=stream)
-    else:
-        run = cat.v2[scan_id]
-        if hasattr(run, stream):
-            return run[stream].read().to_dataframe()
-
-    raise AttributeError(f"No such stream '{stream}' in run '{scan_id}'.")
+    return _getRunTable(scan_id, db=db, stream=stream, query=query, use_v1=use_v1).copy()
 
 
 def getRunDataValue(scan_id, key, db=None, stream="primary", query=None, idx=-1, use_v1=True):
@@ -156,14 +329,22 @@ def getRunDataValue(scan_id, key, db=None, stream="primary", query=None, idx=-1,
 
     stream = stream or "primary"
 
-    table = getRunData(scan_id, db=db, stream=stream, query=query)
+    # Read only this column (unless already cached).
+    table = _getRunTable(
+        scan_id,
+        db=db,
+        stream=stream,
+        query=query,
+        use_v1=use_v1,
+        select=lambda k: k == key,
+    )
 
     if key not in table:
         raise KeyError(f"'{key}' not found in scan {scan_id} stream '{stream}'.")
     data = table[key]
 
     if _idx == "all":
-        return data.values
+        return data.values.copy()  # not the cached table
     elif _idx == "mean":
         return data.mean()
     elif (0 <= _idx < len(data)) or (_idx < 0):
@@ -229,7 +410,7 @@ def listRunKeys(
 
     (new in apstools 1.5.1)
     """
-    table = getRunData(scan_id, db=db, stream=stream, query=query, use_v1=use_v1)
+    table = _getRunTable(scan_id, db=db, stream=stream, query=query, use_v1=use_v1)
 
     # fmt: off
     if len(key_fragment):
@@ -270,9 +451,22 @@ class ListRuns:
 
         ~_get_by_key
         ~_check_cat
+        ~_check_index
         ~_apply_search_filters
+        ~_catalog_sequence
+        ~_index_sequence
+        ~_get_metadata
+        ~_prefetch_metadata
         ~_check_keys
 
+    With ``index`` (a :class:`~apstools.utils.run_index.RunMetadataIndex` or
+    the name of its SQLite file), the run metadata are read from the local
+    index (refreshed first) instead of the catalog.
+
+    Otherwise, the metadata of the next ``prefetch`` runs are read from the
+    catalog (in parallel threads) while the current rows are formatted.  Use
+    ``prefetch=0`` to read one run at a time.  With ``metadata_only=True``,
+    only the *start* and *stop* documents are read (not the full run).
     """
 
     cat: object = None
@@ -287,6 +481,9 @@ class ListRuns:
     until: object = None
     ids: "typing.Any" = None
     hints_override: bool = False
+    index: object = None
+    prefetch: int = 8
+    metadata_only: bool = False
 
     _default_keys = "scan_id time plan_name detectors"
 
@@ -354,21 +551,28 @@ class ListRuns:
         cat = self.cat.v2.search(query)
         return cat
 
-    def parse_runs(self):
-        """Parse the runs for the given metadata keys.  Return a dict."""
-        self._check_keys()
-        cat = self._apply_search_filters()
+    def _check_index(self):
+        """Return the local index of run metadata (refreshed), if requested."""
+        from .run_index import RunMetadataIndex
+
+        if self.index is None:
+            return None
+        self._check_cat()
+        if not isinstance(self.index, RunMetadataIndex):
+            self.index = RunMetadataIndex(self.cat, self.index)
+        self.index.refresh()
+        return self.index
+
+    def _catalog_sequence(self, cat):
+        """Return an iterable of run uids, from the catalog."""
 
-        def _sort(uid):
+        def _sort(md):
             """Sort runs in desired order based on metadata key."""
-            md = self.cat[uid].metadata
             for doc in "start stop".split():
                 if md[doc] and self.sortby in md[doc]:
                     return md[doc][self.sortby] or self.missing
             return self.missing
 
-        num_runs_requested = min(abs(self.num), len(cat))
-        results = {k: [] for k in self.keys}
         sequence = ()  # iterable of run uids
 
         if self.ids is not None:
@@ -394,16 +598,87 @@ class ListRuns:
                     sequence = [uid for uid in cat][::-1]
             else:
                 # full search in Python
-                sequence = sorted(cat.keys(), key=_sort, reverse=self.reverse)
+                uids = list(cat.keys())
+                values = [_sort(md) for md in self._prefetch_metadata(self.cat, uids)]
+                order = sorted(range(len(uids)), key=values.__getitem__, reverse=self.reverse)
+                sequence = [uids[i] for i in order]
+        return sequence
+
+    def _index_sequence(self, index):
+        """Return a list of run uids, from the local index."""
+        search = dict(since=self.since, until=self.until, query=self.query)
+        if self.ids is None:
+            return index.uids(sortby=self.sortby, reverse=self.reverse, missing=self.missing, **search)
+
+        sequence = []
+        for k in self.ids:
+            try:
+                sequence.append(index.find(k, **search))
+            except Exception as exc:
+                logger.warning(
+                    "Could not find run %s in index of catalog %s: %s",
+                    k,
+                    self.cat.name,
+                    exc,
+                )
+        return sequence
+
+    def _get_metadata(self, cat, uid):
+        """Return the metadata (*start* and *stop* documents) of a run."""
+        if self.metadata_only:
+            return _run_metadata(cat, uid)
+        return cat[uid].metadata
+
+    def _prefetch_metadata(self, cat, sequence, limit=None):
+        """
+        Generator of the metadata of the runs in ``sequence``, in order.
 
-        count = 0
-        for uid in sequence:
-            run = cat[uid]
+        The next ``self.prefetch`` runs are read in parallel threads.
+        Stop after ``limit`` runs (``None``: all runs).
+        """
+        sequence = iter(sequence)
+        if limit is not None:
+            sequence = itertools.islice(sequence, limit)
+        if self.prefetch < 1:
+            for uid in sequence:
+                yield self._get_metadata(cat, uid)
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.prefetch,
+            thread_name_prefix="ListRuns",
+        ) as executor:
+            pending = collections.deque()
+            for uid in sequence:
+                pending.append(executor.submit(self._get_metadata, cat, uid))
+                if len(pending) > self.prefetch:
+                    yield pending.popleft().result()
+            while len(pending) > 0:
+                yield pending.popleft().result()
+
+    def parse_runs(self):
+        """Parse the runs for the given metadata keys.  Return a dict."""
+        self._check_keys()
+        index = self._check_index()
+        if index is None:
+            cat = self._apply_search_filters()
+            num_runs_requested = min(abs(self.num), len(cat))
+            sequence = self._catalog_sequence(cat)
+        else:
+            sequence = self._index_sequence(index)
+            num_runs_requested = min(abs(self.num), len(sequence))
+
+        # Always at least one run, as before.
+        limit = max(1, num_runs_requested)
+        if index is None:
+            runs = self._prefetch_metadata(cat, sequence, limit)
+        else:
+            runs = (index.metadata(uid) for uid in itertools.islice(sequence, limit))
+
+        results = {k: [] for k in self.keys}
+        for md in runs:
             for k in self.keys:
-                results[k].append(self._get_by_key(run.metadata, k))
-            count += 1
-            if count >= num_runs_requested:
-                break
+                results[k].append(self._get_by_key(md, k))
         return results
 
     def _check_keys(self):
@@ -440,6 +715,9 @@ def listruns(
     until=None,
     ids=None,
     hints_override=False,
+    index=None,
+    prefetch=8,
+    metadata_only=False,
     **query,
 ):
     """
@@ -512,6 +790,23 @@ def listruns(
         *str* :
         include runs that started before this ISO8601 time
         (default: ``2100-12-31``)
+    index
+        *object* or *str* :
+        Local index of run metadata
+        (:class:`~apstools.utils.run_index.RunMetadataIndex` or the name
+        of its SQLite file).  When given, the run metadata are read from the
+        index (refreshed first), not the catalog.
+        (default: ``None``)
+    prefetch
+        *int* :
+        Read the metadata of this many runs ahead, in parallel threads.
+        ``0`` reads one run at a time.
+        (default: ``8``)
+    metadata_only
+        *bool* :
+        If ``True``, read only the *start* and *stop* documents of each run,
+        not the full run.
+        (default: ``False``)
     ``**query``
         *dict* :
         Any additional keyword arguments will be passed to
@@ -543,6 +838,9 @@ def listruns(
         until=until,
         ids=ids,
         hints_override=hints_override,
+        index=index,
+        prefetch=prefetch,
+        metadata_only=metadata_only,
     )
 
     table_style = table_style or TableStyle.pyRestTable
@@ -566,7 +864,7 @@ def listruns(
     return table_style.value(lr.parse_runs())
 
 
-def summarize_runs(since=None, db=None):
+def summarize_runs(since=None, db=None, index=None):
     """
     Report bluesky run metrics from the databroker.
 
@@ -575,6 +873,9 @@ def summarize_runs(since=None, db=None):
     * How many times each run was used?
     * How frequently?  (TODO:)
 
+    With MongoDB, the runs are counted on the server (one aggregation).
+    Otherwise, only the *start* documents are read.
+
     PARAMETERS
 
     since
@@ -585,56 +886,37 @@ def summarize_runs(since=None, db=None):
         *object* :
         Instance of ``databroker.Broker()``
         (default: ``db`` from the IPython shell)
+    index
+        *object* :
+        Local index of run metadata
+        (:class:`~apstools.utils.run_index.RunMetadataIndex`).
+        When given, the runs are counted from the index (refreshed first)
+        and ``db`` is not used.
+        (default: ``None``)
     """
     from . import ipython_shell_namespace
 
-    db = db or ipython_shell_namespace()["db"]
     # no APS X-ray experiment data before 1995!
     since = since or "1995"
-    cat = db.v2.search(databroker.queries.TimeRange(since=since))
-    plans = defaultdict(list)
-    t0 = time.time()
-    for n, uid in enumerate(cat):
-        t1 = time.time()
-        # next step is very slow (0.01 - 0.5 seconds each!)
-        run = cat[uid]
-        t2 = time.time()
-        plan_name = run.metadata["start"].get("plan_name", "unknown")
-        # fmt:off
-        dt = datetime.datetime.fromtimestamp(
-            run.metadata["start"]["time"]
-        ).isoformat()
-        # fmt:on
-        scan_id = run.metadata["start"].get("scan_id", "unknown")
-        # fmt: off
-        plans[plan_name].append(
-            dict(
-                plan_name=plan_name,
-                dt=dt,
-                time_start=dt,
-                uid=uid,
-                scan_id=scan_id,
-            )
-        )
-        # fmt: on
-        logger.debug(
-            "%s %s dt1=%4.01fus dt2=%5.01fms %s",
-            scan_id,
-            dt,
-            (t1 - t0) * 1e6,
-            (t2 - t1) * 1e3,
-            plan_name,
-        )
-        t0 = time.time()
+    if index is not None:
+        index.refresh()
+        start_docs = (md["start"] for uid, md in index.runs(since=since))
+        plans = _count_values(start_docs, "plan_name", missing="unknown", count_missing=True)
+    else:
+        db = db or ipython_shell_namespace()["db"]
+        cat = db.v2.search(databroker.queries.TimeRange(since=since))
+        # Count on the server (MongoDB) or from the start documents.
+        plans = _count_key_values(cat, "plan_name", missing="unknown", count_missing=True)
 
-    def sorter(plan_name):
-        return len(plans[plan_name])
+    def sorter(item):
+        plan_name, count = item
+        return -count, str(plan_name)
 
     table = TableStyle.pyRestTable.value()
     table.labels = "plan quantity".split()
-    for k in sorted(plans.keys(), key=sorter, reverse=True):
-        table.addRow((k, sorter(k)))
-    table.addRow(("TOTAL", n + 1))
+    for plan_name, count in sorted(plans, key=sorter):
+        table.addRow((plan_name, count))
+    table.addRow(("TOTAL", sum(count for plan_name, count in plans)))
     print(table)
 
 
@@ -12,6 +12,7 @@ Miscellaneous Support
    ~dictionary_table
    ~full_dotted_name
    ~itemizer
+   ~json_default
    ~listobjects
    ~pairwise
    ~print_RE_md
@@ -29,6 +30,7 @@ Miscellaneous Support
 import inspect
 import logging
 import pathlib
+import queue
 import re
 import subprocess
 import sys
@@ -283,7 +285,52 @@ def print_RE_md(dictionary=None, fmt="simple", printing=True):
     return table
 
 
-def replay(headers, callback=None, sort=True):
+def _prefetched(iterable, size):
+    """
+    Iterate ``iterable`` in a reader thread, up to ``size`` items ahead.
+
+    An exception in the reader is raised here.  When the iteration is
+    stopped early, the reader thread stops too.
+    """
+    items = queue.Queue(maxsize=size)
+    halt = threading.Event()
+
+    def put(item):
+        while not halt.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reader():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+        except BaseException as exc:
+            put((False, exc))
+        finally:
+            put(None)  # Always end the iteration.
+
+    thread = threading.Thread(target=reader, name="replay-reader", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is None:
+                break
+            ok, value = item
+            if not ok:
+                raise value
+            yield value
+    finally:
+        halt.set()
+        thread.join()
+
+
+def replay(headers, callback=None, sort=True, prefetch=0, batch_size=None, report=False):
     """
     Replay the document stream from one (or more) scans (headers).
 
@@ -308,7 +355,47 @@ def replay(headers, callback=None, sort=True):
         Sort the headers chronologically if True.
         (default:``True``)
 
-    (new in apstools release 1.1.11)
+    prefetch
+        *int* :
+        If greater than zero, read the documents in a background thread, up
+        to ``prefetch`` documents ahead of the callback.  The next runs are
+        read from the database while the callback handles the current one.
+        (default:``0``, read and handle each document in turn)
+
+    batch_size
+        *int* :
+        If given, send consecutive *event* documents (of the same stream) as
+        *event_page* documents of at most ``batch_size`` events.  Use only
+        with callbacks that handle *event_page* documents.
+        (default:``None``, send documents as read)
+
+    report
+        *bool* :
+        Print a table of the throughput if True.
+        (default:``False``)
+
+    Returns a dictionary with the throughput: number of ``runs``,
+    ``documents`` (sent to the callback), and ``events``, the ``elapsed``
+    time (s), ``docs_per_s``, ``events_per_s``, and the time (s) spent
+    waiting for documents (``read_wait``) and in the ``callback``.
+
+    EXAMPLE::
+
+        from apstools.callbacks import SpecWriterCallback
+        from apstools.utils import replay
+
+        specwriter = SpecWriterCallback()
+        runs = cat.search(databroker.queries.TimeRange(since="2024-06-01"))
+        replay(
+            [runs[uid] for uid in runs],
+            specwriter.receiver,
+            prefetch=10_000,
+            batch_size=1000,
+            report=True,
+        )
+
+    (new in apstools release 1.1.11, ``prefetch``, ``batch_size``, &
+    ``report`` new in release 1.6.21)
     """
     # fmt: off
     callback = callback or ipython_shell_namespace().get(
@@ -343,19 +430,71 @@ def replay(headers, callback=None, sort=True):
     }[sort]
     # fmt: on
 
-    for h in sorted(runs, key=sorter):
+    runs = sorted(runs, key=sorter)
+    for h in runs:
         if not isinstance(h, databroker.Header):
             # fmt: off
             raise TypeError(
                 f"Must be a databroker Header: received: {type(h)}: |{h}|"
             )
             # fmt: on
-        cmd = spec_file_writer._rebuild_scan_command(h.start)
-        logger.debug("%s", cmd)
 
+    def documents():
+        for h in runs:
+            cmd = spec_file_writer._rebuild_scan_command(h.start)
+            logger.debug("%s", cmd)
+            yield from h.documents()  # get the stream
+
+    stream = documents()
+    if batch_size is not None:
+        from .catalog import _batched_documents
+
+        stream = _batched_documents(stream, batch_size, datums=False)
+    if prefetch > 0:
+        stream = _prefetched(stream, prefetch)
+
+    stats = dict(runs=0, documents=0, events=0, read_wait=0, callback=0)
+    t_start = time.perf_counter()
+    t_read = t_start
+    try:
         # at last, this is where the real action happens
-        for k, doc in h.documents():  # get the stream
+        for k, doc in stream:
+            t_callback = time.perf_counter()
+            stats["read_wait"] += t_callback - t_read
             callback(k, doc)  # play it through the callback
+            t_read = time.perf_counter()
+            stats["callback"] += t_read - t_callback
+            stats["documents"] += 1
+            if k == "start":
+                stats["runs"] += 1
+            elif k == "event":
+                stats["events"] += 1
+            elif k == "event_page":
+                stats["events"] += len(doc["seq_num"])
+    finally:
+        stream.close()  # also stops the reader thread
+    elapsed = time.perf_counter() - t_start
+    stats["elapsed"] = elapsed
+    stats["docs_per_s"] = stats["documents"] / elapsed if elapsed > 0 else None
+    stats["events_per_s"] = stats["events"] / elapsed if elapsed > 0 else None
+
+    if report:
+        table = pyRestTable.Table()
+        table.labels = "runs documents events elapsed,s docs/s events/s read_wait,s callback,s".split()
+        # fmt: off
+        table.addRow((
+            stats["runs"],
+            stats["documents"],
+            stats["events"],
+            f"{elapsed:.3f}",
+            f"{stats['docs_per_s'] or 0:.0f}",
+            f"{stats['events_per_s'] or 0:.0f}",
+            f"{stats['read_wait']:.3f}",
+            f"{stats['callback']:.3f}",
+        ))
+        # fmt: on
+        print(table)
+    return stats
 
 
 def run_in_thread(func):
@@ -514,6 +653,25 @@ def unix(command, raises=True):
     return stdout, stderr
 
 
+def json_default(obj):
+    """
+    Write numpy (and other) values as JSON.
+
+    Use as the ``default`` of ``json.dumps()``, such as for document
+    metadata::
+
+        json.dumps(doc, default=json_default)
+
+    Arrays (and numpy scalars) are written as lists (and numbers), any other
+    object as its ``str()``.
+
+    (new in release 1.6.21)
+    """
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    return str(obj)
+
+
 def listobjects(
     show_pv=True,
     printing=None,  # DEPRECATED
@@ -7,6 +7,8 @@ Searching databroker catalogs
    ~db_query
 """
 
+import json
+
 import databroker
 
 from ._core import FIRST_DATA
@@ -64,6 +66,79 @@ def db_query(db, query):
     return _db
 
 
+def _run_start_documents(cat):
+    """
+    Generator of the *start* documents of the runs in the (v2) catalog.
+
+    Catalogs from msgpack or JSONL files keep the *start* documents in
+    memory.  Otherwise, read the metadata of each run.
+    """
+    cat = cat.v2
+    if hasattr(cat, "_uid_to_run_start_doc"):
+        yield from cat._uid_to_run_start_doc.values()
+    else:
+        for uid in cat:
+            yield cat[uid].metadata["start"]
+
+
+def _count_values(start_docs, key, missing=None, count_missing=False):
+    """
+    Count the runs with each value of ``key`` in their *start* documents.
+
+    Return a list of ``(value, count)``, in the order each value was first
+    found.  Runs without ``key`` are counted with the ``missing`` value if
+    ``count_missing`` is ``True``.
+    """
+    counts = {}  # key: JSON of the value (might be unhashable)
+    values = {}
+    for doc in start_docs:
+        if key in doc:
+            value = doc[key]
+        elif count_missing:
+            value = missing
+        else:
+            continue
+        item = json.dumps(value, sort_keys=True, default=str)
+        counts[item] = counts.get(item, 0) + 1
+        values.setdefault(item, value)
+    return [(values[item], n) for item, n in counts.items()]
+
+
+def _count_key_values(cat, key, missing=None, count_missing=False):
+    """
+    Count the runs of the catalog with each value of ``key``.
+
+    Return a list of ``(value, count)``, as :func:`_count_values`.  With
+    MongoDB, the runs are counted on the server (a single ``$group``
+    aggregation of the *start* documents).  Otherwise, only the *start*
+    documents are read.
+    """
+    cat = cat.v2
+    collection = getattr(cat, "_run_start_collection", None)
+    if collection is None:
+        return _count_values(_run_start_documents(cat), key, missing=missing, count_missing=count_missing)
+
+    match = cat._query or {}
+    if count_missing:
+        # fmt: off
+        group_id = {
+            "$cond": [
+                {"$eq": [{"$type": f"${key}"}, "missing"]},
+                {"$literal": missing},
+                f"${key}",
+            ]
+        }
+        # fmt: on
+    else:
+        match = {"$and": [match, {key: {"$exists": True}}]}
+        group_id = f"${key}"
+    pipeline = [
+        {"$match": match},
+        {"$group": {"_id": group_id, "count": {"$sum": 1}}},
+    ]
+    return [(doc["_id"], doc["count"]) for doc in collection.aggregate(pipeline)]
+
+
 # -----------------------------------------------------------------------------
 # :author:    Pete R. Jemian
 # :email:     jemian@anl.gov
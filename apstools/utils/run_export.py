@@ -0,0 +1,382 @@
+"""
+Export runs to columnar (Parquet or Arrow) files
++++++++++++++++++++++++++++++++++++++++++++++++++
+
+.. autosummary::
+
+   ~export_runs
+   ~read_exported_runs
+"""
+
+import json
+import logging
+import pathlib
+import re
+import time
+
+import databroker.queries
+
+from .misc import json_default
+from .query import db_query
+
+logger = logging.getLogger(__name__)
+
+FORMATS = dict(parquet="parquet", arrow="arrow")  # key: format, value: file suffix
+PARTITIONS = [None, "date", "plan_name"]
+STATE_FILE = "export.json"
+
+
+def _partition(start, partition_by):
+    """Name of the partition directory (``key=value``) for this run."""
+    if partition_by is None:
+        return None
+    if partition_by == "date":
+        value = time.strftime("%Y-%m-%d", time.localtime(start["time"]))
+    else:
+        value = re.sub(r"[^\w.-]", "_", str(start.get(partition_by) or "unknown"))
+    return f"{partition_by}={value}"
+
+
+def _arrow_table(df):
+    """Arrow table from the pandas DataFrame (object columns as text, if needed)."""
+    import pyarrow as pa
+
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        df = df.copy()
+        for column in df.columns:
+            if df[column].dtype == object:
+                try:
+                    pa.array(df[column])
+                except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                    logger.warning("Column %r written as text.", column)
+                    df[column] = df[column].astype(str)
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def _write_table(table, fname, format, compression):
+    """Write the Arrow table to a new file."""
+    fname = pathlib.Path(fname)
+    fname.parent.mkdir(parents=True, exist_ok=True)
+    if format == "parquet":
+        import pyarrow.parquet as pq
+
+        pq.write_table(table, str(fname), compression=compression or "snappy")
+    else:
+        import pyarrow.feather
+
+        # Uncompressed Arrow files are memory-mapped without a copy.
+        pyarrow.feather.write_feather(table, str(fname), compression=compression or "uncompressed")
+
+
+def _read_state(path, catalog_name, format, partition_by):
+    """State of previous exports to ``path`` (a new state if none)."""
+    fname = path / STATE_FILE
+    state = dict(catalog=catalog_name, format=format, partition_by=partition_by, since=None, uids={})
+    if fname.exists():
+        previous = json.loads(fname.read_text())
+        for key in "catalog format partition_by".split():
+            if previous[key] != state[key]:
+                raise ValueError(f"Export {path} has {key}={previous[key]!r}, not {state[key]!r}.")
+        state = previous
+    return state
+
+
+def _write_state(path, state):
+    """Save the state of the exports (replace the file, so it is never partial)."""
+    fname = path / STATE_FILE
+    temporary = fname.with_suffix(".tmp")
+    temporary.write_text(json.dumps(state))
+    temporary.replace(fname)
+
+
+def export_runs(
+    cat,
+    path,
+    query=None,
+    since=None,
+    until=None,
+    streams=None,
+    partition_by="date",
+    format="parquet",
+    compression=None,
+    batch_size=100,
+):
+    """
+    Export runs from the catalog to columnar (Parquet or Arrow) files.
+
+    Each stream of a run is written to its own file, one run at a time (so
+    memory use is set by the largest run, not the number of runs)::
+
+        path/
+            export.json                                  # state of the exports
+            runs/date=2024-06-01/runs-<ns>.parquet       # run metadata table
+            streams/primary/date=2024-06-01/<uid>.parquet
+            streams/baseline/date=2024-06-01/<uid>.parquet
+
+    The *runs* table has one row per run: ``uid``, ``scan_id``,
+    ``plan_name``, ``time``, ``date``, ``exit_status``, and (as JSON text)
+    the ``streams`` exported, ``num_events``, and the ``start`` & ``stop``
+    documents.  Each stream table has the columns of ``run.table(stream)``
+    and ``uid``, ``scan_id``, & ``seq_num``.
+
+    Exports are incremental.  Only runs started since the newest exported
+    run (or the oldest run in progress or that failed) are searched.  Runs
+    in progress (no *stop* document) are exported later.  ``export.json``
+    records that time and the uids of the runs exported since then (these
+    are skipped), not every run exported.  Read the files with :func:`read_exported_runs` (or
+    pyarrow, pandas, polars, duckdb, ...) without the database.
+
+    PARAMETERS
+
+    cat
+        *object* :
+        Instance of databroker v1 or v2 catalog.
+    path
+        *str* :
+        Directory for the files.
+    query
+        *dict* :
+        mongo query dictionary, used to filter the results
+        (default: ``{}``)  See :func:`~apstools.utils.query.db_query`.
+    since
+        *str* :
+        include runs that started on or after this ISO8601 time
+        (default: ``"1995-01-01"``)
+    until
+        *str* :
+        include runs that started before this ISO8601 time
+        (default: ``2100-12-31``)
+    streams
+        *[str]* :
+        Names of the streams to export.  (default: all streams)
+    partition_by
+        *str* :
+        Directories of the files: ``"date"`` (of the run's start),
+        ``"plan_name"``, or ``None``.  (default: ``"date"``)
+    format
+        *str* :
+        ``"parquet"`` or ``"arrow"`` (Arrow IPC / Feather v2 files).
+        (default: ``"parquet"``)
+    compression
+        *str* :
+        Compression of the files.  (default: ``"snappy"`` for Parquet,
+        ``"uncompressed"`` for Arrow)
+    batch_size
+        *int* :
+        Number of runs in each file of the *runs* table.  (default: 100)
+
+    Returns a dictionary: number of runs ``exported``, ``skipped`` (exported
+    before), ``in_progress``, and ``failed``.
+
+    EXAMPLE::
+
+        from apstools.utils import export_runs
+        from apstools.utils import read_exported_runs
+
+        export_runs(cat, "/data/export", query=dict(plan_name="scan"))
+        ...
+        export_runs(cat, "/data/export", query=dict(plan_name="scan"))  # new runs
+        runs = read_exported_runs("/data/export").to_pandas()
+        primary = read_exported_runs("/data/export", "primary").to_pandas()
+
+    Requires the ``pyarrow`` package (``pip install apstools[export]``).
+
+    (new in release 1.6.21)
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown {format=!r}.  Use one of: {' '.join(FORMATS)}")
+    if partition_by not in PARTITIONS:
+        raise ValueError(f"Unknown {partition_by=!r}.  Use one of: {PARTITIONS}")
+
+    path = pathlib.Path(path).expanduser()
+    path.mkdir(parents=True, exist_ok=True)
+    state = _read_state(path, getattr(cat, "name", None) or "", format, partition_by)
+    known = set(state["uids"])  # exported, started at or after state["since"]
+    suffix = FORMATS[format]
+
+    query = dict(query or {})  # db_query() modifies its query
+    if since is not None:
+        query["since"] = since
+    if until is not None:
+        query["until"] = until
+    cat = db_query(cat, query).v2
+    if state["since"] is not None:
+        cat = cat.search(databroker.queries.TimeRange(since=state["since"]))
+
+    summary = dict(exported=0, skipped=0, in_progress=0, failed=0)
+    newest = state["since"]
+    retry = []  # start times of runs to be searched again next time
+    unreadable = False  # a run without metadata: cannot advance "since"
+    rows = []  # of the runs table, not written yet
+
+    def write_runs_table(finished=False):
+        import pandas as pd
+
+        partitions = {}
+        for partition, row in rows:
+            partitions.setdefault(partition, []).append(row)
+        for partition, partition_rows in partitions.items():
+            fname = path / "runs" / (partition or "") / f"runs-{time.time_ns()}.{suffix}"
+            _write_table(_arrow_table(pd.DataFrame(partition_rows)), fname, format, compression)
+        state["uids"].update({row["uid"]: row["time"] for partition, row in rows})
+        if finished and not unreadable:
+            # Only after the whole search: the catalog is not in time order.
+            state["since"] = min(retry) if len(retry) > 0 else newest
+            # Keep only the uids the next search will find again.
+            since = state["since"] or 0
+            state["uids"] = {uid: t for uid, t in state["uids"].items() if t >= since}
+        _write_state(path, state)
+        rows.clear()
+
+    for uid in cat:
+        if uid in known:
+            summary["skipped"] += 1
+            continue
+        start = None
+        try:
+            md = cat[uid].metadata
+            start, stop = md["start"], md["stop"]
+            if stop is None:
+                summary["in_progress"] += 1
+                retry.append(start["time"])
+                continue
+
+            h = cat.v1[uid]
+            partition = _partition(start, partition_by)
+            exported = []
+            for stream in h.stream_names:
+                if streams is not None and stream not in streams:
+                    continue
+                df = h.table(stream).reset_index()
+                df.insert(0, "scan_id", start.get("scan_id"))
+                df.insert(0, "uid", uid)
+                fname = path / "streams" / stream / (partition or "") / f"{uid}.{suffix}"
+                _write_table(_arrow_table(df), fname, format, compression)
+                exported.append(stream)
+                del df  # keep memory bounded: one stream at a time
+        except Exception as exc:
+            logger.warning("Could not export run %s: %s", uid, exc)
+            summary["failed"] += 1
+            if start is None:
+                unreadable = True
+            else:
+                retry.append(start["time"])
+            continue
+
+        row = dict(
+            uid=uid,
+            scan_id=start.get("scan_id"),
+            plan_name=start.get("plan_name"),
+            time=start["time"],
+            date=time.strftime("%Y-%m-%d", time.localtime(start["time"])),
+            exit_status=stop.get("exit_status"),
+            streams=json.dumps(exported),
+            num_events=json.dumps(stop.get("num_events", {})),
+            start=json.dumps(dict(start), default=json_default),
+            stop=json.dumps(dict(stop), default=json_default),
+        )
+        rows.append((partition, row))
+        newest = max(newest or 0, start["time"])
+        summary["exported"] += 1
+        if len(rows) >= batch_size:
+            write_runs_table()
+
+    write_runs_table(finished=True)
+    logger.info("Exported runs to %s: %s", path, summary)
+    return summary
+
+
+def _unify(tables):
+    """Concatenate tables with different columns (missing values are null)."""
+    import pyarrow as pa
+
+    if len(tables) == 0:
+        return pa.table({})
+    schemas = [t.schema.remove_metadata() for t in tables]
+    try:
+        schema = pa.unify_schemas(schemas, promote_options="permissive")
+    except TypeError:  # pyarrow < 14
+        schema = pa.unify_schemas(schemas)
+    unified = []
+    for table in tables:
+        for field in schema:
+            if field.name not in table.column_names:
+                table = table.append_column(field, pa.nulls(len(table), field.type))
+        unified.append(table.select(schema.names).cast(schema))
+    return pa.concat_tables(unified)
+
+
+def read_exported_runs(path, stream=None, columns=None, uids=None, partitions=None):
+    """
+    Read a table exported by :func:`export_runs`, as a ``pyarrow.Table``.
+
+    The files are memory-mapped.  Only the files of the ``uids`` (and
+    ``partitions``) requested are read.  Use ``.to_pandas()`` for a
+    DataFrame.
+
+    PARAMETERS
+
+    path
+        *str* :
+        Directory of the exported files.
+    stream
+        *str* :
+        Name of the stream.  (default: ``None``, the *runs* table)
+    columns
+        *[str]* :
+        Names of the columns to read.  (default: all columns)
+    uids
+        *[str]* :
+        Only these runs.  (default: all runs)
+    partitions
+        *[str]* :
+        Only these partitions, such as ``["2024-06-01", "2024-06-02"]``
+        (dates) or ``["scan"]`` (plan names).  (default: all partitions)
+
+    Requires the ``pyarrow`` package (``pip install apstools[export]``).
+
+    (new in release 1.6.21)
+    """
+    import pyarrow.compute as pc
+    import pyarrow.feather
+    import pyarrow.parquet as pq
+
+    path = pathlib.Path(path).expanduser()
+    state = json.loads((path / STATE_FILE).read_text())
+    suffix = FORMATS[state["format"]]
+    directory = path / "runs" if stream is None else path / "streams" / stream
+    if uids is not None:
+        uids = set(uids)
+
+    tables = []
+    for fname in sorted(directory.rglob(f"*.{suffix}")):
+        if partitions is not None and state["partition_by"] is not None:
+            if fname.parent.name.split("=", 1)[-1] not in partitions:
+                continue
+        if stream is not None and uids is not None and fname.stem not in uids:
+            continue
+        if state["format"] == "parquet":
+            names = pq.read_schema(str(fname), memory_map=True).names
+            selected = None if columns is None else [c for c in names if c in columns or c == "uid"]
+            table = pq.read_table(str(fname), columns=selected, memory_map=True, partitioning=None)
+        else:
+            table = pyarrow.feather.read_table(str(fname), memory_map=True)
+        if stream is None and uids is not None:
+            table = table.filter(pc.is_in(table["uid"], value_set=pyarrow.array(sorted(uids))))
+        if columns is not None:
+            table = table.select([c for c in columns if c in table.column_names])
+        tables.append(table)
+    return _unify(tables)
+
+
+# -----------------------------------------------------------------------------
+# :author:    Pete R. Jemian
+# :email:     jemian@anl.gov
+# :copyright: (c) 2017-2024, UChicago Argonne, LLC
+#
+# Distributed under the terms of the Argonne National Laboratory Open Source License.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
@@ -0,0 +1,298 @@
+"""
+Local index of run metadata
++++++++++++++++++++++++++++++++++++++++
+
+.. autosummary::
+
+   ~RunMetadataIndex
+"""
+
+import json
+import logging
+import pathlib
+import sqlite3
+import threading
+
+import databroker.queries
+import mongoquery
+
+from .misc import json_default
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    uid TEXT PRIMARY KEY,
+    time REAL NOT NULL,
+    scan_id INTEGER,
+    plan_name TEXT,
+    start TEXT NOT NULL,
+    stop TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_time ON runs (time);
+CREATE INDEX IF NOT EXISTS runs_scan_id ON runs (scan_id);
+CREATE TABLE IF NOT EXISTS info (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class RunMetadataIndex:
+    """
+    Local (SQLite) index of the *start* & *stop* documents of a catalog.
+
+    Reading ``cat[uid].metadata`` from MongoDB takes 0.01 - 0.5 s per run.
+    A listing of hundreds of runs (or sorting by a key other than ``time``,
+    which reads every run) can take minutes.  This index keeps a copy of
+    the *start* and *stop* documents of each run, keyed by ``uid``.  Listings,
+    sorts, and searches are answered from the index.
+
+    The index is brought up to date by ``refresh()``, which reads only the
+    runs that started since the newest run in the index (and those runs in
+    the index that did not have a *stop* document yet).
+
+    PARAMETERS
+
+    cat
+        *object* :
+        Instance of databroker v1 or v2 catalog.
+    path
+        *str* :
+        Name of the SQLite file.  The index is kept between sessions in this
+        file.  (default: ``":memory:"``, only for this session)
+
+    EXAMPLE::
+
+        from apstools.utils import listruns
+        from apstools.utils import RunMetadataIndex
+
+        index = RunMetadataIndex(cat, "~/.cache/apstools/runs.sqlite")
+        listruns(cat, num=500, index=index)
+
+    ``listruns()``, ``ListRuns()``, ``summarize_runs()``, and
+    ``quantify_md_key_use()`` use an index given by their ``index`` keyword.
+
+    .. autosummary::
+
+       ~refresh
+       ~metadata
+       ~uids
+       ~find
+       ~runs
+       ~close
+
+    (new in release 1.6.21)
+    """
+
+    def __init__(self, cat, path=":memory:"):
+        self.cat = cat.v2
+        if path != ":memory:":
+            path = pathlib.Path(path).expanduser()
+            path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._check_catalog_name()
+
+    def __len__(self):
+        return self._execute("SELECT COUNT(*) FROM runs")[0][0]
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(catalog={self.cat.name!r}, path={str(self.path)!r}, runs={len(self)})"
+
+    def _execute(self, sql, parameters=()):
+        """Run a query, return all rows."""
+        with self._lock:
+            return self._db.execute(sql, parameters).fetchall()
+
+    def _check_catalog_name(self):
+        """An index file is for one catalog only."""
+        name = getattr(self.cat, "name", None) or ""
+        rows = self._execute("SELECT value FROM info WHERE key = 'catalog'")
+        if len(rows) == 0:
+            with self._lock, self._db:
+                self._db.execute("INSERT INTO info VALUES ('catalog', ?)", (name,))
+        elif rows[0][0] != name:
+            raise ValueError(f"Index {self.path} is for catalog {rows[0][0]!r}, not {name!r}.")
+
+    def refresh(self, full=False):
+        """
+        Add new runs to the index.  Return the number of runs added or updated.
+
+        Only runs that started since the newest run in the index are read
+        from the catalog, as well as the runs that had no *stop* document.
+        With ``full=True``, read all the runs of the catalog again.
+        """
+        newest = None if full else self._execute("SELECT MAX(time) FROM runs")[0][0]
+        known = set() if full else {row[0] for row in self._execute("SELECT uid FROM runs WHERE stop IS NOT NULL")}
+
+        cat = self.cat
+        if newest is not None:
+            cat = cat.search(databroker.queries.TimeRange(since=newest))
+        uids = [uid for uid in cat if uid not in known]
+        # also the runs in progress at the last refresh
+        in_progress = {row[0] for row in self._execute("SELECT uid FROM runs WHERE stop IS NULL")}
+        uids += sorted(in_progress.difference(uids))
+
+        rows = []
+        for uid in uids:
+            try:
+                md = self.cat[uid].metadata
+            except Exception as exc:
+                logger.warning("Could not read run %s: %s", uid, exc)
+                continue
+            rows.append(self._row(md))
+        if len(rows) > 0:
+            with self._lock, self._db:
+                self._db.executemany("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?)", rows)
+        logger.debug("Refreshed index %s: %d runs", self.path, len(rows))
+        return len(rows)
+
+    @staticmethod
+    def _row(md):
+        """Row of the runs table for this run's metadata."""
+        start = dict(md["start"])
+        stop = md.get("stop")
+        scan_id = start.get("scan_id")
+        return (
+            start["uid"],
+            start["time"],
+            scan_id if isinstance(scan_id, int) else None,
+            start.get("plan_name"),
+            json.dumps(start, default=json_default),
+            None if stop is None else json.dumps(dict(stop), default=json_default),
+        )
+
+    def metadata(self, uid):
+        """Return ``dict(start=..., stop=...)`` of this run, as ``run.metadata``."""
+        rows = self._execute("SELECT start, stop FROM runs WHERE uid = ?", (uid,))
+        if len(rows) == 0:
+            raise KeyError(uid)
+        start, stop = rows[0]
+        return dict(start=json.loads(start), stop=None if stop is None else json.loads(stop))
+
+    def runs(self, since=None, until=None, query=None, reverse=True):
+        """
+        Generator of ``(uid, metadata)`` of the runs, in time order.
+
+        Select runs that started between ``since`` and ``until`` (ISO8601
+        time or timestamp) and match the (mongo-style) ``query`` of the
+        *start* document.
+        """
+        sql = "SELECT uid, start, stop FROM runs"
+        conditions, parameters = self._time_range(since, until)
+        if len(conditions) > 0:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += f" ORDER BY time {'DESC' if reverse else 'ASC'}"
+        matcher = mongoquery.Query(query) if query else None
+        for uid, start, stop in self._execute(sql, parameters):
+            start = json.loads(start)
+            if matcher is not None and not matcher.match(start):
+                continue
+            yield uid, dict(start=start, stop=None if stop is None else json.loads(stop))
+
+    @staticmethod
+    def _time_range(since, until):
+        """SQL conditions for the time range."""
+        conditions, parameters = [], []
+        if since is not None or until is not None:
+            time_range = databroker.queries.TimeRange(since=since, until=until)
+            if time_range._since_normalized is not None:
+                conditions.append("time >= ?")
+                parameters.append(time_range._since_normalized)
+            if time_range._until_normalized is not None:
+                conditions.append("time < ?")
+                parameters.append(time_range._until_normalized)
+        return conditions, parameters
+
+    def uids(self, since=None, until=None, query=None, sortby="time", reverse=True, missing=""):
+        """
+        Return a list of run uids, sorted by ``sortby``.
+
+        ``sortby`` is found in the *start* (or, if not there, the *stop*)
+        document.  Runs without ``sortby`` are sorted by the ``missing`` value.
+        Runs with the same ``sortby`` value are in time order.
+        """
+        if query:
+            runs = list(self.runs(since=since, until=until, query=query, reverse=reverse))
+            if sortby == "time":
+                return [uid for uid, md in runs]
+
+            def value(md):
+                for doc in (md["start"], md["stop"]):
+                    if doc and sortby in doc:
+                        return doc[sortby] or missing
+                return missing
+
+            return [uid for uid, md in sorted(runs, key=lambda item: value(item[1]), reverse=reverse)]
+
+        conditions, parameters = self._time_range(since, until)
+        where = "" if len(conditions) == 0 else " WHERE " + " AND ".join(conditions)
+        if sortby == "time":
+            sql = f"SELECT uid FROM runs{where} ORDER BY time {'DESC' if reverse else 'ASC'}"
+            return [row[0] for row in self._execute(sql, parameters)]
+
+        # Only the sortby values are read from the index.
+        path = '$."' + sortby.replace('"', '\\"') + '"'
+        sql = (
+            "SELECT uid, json_type(start, ?), json_extract(start, ?), json_type(stop, ?), json_extract(stop, ?)"
+            f" FROM runs{where} ORDER BY time {'DESC' if reverse else 'ASC'}"
+        )
+        rows = self._execute(sql, [path] * 4 + parameters)
+
+        def value(row):
+            for kind, v in (row[1:3], row[3:5]):
+                if kind is not None:
+                    if kind in ("array", "object"):
+                        v = json.loads(v)
+                    return v or missing
+            return missing
+
+        return [row[0] for row in sorted(rows, key=value, reverse=reverse)]
+
+    def find(self, key, since=None, until=None, query=None):
+        """
+        Return the uid of the run identified by ``key``.
+
+        As for ``cat[key]``: a *str* is a (partial) ``uid``, a positive *int*
+        is a ``scan_id`` (the most recent run), and a negative *int* is an
+        offset (``-1`` is the most recent run).  Raise ``KeyError`` if not
+        found.
+        """
+        if isinstance(key, str):
+            uids = [u for u in self.uids(since=since, until=until, query=query) if u.startswith(key)]
+            if len(uids) == 1:
+                return uids[0]
+            if len(uids) > 1:
+                raise ValueError(f"uid {key!r} is ambiguous: {len(uids)} runs")
+        elif key < 0:
+            uids = self.uids(since=since, until=until, query=query)
+            if -key <= len(uids):
+                return uids[-key - 1]  # newest first
+        elif query or since or until:
+            for uid, md in self.runs(since=since, until=until, query=query):
+                if md["start"].get("scan_id") == key:
+                    return uid
+        else:
+            rows = self._execute("SELECT uid FROM runs WHERE scan_id = ? ORDER BY time DESC LIMIT 1", (key,))
+            if len(rows) > 0:
+                return rows[0][0]
+        raise KeyError(key)
+
+    def close(self):
+        """Close the index file."""
+        with self._lock:
+            self._db.close()
+
+
+# -----------------------------------------------------------------------------
+# :author:    Pete R. Jemian
+# :email:     jemian@anl.gov
+# :copyright: (c) 2017-2024, UChicago Argonne, LLC
+#
+# Distributed under the terms of the Argonne National Laboratory Open Source License.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
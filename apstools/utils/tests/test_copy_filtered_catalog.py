@@ -0,0 +1,115 @@
+"""
+unit tests for copy_filtered_catalog()
+"""
+
+import collections
+
+import databroker
+import event_model
+import pytest
+from databroker._drivers.msgpack import BlueskyMsgpackCatalog
+
+from ..catalog import _batched_documents
+from ..catalog import copy_filtered_catalog
+
+SOURCE_CATALOG_NAME = "usaxs_test"
+
+
+def count_documents(run):
+    """Count the documents (each row of a page) by name."""
+    counts = collections.Counter()
+    for name, doc in run.documents(fill="no"):
+        name = name.replace("_page", "")
+        counts[name] += len(doc["seq_num" if name == "event" else "datum_id"]) if "_page" in name else 1
+    return counts
+
+
+def test_batched_documents():
+    run = event_model.compose_run()
+    stream = run.compose_descriptor(name="primary", data_keys=dict(x=dict(source="x", dtype="number", shape=[])))
+    events = [stream.compose_event(data=dict(x=i), timestamps=dict(x=0)) for i in range(7)]
+    documents = [
+        ("start", run.start_doc),
+        ("descriptor", stream.descriptor_doc),
+        ("event", events[0]),
+        ("event_page", event_model.pack_event_page(*events[1:4])),
+        ("event", events[4]),
+        ("event_page", event_model.pack_event_page(*events[5:])),
+        ("stop", run.compose_stop()),
+    ]
+    batched = list(_batched_documents(documents, 3))
+    assert [name for name, doc in batched] == "start descriptor event_page event_page event_page stop".split()
+    assert [doc["seq_num"] for name, doc in batched[2:5]] == [[1, 2, 3], [4, 5, 6], [7]]
+    assert sum([doc["data"]["x"] for name, doc in batched[2:5]], []) == list(range(7))
+
+
+def test_copy_filtered_catalog(tmp_path):
+    source = databroker.catalog[SOURCE_CATALOG_NAME]
+    target = BlueskyMsgpackCatalog(str(tmp_path / "*.msgpack"))
+    checkpoint = tmp_path / "copied.txt"
+    query = dict(plan_name={"$ne": "snapshot"})
+    num_runs = len(source.v2.search(query))
+
+    estimate = copy_filtered_catalog(source, target, query=query, dry_run=True)
+    assert estimate["runs"] == num_runs
+    assert len(target) == 0
+
+    summary = copy_filtered_catalog(source, target, query=query, checkpoint=checkpoint, batch_size=50)
+    assert summary["runs"] == num_runs
+    assert summary["documents"] >= estimate["documents"]
+    assert len(target) == num_runs
+    assert len(checkpoint.read_text().split()) == num_runs
+    for uid in source.v2.search(query):
+        assert count_documents(target.v2[uid]) == count_documents(source.v2[uid])
+
+    # resume: all these runs were copied already
+    summary = copy_filtered_catalog(source, target, checkpoint=checkpoint)
+    assert summary["skipped"] == num_runs
+    assert summary["runs"] == len(source) - num_runs
+    assert len(target) == len(source)
+
+
+def test_copy_filtered_catalog_failure(tmp_path):
+    source = databroker.catalog[SOURCE_CATALOG_NAME]
+
+    class NoSerializer:
+        v2 = None
+
+    target = NoSerializer()
+    target.v2 = target
+    with pytest.raises(RuntimeError) as exinfo:
+        copy_filtered_catalog(source, target, query=dict(plan_name="snapshot"))
+    assert "Could not copy 1 run(s)" in str(exinfo.value)
+
+
+def test_copy_filtered_catalog_resume_partial_run(tmp_path):
+    source = databroker.catalog[SOURCE_CATALOG_NAME]
+    target = BlueskyMsgpackCatalog(str(tmp_path / "*.msgpack"))
+    checkpoint = tmp_path / "copied.txt"
+    query = dict(plan_name="tune_mr")
+    uid = list(source.v2.search(query))[0]
+
+    serializer = target._get_serializer
+
+    def interrupted():
+        router = serializer()
+
+        def receiver(name, doc):
+            if name == "event_page":
+                raise ConnectionError("copy interrupted")  # after start & descriptor
+            router(name, doc)
+
+        return receiver
+
+    target._get_serializer = interrupted
+    with pytest.raises(RuntimeError):
+        copy_filtered_catalog(source, target, query=query, checkpoint=checkpoint)
+    assert (tmp_path / f"{uid}.msgpack").exists()  # partial copy
+    assert not checkpoint.exists()
+
+    target._get_serializer = serializer
+    summary = copy_filtered_catalog(source, target, query=query, checkpoint=checkpoint)
+    assert summary["runs"] == 1
+    assert checkpoint.read_text().split() == [uid]
+    target.force_reload()
+    assert count_documents(target.v2[uid]) == count_documents(source.v2[uid])
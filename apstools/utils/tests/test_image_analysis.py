@@ -1,7 +1,15 @@
+import logging
+import time
+
+import numpy
+import pysumreg
 import pytest
 
 from ..image_analysis import analyze_1D
 from ..image_analysis import analyze_2D
+from ..image_analysis import image_statistics
+
+logger = logging.getLogger(__name__)
 
 
 @pytest.mark.parametrize(
@@ -150,3 +158,83 @@ def test_analyze_2D(data, expected, ndigits):
             compare_tuples(results[k], expected[k], f"{k=} {results=}")
         else:
             assert round(results[k], ndigits) == round(expected[k], ndigits), results
+
+
+def test_image_statistics():
+    image = [
+        [0, 1, 2, 1, 0],
+        [1, 2, 3, 2, 1],
+        [2, 3, 4, 10, 2],
+        [1, 2, 3, 2, 1],
+    ]
+    results = image_statistics(image, rois=dict(peak=(3, 2, 1, 1), corner=(0, 0, 2, 2)))
+    expected = analyze_2D(image)
+    for k in "n peak_position max_y".split():
+        assert results[k] == expected[k], k
+    for k in "centroid sigma".split():
+        assert results[k] == pytest.approx(expected[k]), k
+    assert results["total"] == 43
+    assert results["roi_sums"] == dict(peak=10, corner=4)
+
+    results = image_statistics([[0, 0], [0, 0]])
+    assert results["centroid"] == (None, None)
+
+    # peak from the row & column sums, as analyze_2D (not the brightest pixel)
+    image = numpy.zeros((4, 5))
+    image[0, 4] = 9
+    image[3, 0:3] = 5
+    results = image_statistics(image)
+    expected = analyze_2D(image)
+    for k in "n peak_position max_y centroid sigma".split():
+        assert results[k] == expected[k], k
+
+    with pytest.raises(ValueError):
+        image_statistics([1, 2, 3])
+
+
+def test_analyze_stacks():
+    rng = numpy.random.default_rng(1234)
+    stack = rng.integers(0, 100, size=(4, 6, 9))
+    results = analyze_2D(stack)
+    assert isinstance(results, list)
+    assert results == [analyze_2D(frame) for frame in stack]
+
+    results = analyze_1D(stack[0], x_arr=numpy.linspace(-1, 1, 9))
+    assert len(results) == 6
+    assert results[2] == analyze_1D(stack[0][2], x_arr=numpy.linspace(-1, 1, 9))
+
+    with pytest.raises(ValueError):
+        analyze_1D(stack)
+    with pytest.raises(ValueError):
+        analyze_2D(stack[0][0])
+
+
+def pysumreg_analyze_1D(y_arr, x_arr):
+    """The implementation of analyze_1D() before release 1.6.21."""
+    regs = pysumreg.SummationRegisters()
+    for u, v in zip(x_arr, y_arr):
+        regs.add(u, v)
+    return regs.to_dict(use_registers=True)
+
+
+@pytest.mark.parametrize("num", [3, 4096, 100_000])
+def test_analyze_1D_benchmark(num):
+    rng = numpy.random.default_rng(1234)
+    x_arr = numpy.linspace(-2, 2, num)
+    y_arr = 1000 * numpy.exp(-(x_arr**2)) + rng.uniform(0, 10, num)
+    # zeros are a special case for the extrema
+    y_arr[num // 3] = 0
+    x_arr[num // 2] = 0
+
+    def timed(function, y, x):
+        t0 = time.perf_counter()
+        result = function(y, x)
+        return time.perf_counter() - t0, result
+
+    t_reference, expected = timed(pysumreg_analyze_1D, y_arr.tolist(), x_arr.tolist())
+    t_numpy, results = timed(analyze_1D, y_arr, x_arr)
+    assert results.keys() == expected.keys()
+    for k, v in expected.items():
+        assert results[k] == pytest.approx(v, rel=1e-9, abs=1e-9), k
+    # Timing depends on the machine (and its load): report, do not assert.
+    logger.info("analyze_1D(%d points): numpy %.6f s, pysumreg %.6f s", num, t_numpy, t_reference)
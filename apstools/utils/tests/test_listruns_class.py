@@ -377,3 +377,39 @@ def test_ListRuns_ids(ids, nresults, lr):
     dd = lr.parse_runs()
     assert len(dd["time"]) == nresults
 # fmt: on
+
+
+# fmt: off
+@pytest.mark.parametrize(
+    "options",
+    [
+        dict(num=5),
+        dict(num=100, reverse=False),
+        dict(num=100, sortby="scan_id"),
+        dict(ids=[-2, 131, "3e89a", 1234567]),
+        dict(num=10, keys="scan_id stop.exit_status plan_name".split()),
+    ],
+)
+@pytest.mark.parametrize("metadata_only", [False, True])
+@pytest.mark.parametrize("prefetch", [1, 4, 64])
+def test_ListRuns_prefetch(prefetch, metadata_only, options, cat):
+    expected = utils.ListRuns(cat=cat, prefetch=0, **options).parse_runs()
+    lr = utils.ListRuns(cat=cat, prefetch=prefetch, metadata_only=metadata_only, **options)
+    assert lr.parse_runs() == expected
+# fmt: on
+
+
+def test_ListRuns_prefetch_limit(cat):
+    # Not a MongoDB catalog: sorting reads all runs, so select by ids.
+    lr = utils.ListRuns(cat=cat, num=3, prefetch=8, ids=list(range(-1, -11, -1)))
+    fetched = []
+    get_metadata = lr._get_metadata
+
+    def spy(cat, uid):
+        fetched.append(uid)
+        return get_metadata(cat, uid)
+
+    lr._get_metadata = spy
+    dd = lr.parse_runs()
+    assert len(dd["time"]) == 3
+    assert len(fetched) == 3  # no more than num runs are read
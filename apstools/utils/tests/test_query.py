@@ -0,0 +1,104 @@
+"""
+unit tests for counting metadata values in a catalog
+"""
+
+import databroker
+import pytest
+
+from ..catalog import quantify_md_key_use
+from ..list_runs import summarize_runs
+from ..query import _count_key_values
+from ..query import _count_values
+
+TEST_CATALOG_NAME = "apstools_test"
+
+
+@pytest.fixture(scope="module")
+def cat():
+    return databroker.catalog[TEST_CATALOG_NAME]
+
+
+def test_count_values():
+    docs = [
+        dict(plan_name="scan", detectors=["a"]),
+        dict(plan_name="count", detectors=["a", "b"]),
+        dict(plan_name="scan", detectors=["a"]),
+        dict(detectors=None),
+    ]
+    assert _count_values(docs, "plan_name") == [("scan", 2), ("count", 1)]
+    assert _count_values(docs, "plan_name", missing="unknown", count_missing=True) == [
+        ("scan", 2),
+        ("count", 1),
+        ("unknown", 1),
+    ]
+    assert _count_values(docs, "detectors") == [(["a"], 2), (["a", "b"], 1), (None, 1)]
+    assert _count_values(docs, "no such key") == []
+
+
+@pytest.mark.parametrize("key", "plan_name detectors scan_id".split())
+def test_count_key_values(key, cat):
+    counts = _count_key_values(cat, key)
+    expected = {}
+    for uid in cat.v2:
+        start = cat.v2[uid].metadata["start"]
+        if key in start:
+            value = start[key]
+            value = tuple(value) if isinstance(value, list) else value
+            expected[value] = expected.get(value, 0) + 1
+    received = {(tuple(v) if isinstance(v, list) else v): n for v, n in counts}
+    assert received == expected
+
+    counts = _count_key_values(cat.v2.search(dict(plan_name="count")), "plan_name")
+    assert counts == [("count", 26)]
+
+
+class FakeCollection:
+    """Record the aggregation pipeline (as MongoDB would receive it)."""
+
+    def __init__(self, results):
+        self.pipelines = []
+        self.results = results
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        return iter(self.results)
+
+
+class FakeMongoCatalog:
+    """Only the parts of a MongoDB catalog used for aggregation."""
+
+    def __init__(self, results, query=None):
+        self._query = query or {}
+        self._run_start_collection = FakeCollection(results)
+        self.v2 = self
+
+
+def test_count_key_values_mongo():
+    cat = FakeMongoCatalog([dict(_id="scan", count=5), dict(_id="count", count=2)], query=dict(owner="me"))
+    assert _count_key_values(cat, "plan_name") == [("scan", 5), ("count", 2)]
+    pipeline = cat._run_start_collection.pipelines[-1]
+    assert pipeline == [
+        {"$match": {"$and": [dict(owner="me"), {"plan_name": {"$exists": True}}]}},
+        {"$group": {"_id": "$plan_name", "count": {"$sum": 1}}},
+    ]
+
+    _count_key_values(cat, "plan_name", missing="unknown", count_missing=True)
+    pipeline = cat._run_start_collection.pipelines[-1]
+    assert pipeline[0] == {"$match": dict(owner="me")}
+    assert pipeline[1]["$group"]["_id"]["$cond"][1] == {"$literal": "unknown"}
+
+
+def test_summarize_runs(cat, capsys):
+    summarize_runs(db=cat)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[1].split() == ["plan", "quantity"]
+    table = dict(line.split() for line in lines[3:-1] if not line.startswith("="))
+    assert table["TOTAL"] == str(len(cat))
+    assert table["scan"] == "27"
+    assert table["count"] == "26"
+
+
+def test_quantify_md_key_use(cat, capsys):
+    quantify_md_key_use(key="plan_name", db=cat, query=dict(plan_name="count"))
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[3].split() == ["count", "26"]
@@ -0,0 +1,119 @@
+"""
+Test the export of runs to columnar files.
+"""
+
+import json
+
+import databroker
+import pytest
+
+from .. import export_runs
+from .. import read_exported_runs
+
+pytest.importorskip("pyarrow")
+
+CATALOG = "usaxs_test"
+
+
+@pytest.fixture(scope="function")
+def cat():
+    return databroker.catalog[CATALOG]
+
+
+@pytest.mark.parametrize("format", ["parquet", "arrow"])
+@pytest.mark.parametrize("partition_by", [None, "date", "plan_name"])
+def test_export_runs(format, partition_by, cat, tmp_path):
+    summary = export_runs(cat, tmp_path, partition_by=partition_by, format=format, batch_size=3)
+    assert summary["exported"] + summary["in_progress"] + summary["failed"] == len(cat)
+    assert summary["exported"] > 0
+    assert summary["skipped"] == 0
+
+    runs = read_exported_runs(tmp_path).to_pandas()
+    assert len(runs) == summary["exported"]
+    state = json.loads((tmp_path / "export.json").read_text())
+    assert state["since"] == runs["time"].max()
+    assert state["uids"] == {row.uid: row.time for row in runs.itertuples() if row.time == state["since"]}
+    for row in runs.itertuples():
+        md = cat.v2[row.uid].metadata
+        assert row.scan_id == md["start"]["scan_id"]
+        assert row.plan_name == md["start"].get("plan_name")
+        assert json.loads(row.start)["uid"] == row.uid
+
+    # stream tables match the catalog
+    uid = runs["uid"].iloc[0]
+    h = cat.v1[uid]
+    for stream in h.stream_names:
+        table = read_exported_runs(tmp_path, stream, uids=[uid]).to_pandas()
+        expected = h.table(stream).reset_index()
+        assert len(table) == len(expected)
+        assert set(table["uid"]) == {uid}
+        assert list(table["seq_num"]) == list(expected["seq_num"])
+        for column in expected.columns:
+            assert column in table.columns
+
+    # all runs of a stream, only some columns
+    primary = read_exported_runs(tmp_path, "primary", columns=["uid", "seq_num", "time"])
+    assert primary.column_names == ["uid", "seq_num", "time"]
+    assert set(primary.column("uid").to_pylist()).issubset(set(runs["uid"]))
+
+    # partitions
+    if partition_by is not None:
+        value = str(runs[partition_by].iloc[0])
+        selected = read_exported_runs(tmp_path, partitions=[value]).to_pandas()
+        assert set(selected[partition_by]) == {value}
+        assert 0 < len(selected) <= len(runs)
+
+
+def test_export_runs_incremental(cat, tmp_path):
+    uids = sorted(cat.v2, key=lambda uid: cat.v2[uid].metadata["start"]["time"])
+    until = cat.v2[uids[-4]].metadata["start"]["time"]
+    first = export_runs(cat, tmp_path, until=until)
+    assert first["exported"] == len(uids) - 4
+    assert len(read_exported_runs(tmp_path)) == first["exported"]
+
+    second = export_runs(cat, tmp_path)
+    assert second["exported"] == 4
+    assert second["skipped"] >= 1  # the newest run of the first export
+    runs = read_exported_runs(tmp_path).to_pandas()
+    assert sorted(runs["uid"]) == sorted(uids)
+
+    third = export_runs(cat, tmp_path)
+    assert third["exported"] == 0
+    assert len(read_exported_runs(tmp_path)) == len(uids)
+    state = json.loads((tmp_path / "export.json").read_text())
+    assert list(state["uids"]) == [uids[-1]]  # only the runs at the "since" time
+
+    selected = read_exported_runs(tmp_path, uids=uids[:2], columns=["scan_id"])
+    assert selected.column_names == ["scan_id"]
+    assert len(selected) == 2
+
+    with pytest.raises(ValueError, match="format"):
+        export_runs(cat, tmp_path, format="arrow")
+    with pytest.raises(ValueError, match="Unknown"):
+        export_runs(cat, tmp_path / "other", format="csv")
+
+
+def test_export_runs_interrupted(cat, tmp_path, monkeypatch):
+    from .. import run_export
+
+    written = []
+    write_table = run_export._write_table
+
+    def interrupt(table, fname, *args):
+        if len(written) == 8:
+            raise KeyboardInterrupt
+        written.append(fname)
+        write_table(table, fname, *args)
+
+    monkeypatch.setattr(run_export, "_write_table", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        export_runs(cat, tmp_path, batch_size=2)
+    state = json.loads((tmp_path / "export.json").read_text())
+    assert 0 < len(state["uids"]) < len(cat)
+    assert state["since"] is None  # not advanced before the search is complete
+
+    monkeypatch.setattr(run_export, "_write_table", write_table)
+    summary = export_runs(cat, tmp_path)
+    assert summary["skipped"] == len(state["uids"])
+    runs = read_exported_runs(tmp_path).to_pandas()
+    assert sorted(runs["uid"]) == sorted(cat.v2)
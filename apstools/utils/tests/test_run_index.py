@@ -0,0 +1,120 @@
+"""
+unit tests for the local index of run metadata
+"""
+
+import databroker
+import pytest
+
+from ... import utils
+from ..catalog import quantify_md_key_use
+from ..run_index import RunMetadataIndex
+
+TEST_CATALOG_NAME = "apstools_test"
+
+
+@pytest.fixture(scope="module")
+def cat():
+    return databroker.catalog[TEST_CATALOG_NAME]
+
+
+@pytest.fixture(scope="module")
+def index(cat):
+    index = RunMetadataIndex(cat)
+    assert index.refresh() == len(cat)
+    return index
+
+
+def test_refresh(cat, tmp_path):
+    path = tmp_path / "runs.sqlite"
+    index = RunMetadataIndex(cat, path)
+    assert len(index) == 0
+    assert index.refresh() == len(cat)
+    assert len(index) == len(cat)
+    # Only the newest run (and any without a stop document) are read again.
+    assert index.refresh() <= 2
+    index.close()
+
+    # persistent
+    index = RunMetadataIndex(cat, path)
+    assert len(index) == len(cat)
+    assert index.refresh(full=True) == len(cat)
+    index.close()
+
+    with pytest.raises(ValueError) as exinfo:
+        RunMetadataIndex(databroker.catalog["usaxs_test"], path)
+    assert "is for catalog 'apstools_test'" in str(exinfo.value)
+
+
+def test_metadata(cat, index):
+    uid = list(cat.v2)[0]
+    md = index.metadata(uid)
+    assert md["start"] == dict(cat.v2[uid].metadata["start"])
+    assert md["start"]["uid"] == uid
+    with pytest.raises(KeyError):
+        index.metadata("no such uid")
+
+
+# fmt: off
+@pytest.mark.parametrize(
+    "options",
+    [
+        dict(),
+        dict(num=100),
+        dict(num=100, reverse=False),
+        dict(num=100, query=dict(plan_name="count")),
+        dict(num=100, query=dict(scan_id={"$gte": 100})),
+        dict(num=100, since="2020-12-20", until="2021-01-10"),
+        dict(num=100, sortby="uid", keys="time uid".split()),
+        dict(num=100, sortby="scan_id", reverse=False),
+        dict(num=100, sortby="motive", keys="scan_id motive purpose exit_status".split()),
+        dict(num=100, keys="scan_id start.time stop.time stop.exit_status detectors".split()),
+        dict(ids=[130, 131, 132]),
+        dict(ids=[1234]),
+        dict(ids=["bb7e0"]),
+        dict(ids=[-2, -4, -10, -8]),
+        dict(ids=[-2, 131, "3e89a", 1234567, "1234567"]),
+    ],
+)
+def test_ListRuns(options, cat, index):
+    expected = utils.ListRuns(cat=cat, **options).parse_runs()
+    received = utils.ListRuns(cat=cat, index=index, **options).parse_runs()
+    sortby = options.get("sortby", "time")
+    if sortby == "time":
+        assert received == expected
+    else:
+        # Order of runs with the same sortby value depends on the catalog.
+        assert received[sortby] == expected[sortby]
+        assert sorted(zip(*received.values())) == sorted(zip(*expected.values()))
+# fmt: on
+
+
+def test_listruns(cat, tmp_path):
+    path = tmp_path / "runs.sqlite"
+    expected = utils.listruns(cat=cat, num=30, table_style=utils.TableStyle.pandas)
+    received = utils.listruns(cat=cat, num=30, index=path, table_style=utils.TableStyle.pandas)
+    assert received.equals(expected)
+    assert path.exists()
+
+
+def test_summarize_runs(cat, index, capsys):
+    utils.summarize_runs(db=cat)
+    expected = capsys.readouterr().out
+    utils.summarize_runs(index=index)
+    assert capsys.readouterr().out == expected
+
+
+@pytest.mark.parametrize("key", "plan_name detectors scan_id".split())
+def test_quantify_md_key_use(key, cat, index, capsys):
+    quantify_md_key_use(key=key, db=cat)
+    expected = capsys.readouterr().out
+    quantify_md_key_use(key=key, index=index)
+    assert capsys.readouterr().out == expected
+
+
+def test_quantify_md_key_use_list_values(index, capsys):
+    # list values (such as detectors) are counted, too
+    quantify_md_key_use(key="detectors", index=index)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[1].split() == ["detectors", "#runs"]
+    table = {line.rsplit(maxsplit=1)[0]: int(line.split()[-1]) for line in lines[3:-2]}
+    assert table["['noisy_det']"] > 0
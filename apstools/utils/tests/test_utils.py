@@ -2,6 +2,7 @@
 simple unit tests for this package.
 """
 
+import json
 import time
 import uuid
 
@@ -73,6 +74,12 @@ def test_utils_itemizer():
     assert received == expected
 
 
+def test_utils_json_default():
+    doc = dict(a=np.arange(3), b=np.float32(1.5), c=np.int64(2), d=uuid.UUID(int=0))
+    received = json.loads(json.dumps(doc, default=utils.json_default))
+    assert received == dict(a=[0, 1, 2], b=1.5, c=2, d=str(uuid.UUID(int=0)))
+
+
 def test_utils_print_RE_md(capsys):
     global RE
     md = {}
@@ -312,6 +319,67 @@ def test_replay(run_type, ref, scan_ids, cat):
     assert len(replies) == n_items
 
 
+@pytest.mark.parametrize("prefetch, batch_size", [[0, None], [5, None], [0, 3], [100, 1000]])
+def test_replay_pipelined(prefetch, batch_size, cat):
+    serial = []
+    utils.replay(cat.v1[-3:], lambda key, doc: serial.append((key, doc)))
+
+    replies = []
+    stats = utils.replay(
+        cat.v1[-3:],
+        lambda key, doc: replies.append((key, doc)),
+        prefetch=prefetch,
+        batch_size=batch_size,
+    )
+    assert stats["runs"] == 3
+    assert stats["documents"] == len(replies)
+    assert stats["docs_per_s"] > 0
+
+    events = [doc for key, doc in serial if key == "event"]
+    assert stats["events"] == len(events)
+    if batch_size is None:
+        assert [key for key, doc in replies] == [key for key, doc in serial]
+    else:
+        assert "event" not in [key for key, doc in replies]
+        pages = [doc for key, doc in replies if key == "event_page"]
+        assert max(len(page["seq_num"]) for page in pages) <= batch_size
+        rows = [uid for page in pages for uid in page["uid"]]
+        assert rows == [doc["uid"] for doc in events]
+        other = [(key, doc["uid"]) for key, doc in serial if key != "event" and "uid" in doc]
+        assert other == [(key, doc["uid"]) for key, doc in replies if key != "event_page" and "uid" in doc]
+
+
+def test_replay_pipelined_errors(cat):
+    from ..misc import _prefetched
+
+    def callback(key, doc):
+        if key == "descriptor":
+            raise RuntimeError("callback failed")
+
+    with pytest.raises(RuntimeError, match="callback failed"):
+        utils.replay(cat.v1[-3:], callback, prefetch=2)
+
+    def documents():
+        yield "start", {}
+        raise ValueError("reader failed")
+
+    received = []
+    with pytest.raises(ValueError, match="reader failed"):
+        for item in _prefetched(documents(), 2):
+            received.append(item)
+    assert received == [("start", {})]
+
+    class Interrupted(BaseException):
+        pass
+
+    def interrupted():
+        yield "start", {}
+        raise Interrupted()  # not an Exception, such as KeyboardInterrupt
+
+    with pytest.raises(Interrupted):
+        list(_prefetched(interrupted(), 2))
+
+
 # fmt:off
 @pytest.mark.parametrize(
     "scan_id, stream, total_keys, key, v1, m3, m_default, m_strict, m_lower",
@@ -426,6 +494,91 @@ def test_utils_getRunDataValue(scan_id, stream, key, idx, v1, expected, prec, ca
             assert round(v, prec) == e
 # fmt: on
 
+def test_utils_run_data_cache(cat):
+    cache = utils.run_data_cache
+    cache.clear()
+    hits = cache.hits
+
+    uid = cat.v2[103].metadata["start"]["uid"]
+    v0 = utils.getRunDataValue(103, "a_stage_r", db=cat, idx=0, use_v1=False)
+    assert len(cache) == 1
+    assert (cat.name, uid, "primary", "v2", ("a_stage_r",)) in cache
+    assert utils.getRunDataValue(uid, "a_stage_r", db=cat, idx=0, use_v1=False) == v0
+    assert cache.hits == hits + 1
+    assert len(cache) == 1
+
+    # all columns
+    assert "a_stage_r_user_setpoint" in utils.listRunKeys(103, db=cat, use_v1=False)
+    assert (cat.name, uid, "primary", "v2", None) in cache
+    assert len(cache) == 2
+    # projected from the full table
+    hits = cache.hits
+    assert utils.getRunDataValue(103, "a_stage_r_user_setpoint", db=cat, idx=0, use_v1=False) is not None
+    assert cache.hits == hits + 1
+    assert len(cache) == 2
+
+    # getRunData() returns a copy, changes do not reach the cache
+    table = utils.getRunData(103, db=cat, use_v1=False)
+    table["a_stage_r"] = 0
+    assert utils.getRunDataValue(103, "a_stage_r", db=cat, idx=0, use_v1=False) == v0
+
+    # v1 API is cached separately
+    utils.getRunData(103, db=cat, use_v1=True)
+    assert len(cache) == 3
+    assert cache.nbytes > 0
+
+    cache.invalidate(uid)
+    assert len(cache) == 0
+    assert cache.nbytes == 0
+
+
+def test_utils_column_projection(cat):
+    cache = utils.run_data_cache
+    cache.clear()
+    projected = utils.getStreamValues(103, key_fragment="undulator", db=cat)
+    keys = [k[-1] for k in cache._tables]
+    assert len(keys) == 1
+    assert 0 < len(keys[0]) < 100  # only some of the 268 columns were read
+
+    cache.clear()
+    utils.getRunData(103, db=cat, stream="baseline")  # all columns
+    expected = utils.getStreamValues(103, key_fragment="undulator", db=cat)
+    assert projected.equals(expected)
+    cache.clear()
+
+
+@pytest.mark.parametrize("v1", [True, False])
+def test_utils_getRunDataValue_projection(v1, cat):
+    cache = utils.run_data_cache
+    cache.clear()
+    value = utils.getRunDataValue(103, "a_stage_r", db=cat, idx="all", use_v1=v1)
+    assert [k[-1] for k in cache._tables] == [("a_stage_r",)]
+    table = utils.getRunData(103, db=cat, use_v1=v1)  # all columns
+    assert value.tolist() == table["a_stage_r"].tolist()
+    cache.clear()
+
+
+def test_utils_run_data_cache_eviction(cat):
+    cache = utils.RunDataCache(max_bytes=1000)
+    table = utils.getRunData(103, db=cat, use_v1=False)
+    nbytes = int(table.memory_usage(deep=True).sum())
+    cache.max_bytes = int(2.5 * nbytes)
+    for i in range(3):
+        cache.put((cat.name, f"uid{i}", "primary", "v2", None), table)
+    assert len(cache) == 2
+    assert (cat.name, "uid0", "primary", "v2", None) not in cache  # least recently used
+    assert cache.get((cat.name, "uid1", "primary", "v2", None)) is table
+    cache.put((cat.name, "uid3", "primary", "v2", None), table)
+    assert (cat.name, "uid1", "primary", "v2", None) in cache
+    assert (cat.name, "uid2", "primary", "v2", None) not in cache
+
+    cache.max_bytes = 0  # disabled
+    cache.clear()
+    cache.put((cat.name, "uid4", "primary", "v2", None), table)
+    assert len(cache) == 0
+    assert cache.get((cat.name, "uid4", "primary", "v2", None)) is None
+
+
 # # fmt: off
 # @pytest.mark.parametrize(
 #     "scan_id, stream, key, idx, expected, prec",